@@ -1,16 +1,24 @@
 """Command-line interface definition for managing the database in the project from an
 admin perspective.
 
-Entries can be added, removed, or multi-added from the CLI.
+Entries can be added, removed, or multi-added from the CLI, Land Registry Price Paid
+CSV files can be ingested into the local transactions table, and CSV or NDJSON files of
+postcodes can be geocoded through the running API.
 """
 
 import argparse
+import json
+import sys
 import requests
 import pandas as pd
 from sqlalchemy.orm import Session
-from sqlalchemy import Connection, create_engine
-from app.models.postcodes import Postcodes
+from sqlalchemy import Connection, make_url
+from app.models.transactions import Transactions, TransactionFetches
+from app.db.base import Base
+from app.db.session import make_engine
+from app.core.config import config
 from app.const import LOCALHOST, URL_SEARCH
+from app.services import gazetteer, pricepaid
 
 # ---------------------------------------------------------------------------- #
 #  _____                            ____        _
@@ -43,6 +51,36 @@ parser.add_argument(
     help="option to delete a db entry",
     action="store_true",
 )
+parser.add_argument(
+    "--bulk-load",
+    dest="bulk_load",
+    help="option to replace the postcodes table from a gazetteer CSV",
+    action="store_true",
+)
+parser.add_argument(
+    "--ingest-prices",
+    dest="ingest_prices",
+    help="option to load a yearly or monthly Price Paid CSV into the local db",
+    action="store_true",
+)
+parser.add_argument(
+    "--apply-changes",
+    dest="apply_changes",
+    help="option to add, move and terminate the postcodes listed in a CSV file at once",
+    action="store_true",
+)
+parser.add_argument(
+    "--dry-run",
+    dest="dry_run",
+    help="only count the changes --apply-changes would make",
+    action="store_true",
+)
+parser.add_argument(
+    "--geocode",
+    dest="geocode",
+    help="option to add coordinates to every row of a CSV or NDJSON file",
+    action="store_true",
+)
 # ------------------------------ Key-value args ------------------------------ #
 parser.add_argument(
     "--postcode",
@@ -104,6 +142,39 @@ parser.add_argument(
     action="store",
     type=float,
 )
+parser.add_argument(
+    "--file",
+    dest="file",
+    help="path to the CSV file to load or ingest",
+    action="store",
+)
+parser.add_argument(
+    "--chunksize",
+    dest="chunksize",
+    help="rows read and written at a time when ingesting",
+    action="store",
+    type=int,
+    default=100_000,
+)
+parser.add_argument(
+    "--output",
+    dest="output",
+    help="path to write the geocoded file to, stdout if not given",
+    action="store",
+)
+parser.add_argument(
+    "--unmatched",
+    dest="unmatched",
+    help="path to write the report of unmatched rows to when geocoding",
+    action="store",
+)
+parser.add_argument(
+    "--column",
+    dest="column",
+    help="column or key holding the postcode when geocoding",
+    action="store",
+    default="postcode",
+)
 # Parse arguments
 args = parser.parse_args()
 
@@ -154,42 +225,88 @@ def get(args) -> None:
     print(response.content)
 
 
-def create_multiple() -> None:
-    """Pass in a dictionary of lists, where each entry is a dictionary of the
-    following:
-        - Postcode
-        - latitude
-        - longitude
+def create_multiple(args) -> None:
+    """Load the full postcode gazetteer from a CSV of postcode, latitude and longitude,
+    replacing the postcodes table.
 
     Large-scale additions like this are not done through queries and are done by
-    developer directly on db.
+    developer directly on db. Rows are bulk-inserted into a staging table, indexed, and
+    swapped in atomically, so the live table is never seen half-filled.
+    """
+    data = gazetteer.read_gazetteer(args.file or "_cache/ukpostcodes.csv.zip")
+    database = make_url(config.database.dsn).database
+    print(gazetteer.bulk_load(database, data))
+
+
+def ingest_prices(args) -> None:
+    """Stream a Price Paid CSV file into the local transactions table.
+
+    Monthly update files are applied incrementally: additions and changes are upserted
+    and deletions removed, so a refresh never needs a full reload.
     """
-    data = pd.read_csv("_cache/ukpostcodes.csv.zip", compression="zip")
-    codes = data["postcode"].values
-    district = data["postcode"].apply(lambda x: x.split(" ")[0]).values
-    sub = data["postcode"].apply(lambda x: x.split(" ")[0][:2]).values
-    lats = data["latitude"].values
-    lons = data["longitude"].values
-
-    engine = create_engine("sqlite:///data/postcodes.db")
+    engine = make_engine(read_only=False)
+    Base.metadata.create_all(
+        bind=engine, tables=[Transactions.__table__, TransactionFetches.__table__]
+    )
     with Session(engine) as session:
-        for chunk in range(0, len(codes), 1000):
-            session.add_all(
-                [
-                    Postcodes(
-                        **{
-                            "full_postcode": codes[i],
-                            "district_postcode": district[i],
-                            "subarea_postcode": sub[i],
-                            "latitude": lats[i],
-                            "longitude": lons[i],
-                        }
-                    )
-                    for i in range(chunk, min(chunk + 1000, len(codes)))
-                ]
-            )
-            session.commit()
-            print(chunk / len(codes) * 100)
+        print(pricepaid.ingest_csv(session, args.file, args.chunksize))
+
+
+def apply_changes(args) -> None:
+    """Apply a CSV of postcode changes through the bulk endpoint in one transaction.
+
+    The file has postcode, lat and lon columns. Rows with coordinates add or move their
+    postcode and rows without them terminate it.
+    """
+    data = pd.read_csv(args.file, dtype={"postcode": str})
+    terminated = data["lat"].isna() | data["lon"].isna()
+    changes = {
+        "upserts": data.loc[~terminated, ["postcode", "lat", "lon"]].to_dict("records"),
+        "deletes": list(data.loc[terminated, "postcode"]),
+        "dry_run": args.dry_run,
+    }
+    response = requests.post(
+        f"{LOCALHOST}/{URL_SEARCH}/bulk",
+        json=changes,
+        headers={"Content-Type": "application/json"},
+    )
+    print(response.content)
+
+
+def geocode(args) -> None:
+    """Stream a CSV or NDJSON file through the geocoding endpoint.
+
+    The file is uploaded and the result written out a chunk at a time, so files of any
+    size are geocoded in constant memory. NDJSON is assumed for ``.ndjson`` and
+    ``.jsonl`` files and CSV otherwise.
+    """
+    ndjson = args.file.lower().endswith((".ndjson", ".jsonl"))
+    content_type = "application/x-ndjson" if ndjson else "text/csv"
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    with open(args.file, "rb") as upload:
+        response = requests.post(
+            f"{LOCALHOST}/{URL_SEARCH}/geocode",
+            params={"column": args.column},
+            data=upload,
+            headers={"Content-Type": content_type},
+            stream=True,
+        )
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            output.write(chunk)
+    if args.output:
+        output.close()
+
+    job = response.headers["X-Geocode-Job"]
+    report = requests.get(f"{LOCALHOST}/{URL_SEARCH}/geocode/{job}").json()
+    if args.unmatched:
+        with open(args.unmatched, "w") as f:
+            json.dump(report["unmatched"], f)
+    print(
+        f"{report['matched']} of {report['rows']} rows geocoded, "
+        f"{report['rows'] - report['matched']} unmatched",
+        file=sys.stderr,
+    )
 
 
 # ---------------------------------------------------------------------------- #
@@ -212,4 +329,16 @@ if args.get:
     get(args)
 
 if args.delete:
-    delete(args)
\ No newline at end of file
+    delete(args)
+
+if args.bulk_load:
+    create_multiple(args)
+
+if args.ingest_prices:
+    ingest_prices(args)
+
+if args.apply_changes:
+    apply_changes(args)
+
+if args.geocode:
+    geocode(args)
\ No newline at end of file
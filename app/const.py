@@ -1,5 +1,35 @@
 """Constants
 """
 
+import datetime
+
 URL_SEARCH = "search"
 LOCALHOST = "http://127.0.0.1:8000"
+# Largest number of sub-squares along each side of a search grid
+MAX_NBINS = 256
+# Most periods in a price series, and most sub-squares times periods, so that a long
+# series is only asked for over a coarse grid
+MAX_PERIODS = 600
+MAX_SERIES_CELLS = 400_000
+# Largest number of boxes in a single batch search
+MAX_BATCH_BOXES = 100
+# Largest radius in km and number of neighbours of a nearby-postcode search
+MAX_RADIUS_KM = 50.0
+MAX_NEAREST = 100
+# Most postcodes added, moved or terminated in a single bulk change
+MAX_BULK_CHANGES = 200_000
+# Most completions returned for a postcode prefix
+MAX_COMPLETIONS = 50
+# Largest number of districts or subareas in a single area search
+MAX_AREAS = 100
+# Largest number of vertices of a searched polygon
+MAX_POLYGON_POINTS = 1000
+# Mean radius of the Earth in km, for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+# Extent of the tile pyramid, covering the UK postcode gazetteer
+UK_LAT_BOUNDS = (49.8, 60.9)
+UK_LON_BOUNDS = (-8.7, 1.8)
+# First day of the HM Land Registry Price Paid Data
+PRICE_PAID_START = datetime.date(1995, 1, 1)
+# Relative accuracy of price quantile sketches, fixed as stored sketch buckets depend on it
+SKETCH_ALPHA = 0.01
@@ -6,11 +6,157 @@ import os
 
 class DatabaseConfig(BaseModel):
     dsn: str = "sqlite:///data/postcodes.db"
+    # :float: Largest box in square degrees looked up through the R*Tree; bigger boxes
+    # select so much of the table that a plain scan is faster
+    rtree_max_area: float = 0.25
+    # :str: SQLite journal mode; "wal" lets readers carry on while a writer commits
+    journal_mode: str = "wal"
+    # :str: SQLite sync level; "normal" is safe with WAL, only losing the last commits
+    # on power loss
+    synchronous: str = "normal"
+    # :int: Page cache of every connection in KiB
+    cache_size_kib: int = 65_536
+    # :int: Bytes of the db file read through a memory map, 0 to read with syscalls
+    mmap_size: int = 268_435_456
+    # :int: Milliseconds a connection waits on a lock before failing
+    busy_timeout_ms: int = 5_000
+    # :int: Connections kept open in the pool shared by the whole app
+    pool_size: int = 8
+    # :int: Connections opened beyond the pool at peaks, closed once returned
+    max_overflow: int = 16
+    # :float: Seconds a request waits for a free connection
+    pool_timeout: float = 30.0
+    # :bool: Open the db read-only, for API workers serving a replica of the file;
+    # nothing is created, rebuilt or fetched from the Land Registry
+    read_only: bool = False
+
+
+class TilesConfig(BaseModel):
+    # :bool: Answer grid counts from the precomputed tile pyramid
+    enabled: bool = False
+    # :int: Deepest quadtree level, with 4**max_level tiles over the UK
+    max_level: int = 10
+    # :int: Minimum number of tiles across a grid cell for the pyramid to be used
+    min_tiles_per_cell: int = 16
+
+
+class StoreConfig(BaseModel):
+    # :bool: Serve bounding-box lookups from an in-memory copy of the postcodes table
+    enabled: bool = False
+    # :float: Height in degrees of the latitude bands the copy is sorted by
+    band_width: float = 0.01
+
+
+class NearestConfig(BaseModel):
+    # :bool: Answer radius and nearest-postcode searches from an in-memory k-d tree
+    enabled: bool = False
+    # :int: Postcodes added or deleted since the tree was built before it is rebuilt
+    rebuild_after: int = 1_000
+
+
+class AutocompleteConfig(BaseModel):
+    # :bool: Answer postcode autocomplete and lookup from an in-memory prefix index
+    enabled: bool = False
+
+
+class BulkConfig(BaseModel):
+    # :int: Postcodes changed by a bulk change above which the in-memory indexes are
+    # rebuilt from the db rather than patched
+    patch_limit: int = 1_000
+
+
+class GeocodeConfig(BaseModel):
+    # :int: Records of an uploaded file resolved with one lookup
+    batch_size: int = 1_000
+    # :int: Reports of finished geocoding jobs kept for their unmatched rows
+    max_reports: int = 100
+    # :int: Unmatched rows listed in the report of a job, the rest only counted
+    max_unmatched: int = 10_000
+
+
+class LandRegistryConfig(BaseModel):
+    # :str: SPARQL endpoint queried for price paid data
+    endpoint: str = "https://landregistry.data.gov.uk/landregistry/sparql"
+    # :int: Days after which transactions held locally for a postcode are refreshed
+    max_age_days: int = 7
+    # :int: Days before the end of a stale postcode's last fetch that its refresh starts
+    # from, as sales reach the Land Registry weeks to months after they complete
+    registration_lag_days: int = 90
+    # :str: "sparql" to fetch missing transactions on demand, "local" to answer only from
+    # transactions ingested from the Price Paid CSV files
+    source: str = "sparql"
+    # :int: Most postcodes in the VALUES clause of a single query
+    max_batch_size: int = 100
+    # :int: Fewest postcodes worth a query of their own when spreading work across threads
+    min_batch_size: int = 10
+    # :int: Queries in flight at once, the size of the dedicated thread pool
+    max_concurrency: int = 4
+    # :int: Seconds before a query is abandoned as timed out
+    timeout: int = 60
+    # :int: Attempts after the first for a failing query
+    retries: int = 3
+    # :float: Seconds before the first retry, doubled for every retry after it
+    backoff: float = 1.0
+    # :int: Rows of a SPARQL CSV response parsed at a time
+    chunksize: int = 10_000
+
+
+class CacheConfig(BaseModel):
+    # :bool: Serve repeated bounding-box searches from the response cache
+    enabled: bool = False
+    # :int: Most responses held before the least recently used is dropped
+    max_entries: int = 1024
+    # :float: Seconds a response is served before it is recomputed
+    ttl: float = 300.0
+    # :float: Grid in degrees that boxes are snapped outwards to
+    resolution: float = 0.001
+
+
+class ParallelConfig(BaseModel):
+    # :bool: Reduce the prices of large boxes across a pool of worker processes
+    enabled: bool = False
+    # :int: Worker processes, 0 for one per core
+    workers: int = 0
+    # :int: Fewest postcodes in a box for prices to be reduced across the pool
+    min_postcodes: int = 5_000
+
+
+class MetricsConfig(BaseModel):
+    # :bool: Time the hot-path stages of every request, reported in a Server-Timing
+    # header and as histograms on /metrics
+    enabled: bool = True
+    # :float: Profile every request and keep the profiles of those slower than this many
+    # milliseconds, 0 to disable the profiler
+    profile_slow_ms: float = 0
+    # :float: Seconds between stack samples of the profiler
+    profile_interval: float = 0.005
+    # :str: Directory the profiles of slow requests are written to
+    profile_dir: str = "data/profiles"
 
 
 class Config:
     # :DatabaseConfig: String to database location
     database: DatabaseConfig = DatabaseConfig()
+    # :TilesConfig: Precomputed tile pyramid for region summaries
+    tiles: TilesConfig = TilesConfig()
+    # :StoreConfig: In-memory columnar postcode store
+    store: StoreConfig = StoreConfig()
+    # :NearestConfig: k-d tree for radius and nearest-postcode searches
+    nearest: NearestConfig = NearestConfig()
+    # :AutocompleteConfig: Sorted prefix index for postcode autocomplete
+    autocomplete: AutocompleteConfig = AutocompleteConfig()
+    # :BulkConfig: Bulk postcode maintenance
+    bulk: BulkConfig = BulkConfig()
+    # :GeocodeConfig: Bulk geocoding of uploaded files
+    geocode: GeocodeConfig = GeocodeConfig()
+    # :LandRegistryConfig: Land Registry price paid source and local cache
+    landregistry: LandRegistryConfig = LandRegistryConfig()
+    # :CacheConfig: Response cache for the bounding-box search routes
+    cache: CacheConfig = CacheConfig()
+    # :ParallelConfig: Process pool for aggregating large boxes
+    parallel: ParallelConfig = ParallelConfig()
+    # :MetricsConfig: Request stage timing, metrics endpoint and slow-request profiler
+    metrics: MetricsConfig = MetricsConfig()
     # :str: Secrect key
     token_key: str = ""
 
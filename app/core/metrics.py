@@ -0,0 +1,237 @@
+"""Per-request stage timing, Prometheus histograms and a slow-request profiler.
+
+Hot paths are wrapped in ``stage("name")``. While a request is served, the time spent in
+each stage is added up for that request and reported back in its ``Server-Timing``
+header, and every stage and request duration is observed into a histogram served in the
+Prometheus text format on ``/metrics``. Calls to external services are wrapped in
+``external("name")``, which feeds their own histogram and error counter without adding
+to the request's stages, as several may be in flight at once.
+
+With ``config.metrics.profile_slow_ms`` set, every request is sampled by a background
+thread and the collapsed stacks of those slower than the threshold are written to
+``config.metrics.profile_dir``, ready for speedscope or flamegraph.pl. The sampler walks
+every thread of the process, so overlapping requests share their samples.
+"""
+
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from starlette.datastructures import MutableHeaders
+
+from app.core.config import config
+
+# Upper bounds in seconds of the histogram buckets, from a cached lookup to a slow query
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Seconds spent in each stage by the request being served, None outside a request
+_timings: ContextVar[dict[str, float] | None] = ContextVar("timings", default=None)
+
+
+class Histogram:
+    """Cumulative histogram of durations, one series per value of a single label."""
+
+    def __init__(self, name: str, help: str, label: str, buckets: tuple = BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # label value -> count per bucket (the last for +Inf), then the sum
+        self._series: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: str, seconds: float) -> None:
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += seconds
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {value: list(counts) for value, counts in self._series.items()}
+        for value, counts in sorted(series.items()):
+            label = f'{self.label}="{value}"'
+            total = 0
+            for bound, n in zip(self.buckets, counts):
+                total += n
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {total}')
+            total += counts[-2]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f"{self.name}_sum{{{label}}} {counts[-1]}")
+            lines.append(f"{self.name}_count{{{label}}} {total}")
+        return lines
+
+
+class Counter:
+    """Monotonic count, one series per value of a single label."""
+
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._series: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: str) -> None:
+        with self._lock:
+            self._series[value] = self._series.get(value, 0) + 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for value, n in sorted(series.items()):
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {n}')
+        return lines
+
+
+requests = Histogram("search_request_seconds", "Time to serve a request.", "route")
+stages = Histogram("search_stage_seconds", "Time spent in a stage of a request.", "stage")
+calls = Histogram("search_external_seconds", "Duration of a call to an external service.", "call")
+call_errors = Counter("search_external_errors_total", "Failed calls to an external service.", "call")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the current request.
+
+    Time spent in the same stage more than once is added up for the request.
+    """
+    if not config.metrics.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stages.observe(name, elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def external(name: str) -> Iterator[None]:
+    """Time a call to an external service, counting it as an error if it raises."""
+    if not config.metrics.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        call_errors.inc(name)
+        raise
+    finally:
+        calls.observe(name, time.perf_counter() - start)
+
+
+def server_timing(timings: dict[str, float], total: float) -> str:
+    """``Server-Timing`` header value of the stages of a request, in milliseconds."""
+    parts = [f"{name};dur={seconds * 1e3:.1f}" for name, seconds in timings.items()]
+    return ", ".join(parts + [f"total;dur={total * 1e3:.1f}"])
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in (requests, stages, calls, call_errors):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class Sampler:
+    """Samples the stacks of every other thread at a fixed interval until stopped.
+
+    Args:
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path: str) -> None:
+        """Write the samples as collapsed stacks, one ``frames count`` line per stack."""
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+class TimingMiddleware:
+    """ASGI middleware collecting the stage timings of every HTTP request.
+
+    Adds the ``Server-Timing`` header, observes the request duration by route template
+    and, when enabled, profiles the request and keeps the profile if it was slow.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.metrics.enabled:
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = _timings.set(timings)
+        opts = config.metrics
+        sampler = Sampler(opts.profile_interval) if opts.profile_slow_ms > 0 else None
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(timings, time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            _timings.reset(token)
+            # Route templates rather than raw paths keep the number of series bounded
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            requests.observe(path, elapsed)
+            if sampler is not None:
+                sampler.stop()
+                if elapsed * 1e3 >= opts.profile_slow_ms:
+                    os.makedirs(opts.profile_dir, exist_ok=True)
+                    name = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+                    sampler.dump(
+                        os.path.join(
+                            opts.profile_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}.txt"
+                        )
+                    )
@@ -0,0 +1,140 @@
+"""Read operations for the per-tile and per-area aggregates maintained by
+``app.db.aggregates``."""
+
+import datetime
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.models.aggregates import (
+    AreaPostcodes,
+    AreaPrices,
+    AreaSketches,
+    PostcodeCells,
+    PriceCells,
+    PriceSketches,
+)
+
+
+def get_postcode_cells(db: Session, level: int) -> pd.DataFrame:
+    """Row, column and postcode count of every non-empty tile of a level."""
+    q = db.query(PostcodeCells.row, PostcodeCells.col, PostcodeCells.n_postcodes)
+    q = q.filter(PostcodeCells.level == level, PostcodeCells.n_postcodes > 0)
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_price_sketches(
+    db: Session,
+    level: int,
+    rows: tuple[int, int],
+    cols: tuple[int, int],
+    start: datetime.date,
+    end: datetime.date,
+) -> pd.DataFrame:
+    """Sketch bucket counts of the tiles in a block of a level, for the months starting
+    from ``start`` up to but excluding ``end``.
+
+    Args:
+        db (Session): Database session.
+        level (int): Level of the tile pyramid the sketches were stored at.
+        rows (tuple[int, int]): First and one past the last tile row.
+        cols (tuple[int, int]): First and one past the last tile column.
+        start (datetime.date): First month, as its first day.
+        end (datetime.date): Month after the last one, as its first day.
+
+    Returns:
+        pd.DataFrame: Row, column, month, bucket and number of sales of every non-empty
+            bucket.
+    """
+    q = db.query(
+        PriceSketches.row,
+        PriceSketches.col,
+        PriceSketches.month,
+        PriceSketches.bucket,
+        PriceSketches.n_sales,
+    )
+    q = q.filter(PriceSketches.level == level)
+    q = q.filter(PriceSketches.row >= rows[0], PriceSketches.row < rows[1])
+    q = q.filter(PriceSketches.col >= cols[0], PriceSketches.col < cols[1])
+    q = q.filter(PriceSketches.month >= start, PriceSketches.month < end)
+    q = q.filter(PriceSketches.n_sales > 0)
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_price_cells(
+    db: Session,
+    level: int,
+    rows: tuple[int, int],
+    cols: tuple[int, int],
+    start: datetime.date,
+    end: datetime.date,
+) -> pd.DataFrame:
+    """Sales counts and amount sums of the tiles in a block of a level, for the months
+    starting from ``start`` up to but excluding ``end``.
+
+    Args:
+        As ``get_price_sketches``.
+
+    Returns:
+        pd.DataFrame: Row, column, month, number of sales and amount sum of every
+            non-empty tile and month.
+    """
+    q = db.query(
+        PriceCells.row, PriceCells.col, PriceCells.month, PriceCells.n_sales, PriceCells.amount_sum
+    )
+    q = q.filter(PriceCells.level == level)
+    q = q.filter(PriceCells.row >= rows[0], PriceCells.row < rows[1])
+    q = q.filter(PriceCells.col >= cols[0], PriceCells.col < cols[1])
+    q = q.filter(PriceCells.month >= start, PriceCells.month < end)
+    q = q.filter(PriceCells.n_sales > 0)
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_area_postcodes(db: Session, kind: str, areas: list[str]) -> pd.DataFrame:
+    """Postcode count, coordinate sums and bounds of the non-empty areas of a kind."""
+    q = db.query(
+        AreaPostcodes.area,
+        AreaPostcodes.n_postcodes,
+        AreaPostcodes.lat_sum,
+        AreaPostcodes.lon_sum,
+        AreaPostcodes.min_lat,
+        AreaPostcodes.max_lat,
+        AreaPostcodes.min_lon,
+        AreaPostcodes.max_lon,
+    )
+    q = q.filter(AreaPostcodes.kind == kind, AreaPostcodes.area.in_(areas))
+    q = q.filter(AreaPostcodes.n_postcodes > 0)
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_area_prices(
+    db: Session, kind: str, areas: list[str], start: datetime.date, end: datetime.date
+) -> pd.DataFrame:
+    """Sales counts and amount sums of areas of a kind, for the months starting from
+    ``start`` up to but excluding ``end``.
+
+    Returns:
+        pd.DataFrame: Area, month, number of sales and amount sum of every non-empty
+            area and month.
+    """
+    q = db.query(AreaPrices.area, AreaPrices.month, AreaPrices.n_sales, AreaPrices.amount_sum)
+    q = q.filter(AreaPrices.kind == kind, AreaPrices.area.in_(areas))
+    q = q.filter(AreaPrices.month >= start, AreaPrices.month < end)
+    q = q.filter(AreaPrices.n_sales > 0)
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_area_sketches(
+    db: Session, kind: str, areas: list[str], start: datetime.date, end: datetime.date
+) -> pd.DataFrame:
+    """Sketch bucket counts of areas of a kind, for the months starting from ``start`` up
+    to but excluding ``end``.
+
+    Returns:
+        pd.DataFrame: Area, month, bucket and number of sales of every non-empty bucket.
+    """
+    q = db.query(AreaSketches.area, AreaSketches.month, AreaSketches.bucket, AreaSketches.n_sales)
+    q = q.filter(AreaSketches.kind == kind, AreaSketches.area.in_(areas))
+    q = q.filter(AreaSketches.month >= start, AreaSketches.month < end)
+    q = q.filter(AreaSketches.n_sales > 0)
+    return pd.read_sql(q.statement, q.session.bind)
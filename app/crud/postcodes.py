@@ -2,18 +2,29 @@
 responsibilities.
 
 Create, Reuse, Update, Delete operations for the postcodes db.
+
+SQLAlchemy sessions here are synchronous, so every operation used by the async routers
+has an ``_async`` variant that runs it on the threadpool, keeping the event loop free to
+serve other requests while SQLite works.
 """
+import numpy as np
 import pandas as pd
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, update
 from sqlalchemy.orm import Session
 from sqlalchemy.future import select
+from app.core import metrics
 from app.schemas.postcodes import (
+    PostcodeChangesSchema,
     PostcodeCreateSchema,
     PostcodeResponseSchema,
     PostcodeSchema,
     GeometricSchema,
 )
 from app.models.postcodes import Postcodes
+from app.db import nearest, prefix, spatial
+from app.db.columnar import store
 
 
 async def get_items(
@@ -39,8 +50,16 @@ async def get_items(
         q = q.filter(Postcodes.longitude >= query_data.min_lon)
     if query_data.max_lon:
         q = q.filter(Postcodes.longitude <= query_data.max_lon)
-    result = db.execute(q)
-    return result.scalars().all()
+    if spatial.use_index(
+        query_data.min_lat, query_data.max_lat, query_data.min_lon, query_data.max_lon
+    ):
+        # Narrow to the rows inside the box through the R*Tree
+        q = q.filter(
+            spatial.within(
+                query_data.min_lat, query_data.max_lat, query_data.min_lon, query_data.max_lon
+            )
+        )
+    return await run_in_threadpool(lambda: db.execute(q).scalars().all())
 
 
 def get_frame_from_latlon(
@@ -56,22 +75,77 @@ def get_frame_from_latlon(
     Returns:
         list[PostcodeResponseSchema]: _description_
     """
+    if store.loaded:
+        # Answer from the in-memory copy without touching the db
+        return store.search_frame(
+            query_data.min_lat, query_data.max_lat, query_data.min_lon, query_data.max_lon
+        )
     q = db.query(Postcodes)
     q = q.filter(Postcodes.latitude >= query_data.min_lat)
     q = q.filter(Postcodes.latitude <= query_data.max_lat)
     q = q.filter(Postcodes.longitude >= query_data.min_lon)
     q = q.filter(Postcodes.longitude <= query_data.max_lon)
+    if spatial.use_index(
+        query_data.min_lat, query_data.max_lat, query_data.min_lon, query_data.max_lon
+    ):
+        # Narrow to the rows inside the box through the R*Tree
+        q = q.filter(
+            spatial.within(
+                query_data.min_lat, query_data.max_lat, query_data.min_lon, query_data.max_lon
+            )
+        )
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_coordinates(db: Session) -> pd.DataFrame:
+    """Latitude and longitude of every postcode in the db."""
+    q = db.query(Postcodes.latitude, Postcodes.longitude)
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def _compacted():
+    """SQL expression of ``prefix.compact_postcode`` applied to ``full_postcode``."""
+    return func.replace(func.upper(Postcodes.full_postcode), " ", "")
+
+
+def get_by_prefix(db: Session, key: str, k: int) -> pd.DataFrame:
+    """The first ``k`` postcodes whose compacted form starts with ``key``, scanning the
+    table, for when the prefix index is not loaded.
+
+    Args:
+        db (Session): Database session.
+        key (str): Compacted prefix of letters and digits only.
+        k (int): Most postcodes returned.
+    """
+    q = db.query(Postcodes.full_postcode, Postcodes.latitude, Postcodes.longitude)
+    q = q.filter(_compacted().like(f"{key}%")).order_by(_compacted()).limit(k)
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_by_keys(db: Session, keys: list[str]) -> pd.DataFrame:
+    """Postcodes whose compacted form is one of ``keys``."""
+    q = db.query(Postcodes.full_postcode, Postcodes.latitude, Postcodes.longitude)
+    q = q.filter(_compacted().in_(keys))
+    return pd.read_sql(q.statement, q.session.bind)
+
+
+def get_by_postcodes(db: Session, postcodes: list[str]) -> pd.DataFrame:
+    """Postcodes matching any of ``postcodes`` exactly, through the unique index."""
+    q = db.query(Postcodes.full_postcode, Postcodes.latitude, Postcodes.longitude)
+    q = q.filter(Postcodes.full_postcode.in_(postcodes))
     return pd.read_sql(q.statement, q.session.bind)
 
 
 def create(db: Session, item: PostcodeCreateSchema) -> Postcodes:
+    # Stored normalised, as by ``apply_changes``, so every write path agrees on the key
+    postcode = prefix.normalise_postcode(item.postcode)
     # separate postcode at the space
-    elems = item.postcode.split(sep=" ")
+    elems = postcode.split(sep=" ")
     subdistrict = elems[0]
     district = elems[0][:2]
 
     db_item = Postcodes(
-        full_postcode=item.postcode,
+        full_postcode=postcode,
         district_postcode=district,
         subarea_postcode=subdistrict,
         latitude=item.lat,
@@ -79,10 +153,14 @@ def create(db: Session, item: PostcodeCreateSchema) -> Postcodes:
     )
     db.add(db_item)
     db.commit()
+    store.add(db_item.id, db_item.full_postcode, db_item.latitude, db_item.longitude)
+    nearest.tree.add(db_item.id, db_item.full_postcode, db_item.latitude, db_item.longitude)
+    prefix.index.add(db_item.full_postcode, db_item.latitude, db_item.longitude)
     return db_item
 
 
-def delete_postcode(db: Session, postcode: str):
+def delete_postcode(db: Session, postcode: str) -> Postcodes:
+    postcode = prefix.normalise_postcode(postcode)
     result = db.execute(select(Postcodes).filter(Postcodes.full_postcode == postcode))
     item = result.scalar_one_or_none()
 
@@ -91,3 +169,130 @@ def delete_postcode(db: Session, postcode: str):
 
     db.delete(item)
     db.commit()
+    store.remove(item.full_postcode, item.latitude, item.longitude)
+    nearest.tree.remove(item.full_postcode)
+    prefix.index.remove(item.full_postcode)
+    return item
+
+
+# Postcodes bound into a single IN clause, well below SQLite's limit on variables
+_IN_CHUNK = 10_000
+
+
+def _held(db: Session, postcodes: list[str]) -> pd.DataFrame:
+    """Id and coordinates of those of the postcodes held, read in the session."""
+    rows = []
+    for i in range(0, len(postcodes), _IN_CHUNK):
+        q = select(Postcodes.id, Postcodes.full_postcode, Postcodes.latitude, Postcodes.longitude)
+        rows += db.execute(q.filter(Postcodes.full_postcode.in_(postcodes[i : i + _IN_CHUNK])))
+    df = pd.DataFrame(rows, columns=["id", "full_postcode", "latitude", "longitude"])
+    return df.astype({"full_postcode": str})
+
+
+def apply_changes(db: Session, changes: PostcodeChangesSchema) -> pd.DataFrame:
+    """Add, move and delete many postcodes in one transaction.
+
+    Postcodes are normalised first, so any case and spacing match the held ones. Each
+    kind of change is a single executemany statement and the triggers keep the spatial
+    index and the aggregates in step, so the whole diff costs one commit.
+
+    Args:
+        db (Session): Database session.
+        changes (PostcodeChangesSchema): Upserted and deleted postcodes, and whether to
+            only classify them.
+
+    Returns:
+        pd.DataFrame: A row per upserted or deleted postcode with its ``change``, one of
+            "added", "moved", "unchanged", "deleted" or "missing", its ``id`` where
+            held, ``latitude`` and ``longitude`` after the change and ``old_latitude``
+            and ``old_longitude`` before it.
+    """
+    upserts = pd.DataFrame(
+        {
+            "full_postcode": [prefix.normalise_postcode(u.postcode) for u in changes.upserts],
+            "latitude": [u.lat for u in changes.upserts],
+            "longitude": [u.lon for u in changes.upserts],
+        }
+    )
+    deletes = pd.DataFrame(
+        {"full_postcode": [prefix.normalise_postcode(p) for p in changes.deletes]}
+    )
+    # Empty lists would otherwise leave the key columns typed as floats
+    upserts = upserts.astype({"full_postcode": str, "latitude": float, "longitude": float})
+    deletes = deletes.astype({"full_postcode": str})
+    held = _held(db, list(upserts["full_postcode"]) + list(deletes["full_postcode"]))
+    held = held.rename(columns={"latitude": "old_latitude", "longitude": "old_longitude"})
+
+    upserts = upserts.merge(held, on="full_postcode", how="left")
+    same = (upserts["latitude"] == upserts["old_latitude"]) & (
+        upserts["longitude"] == upserts["old_longitude"]
+    )
+    upserts["change"] = np.where(
+        upserts["id"].isna(), "added", np.where(same, "unchanged", "moved")
+    )
+    deletes = deletes.merge(held, on="full_postcode", how="left")
+    deletes["change"] = np.where(deletes["id"].isna(), "missing", "deleted")
+    result = pd.concat([upserts, deletes], ignore_index=True)
+    if changes.dry_run:
+        return result
+
+    added = upserts[upserts["change"] == "added"]
+    moved = upserts[upserts["change"] == "moved"]
+    deleted = deletes[deletes["change"] == "deleted"]
+    if len(added):
+        # District and subarea split from the postcode as in ``create``
+        outward = added["full_postcode"].str.split(" ").str[0]
+        db.execute(
+            insert(Postcodes),
+            pd.DataFrame(
+                {
+                    "full_postcode": added["full_postcode"],
+                    "district_postcode": outward.str[:2],
+                    "subarea_postcode": outward,
+                    "latitude": added["latitude"],
+                    "longitude": added["longitude"],
+                }
+            ).to_dict("records"),
+        )
+    if len(moved):
+        db.execute(
+            update(Postcodes),
+            [
+                {"id": int(id), "latitude": lat, "longitude": lon}
+                for id, lat, lon in zip(moved["id"], moved["latitude"], moved["longitude"])
+            ],
+        )
+    ids = [int(id) for id in deleted["id"]]
+    for i in range(0, len(ids), _IN_CHUNK):
+        db.execute(delete(Postcodes).where(Postcodes.id.in_(ids[i : i + _IN_CHUNK])))
+    db.commit()
+
+    if len(added):
+        # Ids of the added postcodes, for patching the in-memory indexes
+        new_ids = _held(db, list(added["full_postcode"])).set_index("full_postcode")["id"]
+        is_added = result["change"] == "added"
+        result.loc[is_added, "id"] = new_ids.reindex(result.loc[is_added, "full_postcode"]).values
+    return result
+
+
+async def get_frame_from_latlon_async(
+    db: Session, query_data: GeometricSchema
+) -> pd.DataFrame:
+    """Non-blocking ``get_frame_from_latlon``."""
+    with metrics.stage("postcodes"):
+        return await run_in_threadpool(get_frame_from_latlon, db, query_data)
+
+
+async def create_async(db: Session, item: PostcodeCreateSchema) -> Postcodes:
+    """Non-blocking ``create``."""
+    return await run_in_threadpool(create, db, item)
+
+
+async def apply_changes_async(db: Session, changes: PostcodeChangesSchema) -> pd.DataFrame:
+    """Non-blocking ``apply_changes``."""
+    return await run_in_threadpool(apply_changes, db, changes)
+
+
+async def delete_postcode_async(db: Session, postcode: str) -> Postcodes:
+    """Non-blocking ``delete_postcode``."""
+    return await run_in_threadpool(delete_postcode, db, postcode)
@@ -0,0 +1,184 @@
+"""Create and read operations for the local cache of Land Registry transactions.
+
+Transactions are keyed by their Land Registry id so the same sale fetched twice is
+stored once. ``transaction_fetches`` records, per postcode, the date window held locally
+and when it was fetched, which is what decides whether a request has to go back to the
+Land Registry at all.
+
+As in ``crud.postcodes``, the operations used by the async routers have ``_async``
+variants run on the threadpool.
+"""
+
+import datetime
+from collections import defaultdict
+
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app.models.transactions import TransactionFetches, Transactions
+
+# Postcodes per IN (...) clause, kept well below SQLite's bound parameter limit
+_IN_CHUNK = 900
+
+
+def _chunks(items: list, size: int = _IN_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def windows_to_fetch(
+    db: Session,
+    postcodes: list[str],
+    start: datetime.date,
+    max_age: datetime.timedelta,
+    lag: datetime.timedelta = datetime.timedelta(0),
+) -> dict[datetime.date, list[str]]:
+    """Group the postcodes whose transactions must be fetched by the date to fetch from.
+
+    A postcode never fetched, or held from a later date than ``start``, is fetched for
+    the whole window. One held for the window but fetched longer than ``max_age`` ago
+    is refreshed from ``lag`` before the end of its last fetch, so sales dated before
+    that fetch but only registered after it are picked up; the upsert on the
+    transaction id drops those already held. Postcodes fetched within ``max_age`` are
+    left out.
+
+    Returns:
+        dict[datetime.date, list[str]]: Postcodes to fetch, keyed by their start date.
+    """
+    held = {}
+    for chunk in _chunks(list(postcodes)):
+        result = db.execute(
+            select(TransactionFetches).filter(TransactionFetches.postcode.in_(chunk))
+        )
+        held.update({row.postcode: row for row in result.scalars()})
+
+    stale_before = datetime.datetime.now() - max_age
+    windows = defaultdict(list)
+    for postcode in postcodes:
+        fetch = held.get(postcode)
+        if fetch is None or fetch.start_date > start:
+            windows[start].append(postcode)
+        elif fetch.fetched_at < stale_before:
+            since = max(fetch.end_date - lag, fetch.start_date)
+            windows[since].append(postcode)
+    return dict(windows)
+
+
+def upsert_transactions(db: Session, transactions: pd.DataFrame) -> None:
+    """Insert transactions, replacing any already held under the same id."""
+    if len(transactions) == 0:
+        return
+    stmt = insert(Transactions)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Transactions.transaction_id],
+        set_={
+            column: stmt.excluded[column]
+            for column in transactions.columns
+            if column != "transaction_id"
+        },
+    )
+    db.execute(stmt, transactions.to_dict("records"))
+
+
+def delete_transactions(db: Session, transaction_ids: list[str]) -> None:
+    """Remove transactions by id, ignoring any not held."""
+    for chunk in _chunks(list(transaction_ids)):
+        db.execute(delete(Transactions).filter(Transactions.transaction_id.in_(chunk)))
+
+
+def write_transactions(
+    db: Session,
+    transactions: pd.DataFrame,
+    postcodes: list[str],
+    start: datetime.date,
+    end: datetime.date,
+) -> None:
+    """Store fetched transactions and record the window now held for each postcode.
+
+    Args:
+        db (Session): Database session, committed on return.
+        transactions (pd.DataFrame): Rows with the columns of the transactions table.
+        postcodes (list[str]): Every postcode that was queried, including those that
+            returned no transactions.
+        start (datetime.date): Start of the window that was queried.
+        end (datetime.date): End of the window that was queried.
+    """
+    upsert_transactions(db, transactions)
+
+    if postcodes:
+        now = datetime.datetime.now()
+        stmt = insert(TransactionFetches)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TransactionFetches.postcode],
+            set_={
+                # Keep the earliest start held, the window is contiguous either way
+                "start_date": func.min(
+                    TransactionFetches.start_date, stmt.excluded.start_date
+                ),
+                "end_date": stmt.excluded.end_date,
+                "fetched_at": stmt.excluded.fetched_at,
+            },
+        )
+        db.execute(
+            stmt,
+            [
+                {"postcode": p, "start_date": start, "end_date": end, "fetched_at": now}
+                for p in postcodes
+            ],
+        )
+    db.commit()
+
+
+def iter_transactions(
+    db: Session, postcodes: list[str], start: datetime.date, end: datetime.date
+):
+    """Postcode, date and amount of every held transaction in the window, yielded a few
+    hundred postcodes at a time so callers never hold every transaction at once."""
+    for chunk in _chunks(list(postcodes)):
+        q = db.query(Transactions.postcode, Transactions.date, Transactions.amount)
+        q = q.filter(Transactions.postcode.in_(chunk))
+        q = q.filter(Transactions.date > start)
+        q = q.filter(Transactions.date < end)
+        yield pd.read_sql(q.statement, q.session.bind)
+
+
+def get_transactions(
+    db: Session, postcodes: list[str], start: datetime.date, end: datetime.date
+) -> pd.DataFrame:
+    """Postcode, date and amount of every held transaction in the window."""
+    frames = list(iter_transactions(db, postcodes, start, end))
+    if not frames:
+        return pd.DataFrame(columns=["postcode", "date", "amount"])
+    return pd.concat(frames, ignore_index=True)
+
+
+async def windows_to_fetch_async(
+    db: Session,
+    postcodes: list[str],
+    start: datetime.date,
+    max_age: datetime.timedelta,
+    lag: datetime.timedelta = datetime.timedelta(0),
+) -> dict[datetime.date, list[str]]:
+    """Non-blocking ``windows_to_fetch``."""
+    return await run_in_threadpool(windows_to_fetch, db, postcodes, start, max_age, lag)
+
+
+async def write_transactions_async(
+    db: Session,
+    transactions: pd.DataFrame,
+    postcodes: list[str],
+    start: datetime.date,
+    end: datetime.date,
+) -> None:
+    """Non-blocking ``write_transactions``."""
+    await run_in_threadpool(write_transactions, db, transactions, postcodes, start, end)
+
+
+async def get_transactions_async(
+    db: Session, postcodes: list[str], start: datetime.date, end: datetime.date
+) -> pd.DataFrame:
+    """Non-blocking ``get_transactions``."""
+    return await run_in_threadpool(get_transactions, db, postcodes, start, end)
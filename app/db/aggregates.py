@@ -0,0 +1,432 @@
+"""Per-tile aggregates of the postcodes and transactions tables, kept in sync by triggers.
+
+``postcode_cells`` counts the postcodes in every tile of the deepest level of the tile
+pyramid, and ``price_cells`` the number and total amount of the sales in every tile and
+calendar month. SQLite triggers update them in the same transaction as each insert,
+update or delete, whether it comes through the ORM, the CLI or raw SQL, so summaries
+read a few thousand tiles instead of every raw row and writes only touch one tile.
+
+A sale is placed in the tile of its postcode when it is written, and moved with every
+sale of the postcode when the postcode's coordinates change. Sales written before their
+postcode exists are only picked up by ``rebuild_aggregates``.
+
+``price_sketches`` holds the same sales as counts per bucket of ``services.sketch``, so
+approximate price quantiles of any group of tiles and months can be read without the
+raw rows. Bucketing needs SQLite's math functions; on builds without them the sketches
+are left out and ``sketches_enabled`` stays False.
+
+The same rollups are kept per postcode district and subarea: ``area_postcodes`` holds
+the count, coordinate sums and bounding box of the postcodes of every area,
+``area_prices`` and ``area_sketches`` its sales by month. A bounding box only grows on
+insert; a delete or move recomputes it from the area's rows, through the index on the
+area column, when the point removed was on its edge.
+"""
+
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import OperationalError
+
+from app.const import SKETCH_ALPHA, UK_LAT_BOUNDS, UK_LON_BOUNDS
+from app.core.config import config
+
+LEVEL = config.tiles.max_level
+
+# Same arithmetic as TilePyramid._tile, so SQL and numpy agree on every tile edge
+_TILE_LAT = (UK_LAT_BOUNDS[1] - UK_LAT_BOUNDS[0]) / 2**LEVEL
+_TILE_LON = (UK_LON_BOUNDS[1] - UK_LON_BOUNDS[0]) / 2**LEVEL
+# Same base as sketch.bucket_of
+_GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+
+
+def _tile(lat: str, lon: str) -> str:
+    """SQL for the level, row and column of the tile holding a coordinate."""
+    return (
+        f"{LEVEL}, "
+        f"CAST(({lat} - {UK_LAT_BOUNDS[0]!r}) / {_TILE_LAT!r} AS INTEGER), "
+        f"CAST(({lon} - {UK_LON_BOUNDS[0]!r}) / {_TILE_LON!r} AS INTEGER)"
+    )
+
+
+def _inside(lat: str, lon: str) -> str:
+    return (
+        f"{lat} >= {UK_LAT_BOUNDS[0]!r} AND {lat} < {UK_LAT_BOUNDS[1]!r} "
+        f"AND {lon} >= {UK_LON_BOUNDS[0]!r} AND {lon} < {UK_LON_BOUNDS[1]!r}"
+    )
+
+
+def _count_postcode(ref: str, delta: int) -> str:
+    return f"""INSERT INTO postcode_cells (level, row, col, n_postcodes)
+            SELECT {_tile(f"{ref}.latitude", f"{ref}.longitude")}, {delta}
+            WHERE {_inside(f"{ref}.latitude", f"{ref}.longitude")}
+            ON CONFLICT (level, row, col)
+            DO UPDATE SET n_postcodes = n_postcodes + excluded.n_postcodes;"""
+
+
+def _count_sale(ref: str, sign: int) -> str:
+    return f"""INSERT INTO price_cells (level, row, col, month, n_sales, amount_sum)
+            SELECT {_tile("p.latitude", "p.longitude")}, date({ref}.date, 'start of month'),
+                {sign}, {sign} * {ref}.amount
+            FROM postcodes AS p
+            WHERE p.full_postcode = {ref}.postcode AND {_inside("p.latitude", "p.longitude")}
+            ON CONFLICT (level, row, col, month)
+            DO UPDATE SET n_sales = n_sales + excluded.n_sales,
+                amount_sum = amount_sum + excluded.amount_sum;"""
+
+
+def _sketch_sale(ref: str, sign: int) -> str:
+    return f"""INSERT INTO price_sketches (level, row, col, month, bucket, n_sales)
+            SELECT {_tile("p.latitude", "p.longitude")}, date({ref}.date, 'start of month'),
+                {_bucket(f"{ref}.amount")}, {sign}
+            FROM postcodes AS p
+            WHERE p.full_postcode = {ref}.postcode AND {_inside("p.latitude", "p.longitude")}
+            ON CONFLICT (level, row, col, month, bucket)
+            DO UPDATE SET n_sales = n_sales + excluded.n_sales;"""
+
+
+def _move_sales(ref: str, sign: int) -> str:
+    """Every sale of a postcode taken out of, or put into, the tile at ``ref``."""
+    return f"""INSERT INTO price_cells (level, row, col, month, n_sales, amount_sum)
+            SELECT {_tile(f"{ref}.latitude", f"{ref}.longitude")},
+                date(t.date, 'start of month') AS month,
+                {sign} * count(*), {sign} * sum(t.amount)
+            FROM transactions AS t
+            WHERE t.postcode = {ref}.full_postcode
+                AND {_inside(f"{ref}.latitude", f"{ref}.longitude")}
+            GROUP BY month
+            ON CONFLICT (level, row, col, month)
+            DO UPDATE SET n_sales = n_sales + excluded.n_sales,
+                amount_sum = amount_sum + excluded.amount_sum;"""
+
+
+def _move_sketches(ref: str, sign: int) -> str:
+    return f"""INSERT INTO price_sketches (level, row, col, month, bucket, n_sales)
+            SELECT {_tile(f"{ref}.latitude", f"{ref}.longitude")},
+                date(t.date, 'start of month') AS month, {_bucket("t.amount")} AS bucket,
+                {sign} * count(*)
+            FROM transactions AS t
+            WHERE t.postcode = {ref}.full_postcode
+                AND {_inside(f"{ref}.latitude", f"{ref}.longitude")}
+            GROUP BY month, bucket
+            ON CONFLICT (level, row, col, month, bucket)
+            DO UPDATE SET n_sales = n_sales + excluded.n_sales;"""
+
+
+# Kind of area and the postcodes column holding it
+AREAS = {"district": "district_postcode", "subarea": "subarea_postcode"}
+
+
+def _add_area_postcode(kind: str, column: str) -> str:
+    return f"""INSERT INTO area_postcodes
+                (kind, area, n_postcodes, lat_sum, lon_sum, min_lat, max_lat, min_lon, max_lon)
+            SELECT '{kind}', new.{column}, 1, new.latitude, new.longitude,
+                new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.{column} IS NOT NULL
+            ON CONFLICT (kind, area)
+            DO UPDATE SET n_postcodes = n_postcodes + 1,
+                lat_sum = lat_sum + excluded.lat_sum,
+                lon_sum = lon_sum + excluded.lon_sum,
+                min_lat = min(coalesce(min_lat, excluded.min_lat), excluded.min_lat),
+                max_lat = max(coalesce(max_lat, excluded.max_lat), excluded.max_lat),
+                min_lon = min(coalesce(min_lon, excluded.min_lon), excluded.min_lon),
+                max_lon = max(coalesce(max_lon, excluded.max_lon), excluded.max_lon);"""
+
+
+def _remove_area_postcode(kind: str, column: str) -> str:
+    bounds = ",\n                ".join(
+        f"{edge}_{axis} = (SELECT {edge}({name}) FROM postcodes WHERE {column} = old.{column})"
+        for edge in ("min", "max")
+        for axis, name in (("lat", "latitude"), ("lon", "longitude"))
+    )
+    return f"""UPDATE area_postcodes SET n_postcodes = n_postcodes - 1,
+                lat_sum = lat_sum - old.latitude, lon_sum = lon_sum - old.longitude
+            WHERE kind = '{kind}' AND area = old.{column};
+            UPDATE area_postcodes SET
+                {bounds}
+            WHERE kind = '{kind}' AND area = old.{column}
+                AND (old.latitude IN (min_lat, max_lat) OR old.longitude IN (min_lon, max_lon));"""
+
+
+def _area_sale(ref: str, sign: int, kind: str, column: str) -> str:
+    return f"""INSERT INTO area_prices (kind, area, month, n_sales, amount_sum)
+            SELECT '{kind}', p.{column}, date({ref}.date, 'start of month'),
+                {sign}, {sign} * {ref}.amount
+            FROM postcodes AS p
+            WHERE p.full_postcode = {ref}.postcode AND p.{column} IS NOT NULL
+            ON CONFLICT (kind, area, month)
+            DO UPDATE SET n_sales = n_sales + excluded.n_sales,
+                amount_sum = amount_sum + excluded.amount_sum;"""
+
+
+def _area_sketch_sale(ref: str, sign: int, kind: str, column: str) -> str:
+    return f"""INSERT INTO area_sketches (kind, area, month, bucket, n_sales)
+            SELECT '{kind}', p.{column}, date({ref}.date, 'start of month'),
+                {_bucket(f"{ref}.amount")}, {sign}
+            FROM postcodes AS p
+            WHERE p.full_postcode = {ref}.postcode AND p.{column} IS NOT NULL
+            ON CONFLICT (kind, area, month, bucket)
+            DO UPDATE SET n_sales = n_sales + excluded.n_sales;"""
+
+
+def _for_areas(statement, *args) -> str:
+    """A statement for every kind of area, as one trigger body."""
+    return "\n            ".join(statement(*args, kind, column) for kind, column in AREAS.items())
+
+
+def _bucket(amount: str) -> str:
+    """SQL for the sketch bucket of an amount, as ``sketch.bucket_of``."""
+    return f"CAST(ceil(ln(max({amount}, 1.0)) / ln({_GAMMA!r})) AS INTEGER)"
+
+
+TRIGGER_DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS postcode_cells_insert AFTER INSERT ON postcodes
+        BEGIN
+            {_count_postcode("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS postcode_cells_update
+        AFTER UPDATE OF latitude, longitude ON postcodes
+        BEGIN
+            {_count_postcode("old", -1)}
+            {_count_postcode("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS postcode_cells_delete AFTER DELETE ON postcodes
+        BEGIN
+            {_count_postcode("old", -1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS price_cells_insert AFTER INSERT ON transactions
+        BEGIN
+            {_count_sale("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS price_cells_update
+        AFTER UPDATE OF postcode, date, amount ON transactions
+        BEGIN
+            {_count_sale("old", -1)}
+            {_count_sale("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS price_cells_delete AFTER DELETE ON transactions
+        BEGIN
+            {_count_sale("old", -1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS price_cells_move
+        AFTER UPDATE OF latitude, longitude ON postcodes
+        BEGIN
+            {_move_sales("old", -1)}
+            {_move_sales("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_postcodes_insert AFTER INSERT ON postcodes
+        BEGIN
+            {_for_areas(_add_area_postcode)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_postcodes_update
+        AFTER UPDATE OF district_postcode, subarea_postcode, latitude, longitude ON postcodes
+        BEGIN
+            {_for_areas(_remove_area_postcode)}
+            {_for_areas(_add_area_postcode)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_postcodes_delete AFTER DELETE ON postcodes
+        BEGIN
+            {_for_areas(_remove_area_postcode)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_prices_insert AFTER INSERT ON transactions
+        BEGIN
+            {_for_areas(_area_sale, "new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_prices_update
+        AFTER UPDATE OF postcode, date, amount ON transactions
+        BEGIN
+            {_for_areas(_area_sale, "old", -1)}
+            {_for_areas(_area_sale, "new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_prices_delete AFTER DELETE ON transactions
+        BEGIN
+            {_for_areas(_area_sale, "old", -1)}
+        END""",
+]
+
+SKETCH_TRIGGER_DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS price_sketches_insert AFTER INSERT ON transactions
+        BEGIN
+            {_sketch_sale("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS price_sketches_update
+        AFTER UPDATE OF postcode, date, amount ON transactions
+        BEGIN
+            {_sketch_sale("old", -1)}
+            {_sketch_sale("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS price_sketches_delete AFTER DELETE ON transactions
+        BEGIN
+            {_sketch_sale("old", -1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS price_sketches_move
+        AFTER UPDATE OF latitude, longitude ON postcodes
+        BEGIN
+            {_move_sketches("old", -1)}
+            {_move_sketches("new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_sketches_insert AFTER INSERT ON transactions
+        BEGIN
+            {_for_areas(_area_sketch_sale, "new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_sketches_update
+        AFTER UPDATE OF postcode, date, amount ON transactions
+        BEGIN
+            {_for_areas(_area_sketch_sale, "old", -1)}
+            {_for_areas(_area_sketch_sale, "new", 1)}
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS area_sketches_delete AFTER DELETE ON transactions
+        BEGIN
+            {_for_areas(_area_sketch_sale, "old", -1)}
+        END""",
+]
+
+TRIGGERS = [
+    f"{table}_{event}"
+    for table in (
+        "postcode_cells",
+        "price_cells",
+        "price_sketches",
+        "area_postcodes",
+        "area_prices",
+        "area_sketches",
+    )
+    for event in ("insert", "update", "delete")
+] + ["price_cells_move", "price_sketches_move"]
+
+REBUILD = [
+    "DELETE FROM postcode_cells",
+    f"""INSERT INTO postcode_cells (level, row, col, n_postcodes)
+        SELECT {_tile("latitude", "longitude")}, count(*) FROM postcodes
+        WHERE {_inside("latitude", "longitude")}
+        GROUP BY 1, 2, 3""",
+    "DELETE FROM price_cells",
+    f"""INSERT INTO price_cells (level, row, col, month, n_sales, amount_sum)
+        SELECT {_tile("p.latitude", "p.longitude")}, date(t.date, 'start of month'),
+            count(*), sum(t.amount)
+        FROM transactions AS t JOIN postcodes AS p ON p.full_postcode = t.postcode
+        WHERE {_inside("p.latitude", "p.longitude")}
+        GROUP BY 1, 2, 3, 4""",
+    "DELETE FROM area_postcodes",
+    *(
+        f"""INSERT INTO area_postcodes
+            (kind, area, n_postcodes, lat_sum, lon_sum, min_lat, max_lat, min_lon, max_lon)
+        SELECT '{kind}', {column}, count(*), sum(latitude), sum(longitude),
+            min(latitude), max(latitude), min(longitude), max(longitude)
+        FROM postcodes WHERE {column} IS NOT NULL
+        GROUP BY {column}"""
+        for kind, column in AREAS.items()
+    ),
+    "DELETE FROM area_prices",
+    *(
+        f"""INSERT INTO area_prices (kind, area, month, n_sales, amount_sum)
+        SELECT '{kind}', p.{column}, date(t.date, 'start of month'), count(*), sum(t.amount)
+        FROM transactions AS t JOIN postcodes AS p ON p.full_postcode = t.postcode
+        WHERE p.{column} IS NOT NULL
+        GROUP BY 2, 3"""
+        for kind, column in AREAS.items()
+    ),
+]
+
+SKETCH_REBUILD = [
+    "DELETE FROM price_sketches",
+    f"""INSERT INTO price_sketches (level, row, col, month, bucket, n_sales)
+        SELECT {_tile("p.latitude", "p.longitude")}, date(t.date, 'start of month'),
+            {_bucket("t.amount")}, count(*)
+        FROM transactions AS t JOIN postcodes AS p ON p.full_postcode = t.postcode
+        WHERE {_inside("p.latitude", "p.longitude")}
+        GROUP BY 1, 2, 3, 4, 5""",
+    "DELETE FROM area_sketches",
+    *(
+        f"""INSERT INTO area_sketches (kind, area, month, bucket, n_sales)
+        SELECT '{kind}', p.{column}, date(t.date, 'start of month'),
+            {_bucket("t.amount")}, count(*)
+        FROM transactions AS t JOIN postcodes AS p ON p.full_postcode = t.postcode
+        WHERE p.{column} IS NOT NULL
+        GROUP BY 2, 3, 4"""
+        for kind, column in AREAS.items()
+    ),
+]
+
+# Probe for the math functions the sketch buckets are computed with
+MATH_PROBE = "SELECT ceil(ln(2.0))"
+
+# Set once the triggers exist and the aggregates are in sync with the raw tables
+enabled = False
+sketches_enabled = False
+
+
+def statements(with_sketches: bool) -> tuple[list[str], list[str]]:
+    """Trigger DDL and rebuild statements, with or without the price sketches."""
+    if with_sketches:
+        return TRIGGER_DDL + SKETCH_TRIGGER_DDL, REBUILD + SKETCH_REBUILD
+    return TRIGGER_DDL, REBUILD
+
+
+def create_aggregates(engine: Engine, read_only: bool = False) -> bool:
+    """Create the triggers if missing, and rebuild the aggregates when they are stale.
+
+    The aggregates are rebuilt when they were built for another tile level, when the
+    tile or district postcode counts disagree with the postcodes table, or when sales
+    are held but none are aggregated. Does nothing on databases other than SQLite. A
+    read-only db is never changed and its aggregates only used when they are in sync.
+
+    Returns:
+        bool: Whether the aggregates are available.
+    """
+    global enabled, sketches_enabled
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            try:
+                conn.execute(text(MATH_PROBE))
+                with_sketches = True
+            except OperationalError:
+                with_sketches = False
+            if read_only:
+                # Sketches are only held where their triggers were created
+                held = conn.execute(
+                    text(
+                        """SELECT EXISTS (SELECT 1 FROM sqlite_master
+                            WHERE type = 'trigger' AND name = 'price_sketches_insert')"""
+                    )
+                ).scalar()
+                with_sketches = with_sketches and bool(held)
+            else:
+                ddl, _ = statements(with_sketches)
+                for statement in ddl:
+                    conn.execute(text(statement))
+            stale = conn.execute(
+                text(
+                    f"""SELECT
+                        (SELECT count(*) FROM postcodes WHERE {_inside("latitude", "longitude")})
+                            != (SELECT coalesce(sum(n_postcodes), 0) FROM postcode_cells)
+                        OR EXISTS (SELECT 1 FROM postcode_cells WHERE level != {LEVEL})
+                        OR EXISTS (SELECT 1 FROM price_cells WHERE level != {LEVEL})
+                        OR (EXISTS (SELECT 1 FROM transactions)
+                            AND NOT EXISTS (SELECT 1 FROM price_cells))
+                        OR (SELECT count(*) FROM postcodes WHERE district_postcode IS NOT NULL)
+                            != (SELECT coalesce(sum(n_postcodes), 0) FROM area_postcodes
+                                WHERE kind = 'district')
+                        OR (EXISTS (SELECT 1 FROM transactions)
+                            AND NOT EXISTS (SELECT 1 FROM area_prices))
+                        OR ({int(with_sketches)} AND
+                            (SELECT coalesce(sum(n_sales), 0) FROM price_cells)
+                            != (SELECT coalesce(sum(n_sales), 0) FROM price_sketches))"""
+                )
+            ).scalar()
+            if stale:
+                if read_only:
+                    return False
+                rebuild_aggregates(conn, with_sketches)
+    except OperationalError:
+        # SQLite too old for upserts in triggers, or a read-only db without aggregates
+        return False
+    enabled = True
+    sketches_enabled = with_sketches
+    return True
+
+
+def rebuild_aggregates(conn, with_sketches: bool = True) -> None:
+    """Recompute the aggregate tables from the raw rows."""
+    _, rebuild = statements(with_sketches)
+    for statement in rebuild:
+        conn.execute(text(statement))
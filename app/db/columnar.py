@@ -0,0 +1,189 @@
+"""In-process columnar copy of the postcode gazetteer.
+
+The postcodes table is essentially static, so it can be loaded once at startup into
+compact NumPy arrays and searched without any SQL. Rows are sorted by latitude band and
+then by longitude within each band, so a bounding box is one ``searchsorted`` per band
+for its longitude range followed by an exact latitude check on the gathered rows.
+
+The arrays are swapped as a single ``_Columns`` tuple on every change, so readers on
+other threads always see a consistent snapshot. Writers copy the arrays they change, so
+they are serialised by a lock, else two of them racing would each copy the old arrays
+and the last swap would drop the other's row.
+"""
+
+import threading
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.const import UK_LAT_BOUNDS, UK_LON_BOUNDS
+from app.core.config import config
+from app.models.postcodes import Postcodes
+
+# Multiplier separating bands in the combined sort key; larger than any longitude span
+_BAND_STRIDE = 1000.0
+
+
+class _Columns(NamedTuple):
+    key: np.ndarray
+    ids: np.ndarray
+    postcodes: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+
+
+class PostcodeStore:
+    """Postcode, latitude and longitude columns sorted for bounding-box search.
+
+    Args:
+        band_width (float): Height in degrees of the latitude bands.
+    """
+
+    def __init__(self, band_width: float = 0.01):
+        self.band_width = band_width
+        self._columns: _Columns | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._columns is not None
+
+    def __len__(self) -> int:
+        return 0 if self._columns is None else len(self._columns.key)
+
+    def _band(self, lats) -> np.ndarray:
+        return np.floor((np.asarray(lats, dtype=np.float64) - UK_LAT_BOUNDS[0]) / self.band_width)
+
+    def _key(self, bands, lons) -> np.ndarray:
+        """Sort key ordering rows by band, then by longitude within the band."""
+        return bands * _BAND_STRIDE + (np.asarray(lons, dtype=np.float64) - UK_LON_BOUNDS[0])
+
+    def build(self, ids, postcodes, lats, lons) -> None:
+        """Replace the store contents with the given rows."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        key = self._key(self._band(lats), lons)
+        order = np.argsort(key, kind="stable")
+        with self._lock:
+            self._columns = _Columns(
+                key=key[order],
+                ids=np.asarray(ids, dtype=np.int32)[order],
+                postcodes=np.asarray(postcodes, dtype="S8")[order],
+                latitude=lats[order],
+                longitude=lons[order],
+            )
+
+    def _search(
+        self, columns: _Columns, min_lat: float, max_lat: float, min_lon: float, max_lon: float
+    ) -> np.ndarray:
+        """Positions in ``columns`` of the rows inside the box, bounds inclusive."""
+        bands = np.arange(self._band(min_lat), self._band(max_lat) + 1)
+        lo = np.searchsorted(columns.key, self._key(bands, min_lon), side="left")
+        hi = np.searchsorted(columns.key, self._key(bands, max_lon), side="right")
+
+        # Concatenate the ranges [lo, hi) of every band without a Python loop
+        lengths = np.maximum(hi - lo, 0)
+        starts = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+        positions = starts + np.arange(lengths.sum())
+
+        # Only the first and last bands can hold rows outside the latitude range
+        lats = columns.latitude[positions]
+        return positions[(lats >= min_lat) & (lats <= max_lat)]
+
+    def search_frame(
+        self, min_lat: float, max_lat: float, min_lon: float, max_lon: float
+    ) -> pd.DataFrame:
+        """DataFrame of the rows inside the box, bounds inclusive, named like the
+        postcodes table.
+
+        The rows are searched and gathered from one snapshot of the columns, so a write
+        swapping in new ones meanwhile cannot shift the positions found.
+        """
+        columns = self._columns
+        positions = self._search(columns, min_lat, max_lat, min_lon, max_lon)
+        return pd.DataFrame(
+            {
+                "id": columns.ids[positions],
+                "full_postcode": np.char.decode(columns.postcodes[positions], "ascii"),
+                "latitude": columns.latitude[positions],
+                "longitude": columns.longitude[positions],
+            }
+        )
+
+    def add(self, id: int, postcode: str, lat: float, lon: float) -> None:
+        """Insert a single row at its sorted position."""
+        with self._lock:
+            columns = self._columns
+            if columns is None:
+                return
+            key = self._key(self._band(lat), lon)
+            at = np.searchsorted(columns.key, key, side="right")
+            self._columns = _Columns(
+                key=np.insert(columns.key, at, key),
+                ids=np.insert(columns.ids, at, id),
+                postcodes=np.insert(columns.postcodes, at, postcode.encode("ascii")),
+                latitude=np.insert(columns.latitude, at, lat),
+                longitude=np.insert(columns.longitude, at, lon),
+            )
+
+    def remove(self, postcode: str, lat: float, lon: float) -> None:
+        """Delete a single row, located through its coordinates."""
+        with self._lock:
+            columns = self._columns
+            if columns is None:
+                return
+            key = self._key(self._band(lat), lon)
+            lo = np.searchsorted(columns.key, key, side="left")
+            hi = np.searchsorted(columns.key, key, side="right")
+            matches = lo + np.flatnonzero(columns.postcodes[lo:hi] == postcode.encode("ascii"))
+            if len(matches) == 0:
+                return
+            self._columns = _Columns(*(np.delete(column, matches) for column in columns))
+
+    def patch(self, removed: pd.DataFrame, added: pd.DataFrame) -> None:
+        """Delete and insert many rows with a single copy of every column.
+
+        Args:
+            removed (pd.DataFrame): "full_postcode", "latitude" and "longitude" of the
+                rows to delete, located as in ``remove``.
+            added (pd.DataFrame): "id", "full_postcode", "latitude" and "longitude" of
+                the rows to insert, after the deletions.
+        """
+        with self._lock:
+            columns = self._columns
+            if columns is None:
+                return
+            keep = np.ones(len(columns.key), dtype=bool)
+            gone = self._key(self._band(removed["latitude"]), removed["longitude"])
+            los = np.searchsorted(columns.key, gone, side="left")
+            his = np.searchsorted(columns.key, gone, side="right")
+            for lo, hi, postcode in zip(los, his, removed["full_postcode"]):
+                matches = columns.postcodes[lo:hi] == postcode.encode("ascii")
+                keep[lo + np.flatnonzero(matches)] = False
+            columns = _Columns(*(column[keep] for column in columns))
+
+            key = self._key(self._band(added["latitude"]), added["longitude"])
+            order = np.argsort(key, kind="stable")
+            at = np.searchsorted(columns.key, key[order], side="right")
+            new = _Columns(
+                key=key,
+                ids=added["id"].to_numpy(dtype=np.int32),
+                postcodes=added["full_postcode"].to_numpy().astype("S8"),
+                latitude=added["latitude"].to_numpy(dtype=np.float64),
+                longitude=added["longitude"].to_numpy(dtype=np.float64),
+            )
+            self._columns = _Columns(
+                *(np.insert(column, at, values[order]) for column, values in zip(columns, new))
+            )
+
+
+store = PostcodeStore(band_width=config.store.band_width)
+
+
+def load(db: Session) -> None:
+    """Fill the store from every postcode in the db."""
+    q = db.query(Postcodes.id, Postcodes.full_postcode, Postcodes.latitude, Postcodes.longitude)
+    df = pd.read_sql(q.statement, q.session.bind)
+    store.build(df["id"], df["full_postcode"], df["latitude"], df["longitude"])
@@ -0,0 +1,217 @@
+"""In-process k-d tree for radius and nearest-postcode searches.
+
+Postcodes are indexed as 3D unit vectors on the sphere, where the straight-line (chord)
+distance between two points grows monotonically with their great-circle distance. A
+radius of ``d`` km is therefore exactly a ball of chord ``2 sin(d / 2R)`` around the
+query point, and the nearest points by chord are the nearest by haversine, so a plain
+Euclidean k-d tree answers both queries without any distortion near the poles or the
+antimeridian.
+
+The tree is static. Postcodes added since it was built are kept in a small buffer that
+is searched by brute force, and deleted ones are masked out; once the buffer and the
+mask together exceed ``config.nearest.rebuild_after`` rows the tree is rebuilt from the
+live rows. As in ``columnar``, every change swaps in a new ``_Index`` tuple, so readers
+on other threads always see a consistent snapshot.
+"""
+
+import threading
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.const import EARTH_RADIUS_KM
+from app.core.config import config
+from app.models.postcodes import Postcodes
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+def unit_vectors(lats, lons) -> np.ndarray:
+    """Points on the unit sphere, one row of x, y, z per coordinate."""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.column_stack(
+        (np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats))
+    )
+
+
+def haversine_km(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """Great-circle distance in km from one point to each of many."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _Rows(NamedTuple):
+    ids: np.ndarray
+    postcodes: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+
+    @classmethod
+    def of(cls, ids, postcodes, lats, lons) -> "_Rows":
+        return cls(
+            ids=np.asarray(ids, dtype=np.int32),
+            postcodes=np.asarray(postcodes, dtype="S"),
+            latitude=np.asarray(lats, dtype=np.float64),
+            longitude=np.asarray(lons, dtype=np.float64),
+        )
+
+    def take(self, positions) -> "_Rows":
+        return _Rows(*(column[positions] for column in self))
+
+    def concat(self, other: "_Rows") -> "_Rows":
+        return _Rows(*(np.concatenate(pair) for pair in zip(self, other)))
+
+
+class _Index(NamedTuple):
+    tree: "cKDTree"
+    # Rows the tree was built from, and which of them are still present
+    rows: _Rows
+    live: np.ndarray
+    n_deleted: int
+    # Rows added since the tree was built
+    added: _Rows
+
+
+class PostcodeTree:
+    """Radius and k-nearest postcode search over a k-d tree of unit vectors.
+
+    Args:
+        rebuild_after (int): Rows added or deleted since the last build before the tree
+            is rebuilt.
+    """
+
+    def __init__(self, rebuild_after: int = 1_000):
+        self.rebuild_after = rebuild_after
+        self._index: _Index | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    def __len__(self) -> int:
+        index = self._index
+        if index is None:
+            return 0
+        return len(index.rows.ids) - index.n_deleted + len(index.added.ids)
+
+    def _build(self, rows: _Rows) -> _Index:
+        return _Index(
+            tree=cKDTree(unit_vectors(rows.latitude, rows.longitude)),
+            rows=rows,
+            live=np.ones(len(rows.ids), dtype=bool),
+            n_deleted=0,
+            added=rows.take(slice(0, 0)),
+        )
+
+    def build(self, ids, postcodes, lats, lons) -> None:
+        """Replace the tree with one over the given rows."""
+        if cKDTree is None:
+            raise ImportError("The nearest-postcode index needs scipy installed")
+        index = self._build(_Rows.of(ids, postcodes, lats, lons))
+        with self._lock:
+            self._index = index
+
+    def _frame(self, rows: _Rows, distances: np.ndarray, limit: int) -> pd.DataFrame:
+        order = np.argsort(distances, kind="stable")[:limit]
+        return pd.DataFrame(
+            {
+                "id": rows.ids[order],
+                "full_postcode": np.char.decode(rows.postcodes[order], "ascii"),
+                "latitude": rows.latitude[order],
+                "longitude": rows.longitude[order],
+                "distance_km": distances[order],
+            }
+        )
+
+    def _candidates(self, index: _Index, positions: np.ndarray) -> _Rows:
+        """Live tree rows at ``positions``, followed by every added row."""
+        positions = positions[index.live[positions]]
+        return index.rows.take(positions).concat(index.added)
+
+    def radius(self, lat: float, lon: float, km: float, limit: int) -> pd.DataFrame:
+        """Postcodes within ``km`` of a point, nearest first.
+
+        Returns:
+            pd.DataFrame: Up to ``limit`` rows with their ``distance_km``.
+        """
+        index = self._index
+        chord = 2 * np.sin(min(km / (2 * EARTH_RADIUS_KM), np.pi / 2))
+        positions = np.asarray(
+            index.tree.query_ball_point(unit_vectors([lat], [lon])[0], chord), dtype=np.int64
+        )
+        rows = self._candidates(index, positions)
+        distances = haversine_km(lat, lon, rows.latitude, rows.longitude)
+        inside = distances <= km
+        return self._frame(rows.take(inside), distances[inside], limit)
+
+    def nearest(self, lat: float, lon: float, k: int) -> pd.DataFrame:
+        """The ``k`` postcodes nearest to a point, nearest first."""
+        index = self._index
+        n = len(index.rows.ids)
+        # Deleted rows may be among the nearest, so ask for enough to skip them all
+        kk = min(k + index.n_deleted, n)
+        positions = np.zeros(0, dtype=np.int64)
+        if kk > 0:
+            _, positions = index.tree.query(unit_vectors([lat], [lon])[0], k=[*range(1, kk + 1)])
+            positions = np.asarray(positions, dtype=np.int64)
+            positions = positions[positions < n]
+        rows = self._candidates(index, positions)
+        return self._frame(rows, haversine_km(lat, lon, rows.latitude, rows.longitude), k)
+
+    def _patched(self, index: _Index) -> None:
+        """Swap in a patched index, rebuilt once it has drifted too far from its tree."""
+        if index.n_deleted + len(index.added.ids) > self.rebuild_after:
+            index = self._build(index.rows.take(index.live).concat(index.added))
+        self._index = index
+
+    def add(self, id: int, postcode: str, lat: float, lon: float) -> None:
+        """Make a new postcode searchable."""
+        with self._lock:
+            index = self._index
+            if index is None:
+                return
+            added = index.added.concat(_Rows.of([id], [postcode], [lat], [lon]))
+            self._patched(index._replace(added=added))
+
+    def remove(self, postcode: str) -> None:
+        """Stop returning a deleted postcode."""
+        key = postcode.encode("ascii")
+        with self._lock:
+            index = self._index
+            if index is None:
+                return
+            in_added = index.added.postcodes == key
+            if in_added.any():
+                self._patched(index._replace(added=index.added.take(~in_added)))
+                return
+            matches = np.flatnonzero((index.rows.postcodes == key) & index.live)
+            if len(matches) == 0:
+                return
+            live = index.live.copy()
+            live[matches] = False
+            self._patched(
+                index._replace(live=live, n_deleted=index.n_deleted + len(matches))
+            )
+
+
+tree = PostcodeTree(rebuild_after=config.nearest.rebuild_after)
+
+
+def load(db: Session) -> None:
+    """Build the tree over every postcode in the db."""
+    q = db.query(Postcodes.id, Postcodes.full_postcode, Postcodes.latitude, Postcodes.longitude)
+    df = pd.read_sql(q.statement, q.session.bind)
+    tree.build(df["id"], df["full_postcode"], df["latitude"], df["longitude"])
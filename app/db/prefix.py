@@ -0,0 +1,195 @@
+"""In-process prefix index for postcode autocomplete and lookup.
+
+Postcodes are keyed by their normalised form with the space taken out, e.g. "KT62AB",
+and held in one sorted byte-string array. Every postcode starting with a prefix is then
+a contiguous run of the array, found with two binary searches, so the top ``k``
+completions cost ``O(log n + k)`` whatever the prefix, and a typed "kt6 2", "KT62" or
+" kt62 " all land on the same run.
+
+As in ``columnar``, every change swaps in a new ``_Keys`` tuple, so readers on other
+threads always see a consistent snapshot.
+"""
+
+import re
+import threading
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.models.postcodes import Postcodes
+
+# Length of the inward code, the part of a postcode after the space
+INWARD_LENGTH = 3
+# Characters commonly mistyped for one another in postcodes
+_CONFUSABLE = {"0": "O", "O": "0", "1": "I", "I": "1", "5": "S", "S": "5", "8": "B", "B": "8"}
+
+
+def compact_postcode(text: str) -> str:
+    """A postcode or prefix in upper case with every space taken out, the index key."""
+    return re.sub(r"\s+", "", text).upper()
+
+
+def normalise_postcode(text: str) -> str:
+    """A postcode in the stored form, e.g. " kt62ab" as "KT6 2AB".
+
+    Case and spacing are dropped and a single space put before the inward code, where
+    ``crud.postcodes.create`` splits the outward code off. Text too short to hold an
+    inward code is returned compacted.
+    """
+    key = compact_postcode(text)
+    if len(key) <= INWARD_LENGTH:
+        return key
+    return f"{key[:-INWARD_LENGTH]} {key[-INWARD_LENGTH:]}"
+
+
+class _Keys(NamedTuple):
+    keys: np.ndarray
+    postcodes: np.ndarray
+    latitude: np.ndarray
+    longitude: np.ndarray
+
+
+class PrefixIndex:
+    """Postcodes sorted by their compacted form for prefix and exact lookups."""
+
+    def __init__(self):
+        self._keys: _Keys | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._keys is not None
+
+    def __len__(self) -> int:
+        return 0 if self._keys is None else len(self._keys.keys)
+
+    def build(self, postcodes, lats, lons) -> None:
+        """Replace the index with one over the given rows."""
+        postcodes = np.asarray(postcodes, dtype=object)
+        keys = np.asarray([compact_postcode(p).encode("ascii") for p in postcodes], dtype="S8")
+        order = np.argsort(keys, kind="stable")
+        with self._lock:
+            self._keys = _Keys(
+                keys=keys[order],
+                postcodes=postcodes[order].astype("S8"),
+                latitude=np.asarray(lats, dtype=np.float64)[order],
+                longitude=np.asarray(lons, dtype=np.float64)[order],
+            )
+
+    def _frame(self, keys: _Keys, positions) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "full_postcode": np.char.decode(keys.postcodes[positions], "ascii"),
+                "latitude": keys.latitude[positions],
+                "longitude": keys.longitude[positions],
+            }
+        )
+
+    def complete(self, prefix: str, k: int) -> pd.DataFrame:
+        """The first ``k`` postcodes, in key order, starting with a prefix."""
+        keys = self._keys
+        key = compact_postcode(prefix).encode("ascii", "ignore")
+        lo = np.searchsorted(keys.keys, key, side="left")
+        # Every key with the prefix sorts before the prefix followed by the highest byte
+        hi = np.searchsorted(keys.keys, key + b"\xff", side="left")
+        return self._frame(keys, slice(lo, min(hi, lo + k)))
+
+    def lookup(self, postcodes: list[str]) -> pd.DataFrame:
+        """Rows of those of the postcodes held, matched on their compacted form."""
+        keys = self._keys
+        wanted = np.asarray(
+            [compact_postcode(p).encode("ascii", "ignore") for p in postcodes], dtype="S"
+        )
+        positions = np.searchsorted(keys.keys, wanted)
+        positions = positions[positions < len(keys.keys)]
+        found = positions[np.isin(keys.keys[positions], wanted)]
+        return self._frame(keys, np.unique(found))
+
+    def add(self, postcode: str, lat: float, lon: float) -> None:
+        """Insert a single row at its sorted position."""
+        with self._lock:
+            keys = self._keys
+            if keys is None:
+                return
+            key = compact_postcode(postcode).encode("ascii")
+            at = np.searchsorted(keys.keys, key, side="right")
+            self._keys = _Keys(
+                keys=np.insert(keys.keys, at, key),
+                postcodes=np.insert(keys.postcodes, at, postcode.encode("ascii")),
+                latitude=np.insert(keys.latitude, at, lat),
+                longitude=np.insert(keys.longitude, at, lon),
+            )
+
+    def remove(self, postcode: str) -> None:
+        """Delete the rows of a postcode."""
+        with self._lock:
+            keys = self._keys
+            if keys is None:
+                return
+            key = compact_postcode(postcode).encode("ascii")
+            lo = np.searchsorted(keys.keys, key, side="left")
+            hi = np.searchsorted(keys.keys, key, side="right")
+            matches = lo + np.flatnonzero(keys.postcodes[lo:hi] == postcode.encode("ascii"))
+            if len(matches) == 0:
+                return
+            self._keys = _Keys(*(np.delete(column, matches) for column in keys))
+
+    def patch(self, removed: list[str], added: pd.DataFrame) -> None:
+        """Delete and insert many rows with a single copy of every column.
+
+        Args:
+            removed (list[str]): Postcodes whose rows are deleted.
+            added (pd.DataFrame): "full_postcode", "latitude" and "longitude" of the
+                rows to insert, after the deletions.
+        """
+        with self._lock:
+            keys = self._keys
+            if keys is None:
+                return
+            keep = np.ones(len(keys.keys), dtype=bool)
+            gone = np.asarray(
+                [compact_postcode(p).encode("ascii") for p in removed], dtype="S8"
+            )
+            los = np.searchsorted(keys.keys, gone, side="left")
+            his = np.searchsorted(keys.keys, gone, side="right")
+            for lo, hi, postcode in zip(los, his, removed):
+                matches = keys.postcodes[lo:hi] == postcode.encode("ascii")
+                keep[lo + np.flatnonzero(matches)] = False
+            keys = _Keys(*(column[keep] for column in keys))
+
+            postcodes = added["full_postcode"].to_numpy(dtype=object)
+            key = np.asarray(
+                [compact_postcode(p).encode("ascii") for p in postcodes], dtype="S8"
+            )
+            order = np.argsort(key, kind="stable")
+            at = np.searchsorted(keys.keys, key[order], side="right")
+            new = _Keys(
+                keys=key,
+                postcodes=postcodes.astype("S8"),
+                latitude=added["latitude"].to_numpy(dtype=np.float64),
+                longitude=added["longitude"].to_numpy(dtype=np.float64),
+            )
+            self._keys = _Keys(
+                *(np.insert(column, at, values[order]) for column, values in zip(keys, new))
+            )
+
+
+def confusable_variants(postcode: str) -> list[str]:
+    """The compacted postcode with any one commonly mistyped character swapped, so
+    "KT6 2A8" is also tried as "KT62AB"."""
+    key = compact_postcode(postcode)
+    return [
+        key[:i] + _CONFUSABLE[c] + key[i + 1 :] for i, c in enumerate(key) if c in _CONFUSABLE
+    ]
+
+
+index = PrefixIndex()
+
+
+def load(db: Session) -> None:
+    """Build the index over every postcode in the db."""
+    q = db.query(Postcodes.full_postcode, Postcodes.latitude, Postcodes.longitude)
+    df = pd.read_sql(q.statement, q.session.bind)
+    index.build(df["full_postcode"], df["latitude"], df["longitude"])
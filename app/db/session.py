@@ -1,16 +1,79 @@
-"""Database session manager."""
+"""Database session manager.
+
+The app shares one engine and its connection pool. On SQLite every new connection is
+tuned with the pragmas of ``config.database``: WAL journaling so readers are never
+blocked by a writer, relaxed syncing, a larger page cache and memory-mapped reads, so
+concurrent reads scale with the number of workers instead of queueing on the file lock.
+A read-only engine opens the file with ``mode=ro`` and refuses writes, for API workers
+serving a replica.
+"""
 
 from contextlib import contextmanager
 from typing import Iterator
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine, event, make_url
 from sqlalchemy.orm import Session, sessionmaker
 
 from app.core.config import config
 
+
+def make_engine(dsn: str | None = None, read_only: bool | None = None) -> Engine:
+    """An engine for the db, with the pool and SQLite pragmas of ``config.database``.
+
+    Args:
+        dsn (str | None): Database URL, ``config.database.dsn`` if not given.
+        read_only (bool | None): Open the db read-only, ``config.database.read_only``
+            if not given.
+    """
+    opts = config.database
+    url = make_url(dsn or opts.dsn)
+    read_only = opts.read_only if read_only is None else read_only
+    if url.get_backend_name() != "sqlite":
+        return create_engine(
+            url,
+            pool_size=opts.pool_size,
+            max_overflow=opts.max_overflow,
+            pool_timeout=opts.pool_timeout,
+        )
+
+    kwargs = {}
+    if url.database and url.database != ":memory:":
+        # File databases are pooled; in-memory ones keep a connection per thread
+        kwargs = dict(
+            pool_size=opts.pool_size,
+            max_overflow=opts.max_overflow,
+            pool_timeout=opts.pool_timeout,
+        )
+        if read_only:
+            url = url.set(
+                database=f"file:{url.database}", query={**url.query, "mode": "ro", "uri": "true"}
+            )
+    engine = create_engine(url, connect_args={"check_same_thread": False}, **kwargs)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        if read_only:
+            # The journal mode belongs to the file and is left as the writer set it
+            cursor.execute("PRAGMA query_only = ON")
+        else:
+            cursor.execute(f"PRAGMA journal_mode = {opts.journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {opts.synchronous}")
+        # A negative cache size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size = -{opts.cache_size_kib}")
+        cursor.execute(f"PRAGMA mmap_size = {opts.mmap_size}")
+        cursor.execute(f"PRAGMA busy_timeout = {opts.busy_timeout_ms}")
+        cursor.close()
+
+    return engine
+
+
+# Engine shared by every session of the app
+engine = make_engine()
+
 # Use a factory to create new database sessions
 SessionFactory = sessionmaker(
-    bind=create_engine(config.database.dsn, connect_args={"check_same_thread": False}),
+    bind=engine,
     autocommit=False,
     autoflush=False,
     expire_on_commit=False,
@@ -34,8 +97,9 @@ def create_session() -> Iterator[Session]:
         # Flush changes to db
         session.commit()
     except:
-        # Take back any changes
+        # Take back any changes and let the error reach the handler
         session.rollback()
+        raise
     finally:
         # End the session safely
         session.close()
@@ -0,0 +1,124 @@
+"""SQLite R*Tree index over the coordinates of the postcodes table.
+
+The ``postcodes_rtree`` virtual table holds the id, latitude and longitude of every row
+in ``postcodes`` and is kept in sync by triggers, so inserts and deletes through the ORM,
+the CLI or raw SQL all maintain it. Bounding-box lookups go through the R*Tree to find
+the ids inside the box and then fetch those rows by primary key, instead of scanning
+every postcode.
+
+The R*Tree stores 32-bit floats rounded outwards, so it returns a superset of the box;
+callers keep their exact latitude/longitude predicates on top of ``within``. Boxes
+covering a large share of the table are faster as a plain scan than as one primary key
+lookup per row, so ``use_index`` only selects the R*Tree for boxes up to
+``config.database.rtree_max_area``.
+"""
+
+from sqlalchemy import Column, Engine, Float, Integer, MetaData, Table, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.core.config import config
+from app.models.postcodes import Postcodes
+
+RTREE_TABLE = "postcodes_rtree"
+
+# Kept out of Base.metadata so create_all never tries to create it as a normal table
+rtree = Table(
+    RTREE_TABLE,
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lat", Float),
+    Column("max_lat", Float),
+    Column("min_lon", Float),
+    Column("max_lon", Float),
+)
+
+RTREE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE}
+        USING rtree(id, min_lat, max_lat, min_lon, max_lon)""",
+    f"""CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_insert AFTER INSERT ON postcodes
+        BEGIN
+            INSERT INTO {RTREE_TABLE}
+            VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_update
+        AFTER UPDATE OF latitude, longitude ON postcodes
+        BEGIN
+            UPDATE {RTREE_TABLE}
+            SET min_lat = new.latitude, max_lat = new.latitude,
+                min_lon = new.longitude, max_lon = new.longitude
+            WHERE id = new.id;
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {RTREE_TABLE}_delete AFTER DELETE ON postcodes
+        BEGIN
+            DELETE FROM {RTREE_TABLE} WHERE id = old.id;
+        END""",
+]
+
+# Dropping the R*Tree is far quicker than deleting every entry from it
+RTREE_REBUILD = [
+    f"DROP TABLE IF EXISTS {RTREE_TABLE}",
+    RTREE_DDL[0],
+    f"""INSERT INTO {RTREE_TABLE}
+        SELECT id, latitude, latitude, longitude, longitude FROM postcodes""",
+]
+
+# Set once the index exists and is in sync with the postcodes table
+enabled = False
+
+
+def create_spatial_index(engine: Engine, read_only: bool = False) -> bool:
+    """Create the R*Tree and its triggers if missing, and backfill it from postcodes.
+
+    Does nothing on databases other than SQLite, or SQLite builds without the R*Tree
+    module, in which case lookups fall back to plain range predicates. A read-only db
+    is never changed and its R*Tree only used when it is complete.
+
+    Returns:
+        bool: Whether the index is available.
+    """
+    global enabled
+    if engine.dialect.name != "sqlite":
+        return False
+    try:
+        with engine.begin() as conn:
+            if not read_only:
+                for statement in RTREE_DDL:
+                    conn.execute(text(statement))
+            n_rows = conn.execute(text("SELECT count(*) FROM postcodes")).scalar()
+            n_indexed = conn.execute(text(f"SELECT count(*) FROM {RTREE_TABLE}")).scalar()
+            if n_rows != n_indexed:
+                if read_only:
+                    return False
+                rebuild_spatial_index(conn)
+    except OperationalError:
+        # SQLite compiled without the R*Tree module, or a read-only db without the index
+        return False
+    enabled = True
+    return True
+
+
+def rebuild_spatial_index(conn) -> None:
+    """Repopulate the R*Tree from the postcodes table."""
+    for statement in RTREE_REBUILD:
+        conn.execute(text(statement))
+
+
+def use_index(min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> bool:
+    """Whether a box lookup should go through the R*Tree."""
+    if not enabled or None in (min_lat, max_lat, min_lon, max_lon):
+        return False
+    area = (max_lat - min_lat) * (max_lon - min_lon)
+    return area <= config.database.rtree_max_area
+
+
+def within(min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> ColumnElement:
+    """Filter clause selecting postcodes whose R*Tree entry overlaps the box."""
+    return Postcodes.id.in_(
+        select(rtree.c.id).where(
+            rtree.c.max_lat >= min_lat,
+            rtree.c.min_lat <= max_lat,
+            rtree.c.max_lon >= min_lon,
+            rtree.c.min_lon <= max_lon,
+        )
+    )
@@ -1,18 +1,41 @@
 """Application runner"""
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 
-from sqlalchemy import create_engine
 from app.routers import postcodes
 
+from app.core import metrics
 from app.core.config import config
 from app.db.base import Base
+from app.db import aggregates, columnar, nearest, prefix, spatial
+from app.db.session import engine, open_session
+from app.services import parallel, tiles
 
 from fastapi.middleware.cors import CORSMiddleware
 
 origins = ["*",]
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build in-memory structures over the postcodes table before serving requests."""
+    with open_session() as db:
+        if config.store.enabled:
+            columnar.load(db)
+        if config.tiles.enabled:
+            tiles.load(db)
+        if config.nearest.enabled:
+            nearest.load(db)
+        if config.autocomplete.enabled:
+            prefix.load(db)
+    yield
+    parallel.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,12 +44,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the stage timings cover every other middleware
+app.add_middleware(metrics.TimingMiddleware)
 app.include_router(postcodes.router)
 
-# Create the database tables - Only needs to be done once then it can be commented out
-Base.metadata.create_all(
-    bind=create_engine(config.database.dsn, connect_args={"check_same_thread": False}),
-)
+# Create the database tables on the shared engine, unless serving a read-only replica
+if not config.database.read_only:
+    Base.metadata.create_all(bind=engine)
+# Spatial index for bounding-box lookups, backfilled if it is missing or out of sync
+spatial.create_spatial_index(engine, config.database.read_only)
+# Per-tile aggregates kept in sync by triggers, rebuilt if missing or out of sync
+aggregates.create_aggregates(engine, config.database.read_only)
 
 
 @app.get("/")
@@ -34,6 +62,12 @@ async def root():
     return {"message": "Hello root!"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics() -> PlainTextResponse:
+    """Request, stage and external call histograms in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/get_coordinates")
 async def read_item():
     return [
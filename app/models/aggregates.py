@@ -0,0 +1,82 @@
+"""SQLAlchemy models for per-tile and per-area aggregates maintained alongside the raw rows"""
+
+from sqlalchemy import Column, Date, Float, Integer, String
+from app.db.base import Base
+
+
+class PostcodeCells(Base):
+    """Number of postcodes in a tile of the deepest level of the tile pyramid."""
+
+    __tablename__ = "postcode_cells"
+
+    level = Column(Integer, primary_key=True)
+    row = Column(Integer, primary_key=True)
+    col = Column(Integer, primary_key=True)
+    n_postcodes = Column(Integer, nullable=False, default=0)
+
+
+class PriceCells(Base):
+    """Number and total amount of the sales in a tile within a calendar month."""
+
+    __tablename__ = "price_cells"
+
+    level = Column(Integer, primary_key=True)
+    row = Column(Integer, primary_key=True)
+    col = Column(Integer, primary_key=True)
+    month = Column(Date, primary_key=True)
+    n_sales = Column(Integer, nullable=False, default=0)
+    amount_sum = Column(Float, nullable=False, default=0.0)
+
+
+class PriceSketches(Base):
+    """Number of the sales in a tile and calendar month falling in a quantile sketch bucket."""
+
+    __tablename__ = "price_sketches"
+
+    level = Column(Integer, primary_key=True)
+    row = Column(Integer, primary_key=True)
+    col = Column(Integer, primary_key=True)
+    month = Column(Date, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    n_sales = Column(Integer, nullable=False, default=0)
+
+
+class AreaPostcodes(Base):
+    """Number, coordinate sums and bounding box of the postcodes of a district or subarea."""
+
+    __tablename__ = "area_postcodes"
+
+    kind = Column(String(8), primary_key=True)
+    area = Column(String(4), primary_key=True)
+    n_postcodes = Column(Integer, nullable=False, default=0)
+    lat_sum = Column(Float, nullable=False, default=0.0)
+    lon_sum = Column(Float, nullable=False, default=0.0)
+    min_lat = Column(Float)
+    max_lat = Column(Float)
+    min_lon = Column(Float)
+    max_lon = Column(Float)
+
+
+class AreaPrices(Base):
+    """Number and total amount of the sales in a district or subarea within a calendar month."""
+
+    __tablename__ = "area_prices"
+
+    kind = Column(String(8), primary_key=True)
+    area = Column(String(4), primary_key=True)
+    month = Column(Date, primary_key=True)
+    n_sales = Column(Integer, nullable=False, default=0)
+    amount_sum = Column(Float, nullable=False, default=0.0)
+
+
+class AreaSketches(Base):
+    """Number of the sales in a district or subarea and calendar month falling in a
+    quantile sketch bucket."""
+
+    __tablename__ = "area_sketches"
+
+    kind = Column(String(8), primary_key=True)
+    area = Column(String(4), primary_key=True)
+    month = Column(Date, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    n_sales = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,32 @@
+"""SQLAlchemy models for locally held HM Land Registry price paid data"""
+
+from sqlalchemy import Boolean, Column, Date, DateTime, Index, Integer, String
+from app.db.base import Base
+
+
+class Transactions(Base):
+    """A single price paid transaction, keyed by the Land Registry transaction id."""
+
+    __tablename__ = "transactions"
+
+    transaction_id = Column(String(38), primary_key=True)
+    postcode = Column(String(8), nullable=False)
+    date = Column(Date, nullable=False)
+    amount = Column(Integer, nullable=False)
+    property_type = Column(String(16))
+    estate_type = Column(String(16))
+    new_build = Column(Boolean)
+    category = Column(String(32))
+
+    __table_args__ = (Index("ix_transactions_postcode_date", "postcode", "date"),)
+
+
+class TransactionFetches(Base):
+    """The date window of transactions held for a postcode and when it was last fetched."""
+
+    __tablename__ = "transaction_fetches"
+
+    postcode = Column(String(8), primary_key=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    fetched_at = Column(DateTime, nullable=False)
@@ -3,81 +3,342 @@
 Serves at the UI interaction layer.
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+from dataclasses import asdict
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 
 from app.db.session import create_session
-from app.const import URL_SEARCH
+from app.const import MAX_AREAS, MAX_PERIODS, MAX_SERIES_CELLS, URL_SEARCH
 from app.schemas.postcodes import (
+    AreaKind,
+    AreaSummarySchema,
+    AutocompleteQuerySchema,
+    BatchQuerySchema,
+    BatchResultSchema,
+    GeocodeReportSchema,
+    PostcodeChangesSchema,
+    PostcodeChangesSummarySchema,
     PostcodeCreateSchema,
     PostcodeResponseSchema,
     PostcodeSchema,
-    GeometricSchema,
+    GridSchema,
+    PricesQuerySchema,
     PricesSchema,
+    PriceSeriesQuerySchema,
+    PriceSeriesSchema,
     LatLonSummarySchema,
     LatLonBoundsSchema,
+    NearbyPostcodeSchema,
+    NearestQuerySchema,
+    PolygonQuerySchema,
+    PostcodeMatchSchema,
+    RadiusQuerySchema,
+    ResponseFormat,
+)
+from app.crud.postcodes import create_async, delete_postcode_async
+from app.db.prefix import normalise_postcode
+from app.services import (
+    areas,
+    autocomplete,
+    batch,
+    cache,
+    calculations,
+    compact,
+    geocode,
+    landregistry,
+    maintenance,
+    nearby,
+    periods,
+    tiles,
 )
-from app.crud.postcodes import create, delete_postcode
-from app.services import calculations, landregistry
 
 # Set the base router
 router = APIRouter(prefix="/" + URL_SEARCH)
 
+
+def check_format(format: ResponseFormat) -> None:
+    """Reject encodings whose optional dependencies are missing."""
+    if not compact.available(format):
+        raise HTTPException(
+            status_code=422, detail=f"The {format.value} format needs pyarrow installed"
+        )
+
+
 @router.get("/average_prices", tags=["search"], response_model=list[PricesSchema])
-async def avg_prices(query_data: GeometricSchema = Depends(), db: Session = Depends(create_session)
+async def avg_prices(
+    query_data: PricesQuerySchema = Depends(),
+    percentiles: list[float] = Query([]),
+    db: Session = Depends(create_session),
 ) -> list[PricesSchema]:
-    """Query the external historical house price service."""
+    """Query the external historical house price service.
+
+    Percentiles, from 0 to 100, can be requested on top of the medians, e.g.
+    ``percentiles=10&percentiles=90``.
+    """
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise HTTPException(status_code=422, detail="Percentiles must be between 0 and 100")
+    check_format(query_data.format)
+
+    async def compute(bounds: PricesQuerySchema):
+        if bounds.format is ResponseFormat.FULL:
+            return await landregistry.price_data(bounds, db, percentiles)
+        columns = await landregistry.price_columns(bounds, db, percentiles)
+        return compact.encode(bounds.format, bounds, columns)
+
     try:
-        # Separate the latitude and longitude by size
-        return await landregistry.price_data(query_data, db)
+        result = await cache.cached(f"average_prices{sorted(percentiles)}", query_data, compute)
+        return compact.respond(query_data.format, result)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@router.get("/price_series", tags=["search"], response_model=list[PriceSeriesSchema])
+async def price_series(
+    query_data: PriceSeriesQuerySchema = Depends(), db: Session = Depends(create_session)
+) -> list[PriceSeriesSchema]:
+    """Sales, mean and median price of every sub-square by month, quarter or year."""
+    if query_data.start and query_data.end and query_data.start > query_data.end:
+        raise HTTPException(status_code=422, detail="start must not be after end")
+    start, end = landregistry.series_window(query_data, date.today())
+    nperiods = len(periods.period_starts(start, end, query_data.interval))
+    if nperiods > MAX_PERIODS or query_data.nbins**2 * nperiods > MAX_SERIES_CELLS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {MAX_PERIODS} periods and {MAX_SERIES_CELLS} sub-squares "
+            "times periods can be asked for",
+        )
+    check_format(query_data.format)
+
+    async def compute(bounds: PriceSeriesQuerySchema):
+        if bounds.format is ResponseFormat.FULL:
+            return await landregistry.price_series(bounds, db)
+        starts, columns = await landregistry.series_columns(bounds, db)
+        return compact.encode(
+            bounds.format,
+            bounds,
+            columns,
+            periods=[start.isoformat() for start in starts],
+        )
+
+    try:
+        result = await cache.cached("price_series", query_data, compute)
+        return compact.respond(query_data.format, result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
 @router.get("/npostcodes", tags=["search"], response_model=list[LatLonSummarySchema])
 async def npostcodes(
-    query_data: GeometricSchema = Depends(), db: Session = Depends(create_session)
+    query_data: GridSchema = Depends(), db: Session = Depends(create_session)
 ) -> list[LatLonSummarySchema]:
     """Searches based purely on a maximum and minimum latitude/longitude."""
+    check_format(query_data.format)
+
+    async def compute(bounds: GridSchema):
+        if bounds.format is ResponseFormat.FULL:
+            return await calculations.npostcodes(bounds, db)
+        counts = await calculations.grid_counts(bounds, db)
+        return compact.encode(bounds.format, bounds, {"n_postcodes": counts})
+
     try:
-        # Separate the latitude and longitude by size
-        return await calculations.npostcodes(query_data, db)
+        result = await cache.cached("npostcodes", query_data, compute)
+        return compact.respond(query_data.format, result)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
 @router.get("/subsquares", tags=["search"], response_model=list[LatLonBoundsSchema])
 async def subsquares(
-    query_data: GeometricSchema = Depends(), db: Session = Depends(create_session)
+    query_data: GridSchema = Depends(), db: Session = Depends(create_session)
 ) -> list[LatLonBoundsSchema]:
     """Returns equidistant subsquares from single square.
     """
-    try:
+    check_format(query_data.format)
+
+    async def compute(bounds: GridSchema):
+        if bounds.format is not ResponseFormat.FULL:
+            # The grid alone describes every sub-square
+            return compact.encode(bounds.format, bounds, {})
         # Separate the latitude and longitude by size
-        lats = (query_data.min_lat, query_data.max_lat)
-        lons = (query_data.min_lon, query_data.max_lon)
-        sub_squares = await calculations.separate_by_size(lats, lons)
-        return sub_squares
+        lats = (bounds.min_lat, bounds.max_lat)
+        lons = (bounds.min_lon, bounds.max_lon)
+        return await calculations.separate_by_size(lats, lons, bounds.nbins)
+
+    try:
+        result = await cache.cached("subsquares", query_data, compute)
+        return compact.respond(query_data.format, result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/batch", tags=["search"], response_model=list[BatchResultSchema])
+async def batch_search(
+    query: BatchQuerySchema, db: Session = Depends(create_session)
+) -> list[BatchResultSchema]:
+    """Grids of several boxes in one request, each box's postcodes read and its prices
+    fetched from the Land Registry at most once across the batch."""
+    bounds = lambda box: (box.min_lat, box.max_lat, box.min_lon, box.max_lon)
+    if any(None in bounds(box) for box in query.boxes):
+        raise HTTPException(status_code=422, detail="Every box needs all four bounds")
+    try:
+        return await batch.batch_search(query, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/radius", tags=["search"], response_model=list[NearbyPostcodeSchema])
+async def radius(
+    query_data: RadiusQuerySchema = Depends(), db: Session = Depends(create_session)
+) -> list[NearbyPostcodeSchema]:
+    """Postcodes within a great-circle distance of a point, nearest first."""
+    try:
+        return await nearby.radius_search(query_data, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/nearest", tags=["search"], response_model=list[NearbyPostcodeSchema])
+async def nearest(
+    query_data: NearestQuerySchema = Depends(), db: Session = Depends(create_session)
+) -> list[NearbyPostcodeSchema]:
+    """The postcodes nearest to a point, nearest first."""
+    try:
+        return await nearby.nearest_search(query_data, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/autocomplete", tags=["search"], response_model=list[PostcodeMatchSchema])
+async def autocomplete_postcodes(
+    query_data: AutocompleteQuerySchema = Depends(), db: Session = Depends(create_session)
+) -> list[PostcodeMatchSchema]:
+    """Postcodes starting with a typed prefix, whatever its case and spacing."""
+    try:
+        return await autocomplete.complete(query_data, db)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@router.get("/lookup", tags=["search"], response_model=list[PostcodeMatchSchema])
+async def lookup_postcode(
+    postcode: str = Query(..., min_length=5, max_length=10, pattern=r"^[A-Za-z0-9 ]+$"),
+    db: Session = Depends(create_session),
+) -> list[PostcodeMatchSchema]:
+    """A postcode typed in any case and spacing, or its near misses when it is not held."""
+    try:
+        return await autocomplete.lookup(postcode, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/geocode", tags=["search"])
+async def geocode_file(request: Request, column: str = Query("postcode")):
+    """Coordinates of every row of a CSV or NDJSON upload, streamed back as the file is
+    read, e.g. ``curl --data-binary @in.csv -H "Content-Type: text/csv"``.
+
+    Rows keep their order and gain a latitude and longitude, empty when their postcode
+    is not found. The ``X-Geocode-Job`` header names the job whose report, with its first
+    unmatched rows, is served at ``/geocode/{job}``.
+    """
+    format = geocode.format_of(request.headers.get("content-type"))
+    if format is None:
+        raise HTTPException(
+            status_code=415, detail="Upload text/csv or application/x-ndjson"
+        )
+    report = geocode.new_report()
+    return geocode.UploadStreamingResponse(
+        geocode.geocode_stream(request.stream(), format, column, report),
+        media_type=geocode.MEDIA_TYPES[format],
+        headers={"X-Geocode-Job": report.job},
+    )
+
+
+@router.get("/geocode/{job}", tags=["search"], response_model=GeocodeReportSchema)
+async def geocode_report(job: str) -> GeocodeReportSchema:
+    """Counts and unmatched rows of a bulk geocoding job."""
+    report = geocode.reports.get(job)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return GeocodeReportSchema(**asdict(report))
+
+
+@router.get("/areas", tags=["search"], response_model=list[AreaSummarySchema])
+async def area_summaries(
+    kind: AreaKind = Query(AreaKind.DISTRICT),
+    areas_: list[str] = Query(..., alias="areas"),
+    db: Session = Depends(create_session),
+) -> list[AreaSummarySchema]:
+    """Postcodes and sales of whole districts or subareas, e.g.
+    ``kind=subarea&areas=KT6&areas=KT5``, read from the stored area rollups."""
+    if not 1 <= len(areas_) <= MAX_AREAS:
+        raise HTTPException(
+            status_code=422, detail=f"Between 1 and {MAX_AREAS} areas can be summarised"
+        )
+    try:
+        return await areas.area_summaries(kind, areas_, db)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/polygon", tags=["search"], response_model=AreaSummarySchema)
+async def polygon(
+    query: PolygonQuerySchema, db: Session = Depends(create_session)
+) -> AreaSummarySchema:
+    """Postcodes inside a polygon and their sales over two and five years."""
+    try:
+        return await areas.polygon_summary(query, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.get("/cache", tags=["search"])
+async def cache_stats() -> dict:
+    """Hit, miss and eviction counters of the response cache."""
+    return cache.responses.stats()
+
+
 @router.post("/add", tags=["search"], response_model=PostcodeResponseSchema)
 async def create_latlons(
     item: PostcodeCreateSchema, db: Session = Depends(create_session)
 ):
     """Create an item in the data base from a postcode, latitude and longitude."""
     try:
-        answer = create(db, item)
+        answer = await create_async(db, item)
+        tiles.pyramid.add(item.lat, item.lon)
+        cache.responses.invalidate(item.lat, item.lon)
         return answer
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@router.post("/bulk", tags=["search"], response_model=PostcodeChangesSummarySchema)
+async def bulk_changes(
+    changes: PostcodeChangesSchema, db: Session = Depends(create_session)
+) -> PostcodeChangesSummarySchema:
+    """Add, move and delete many postcodes in one transaction, or with ``dry_run`` only
+    count what would change."""
+    postcodes = [normalise_postcode(u.postcode) for u in changes.upserts]
+    postcodes += [normalise_postcode(p) for p in changes.deletes]
+    if len(set(postcodes)) != len(postcodes):
+        raise HTTPException(
+            status_code=422, detail="Every postcode can be upserted or deleted only once"
+        )
+    try:
+        return await maintenance.apply_changes(changes, db)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
 @router.delete("/{postcode}", tags=["search"], status_code=204)
 async def delete_item(postcode: str, db: Session = Depends(create_session)):
     """Delete an entry in the db if it is present."""
     try:
-        delete_postcode(db, postcode)
+        item = await delete_postcode_async(db, postcode)
+        tiles.pyramid.add(item.latitude, item.longitude, -1)
+        cache.responses.invalidate(item.latitude, item.longitude)
     except HTTPException as e:
         raise e
     except Exception as e:
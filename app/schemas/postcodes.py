@@ -1,10 +1,21 @@
 """Schema for model response containing lat and lon data.
 """
 
-from typing import Optional
-from datetime import datetime
+from enum import Enum
+from typing import Annotated, Optional
+from datetime import date, datetime
 from pydantic import BaseModel, Field
 
+from app.const import (
+    MAX_BATCH_BOXES,
+    MAX_BULK_CHANGES,
+    MAX_COMPLETIONS,
+    MAX_NBINS,
+    MAX_NEAREST,
+    MAX_POLYGON_POINTS,
+    MAX_RADIUS_KM,
+)
+
 
 class GeometricSchema(BaseModel):
     min_lat: Optional[float] = Field(None)
@@ -13,6 +24,95 @@ class GeometricSchema(BaseModel):
     max_lon: Optional[float] = Field(None)
 
 
+class ResponseFormat(str, Enum):
+    """Encoding of a grid response, see ``services.compact`` for the compact ones."""
+
+    FULL = "full"
+    COMPACT = "compact"
+    BINARY = "binary"
+    ARROW = "arrow"
+
+
+class GridSchema(GeometricSchema):
+    """A bounding box split into ``nbins`` x ``nbins`` sub-squares."""
+
+    nbins: int = Field(10, ge=1, le=MAX_NBINS)
+    #:format: a model per sub-square, or the grid once and its values as flat columns.
+    format: ResponseFormat = Field(ResponseFormat.FULL)
+
+
+class PricesQuerySchema(GridSchema):
+    """A price grid, optionally answered from quantile sketches."""
+
+    #:approximate: allows quantiles within 1% of the exact value, served from sketches.
+    approximate: bool = Field(False)
+
+
+class Interval(str, Enum):
+    """Length of the periods a price series is bucketed into."""
+
+    MONTH = "month"
+    QUARTER = "quarter"
+    YEAR = "year"
+
+
+class PriceSeriesQuerySchema(GridSchema):
+    """A price grid bucketed over time."""
+
+    #:start: first day of the series, defaults to five years before the end.
+    start: Optional[date] = Field(None)
+    #:end: last day of the series, defaults to today.
+    end: Optional[date] = Field(None)
+    interval: Interval = Field(Interval.YEAR)
+    #:approximate: allows the series to be read from the stored monthly tile aggregates.
+    approximate: bool = Field(False)
+
+
+class PointSchema(BaseModel):
+    """A point to search around."""
+
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+
+
+class RadiusQuerySchema(PointSchema):
+    """Postcodes within a distance of a point."""
+
+    #:radius_km: great-circle distance from the point.
+    radius_km: float = Field(..., gt=0, le=MAX_RADIUS_KM)
+    #:limit: most postcodes returned, nearest first.
+    limit: int = Field(1000, ge=1, le=10_000)
+
+
+class NearestQuerySchema(PointSchema):
+    """The postcodes nearest to a point."""
+
+    k: int = Field(1, ge=1, le=MAX_NEAREST)
+
+
+class AutocompleteQuerySchema(BaseModel):
+    """Postcodes starting with a typed prefix, whatever its case and spacing."""
+
+    q: str = Field(..., min_length=1, max_length=10, pattern=r"^[A-Za-z0-9 ]+$")
+    k: int = Field(10, ge=1, le=MAX_COMPLETIONS)
+
+
+class AreaKind(str, Enum):
+    """Postcode areas with stored rollups, named after their column in ``postcodes``."""
+
+    DISTRICT = "district"
+    SUBAREA = "subarea"
+
+
+class PolygonQuerySchema(BaseModel):
+    """A polygon to summarise the postcodes and sales within."""
+
+    #:points: vertices as (lat, lon) pairs in order, the last joined back to the first.
+    points: list[
+        tuple[Annotated[float, Field(ge=-90, le=90)], Annotated[float, Field(ge=-180, le=180)]]
+    ] = Field(..., min_length=3, max_length=MAX_POLYGON_POINTS)
+
+
 class PostcodeSchema(GeometricSchema):
     full_postcode: Optional[str] = Field(None, example="A full postcode: YO1 2GH")
     district_postcode: Optional[str] = Field(None, example="A district postcode: KT")
@@ -21,14 +121,43 @@ class PostcodeSchema(GeometricSchema):
     longitude: Optional[float] = Field(None, example="The longitude")
 
 
+# A postcode of ASCII letters and digits, 5 to 7 of them whatever the spacing, so that
+# it is at most 8 characters once normalised and fits the in-memory indexes
+PostcodeText = Annotated[str, Field(pattern=r"^ *(?:[A-Za-z0-9] *){5,7}$")]
+
+
 class PostcodeCreateSchema(BaseModel):
     """Creates an item in postcodes db"""
 
-    postcode: str
+    postcode: PostcodeText
     lat: float
     lon: float
 
 
+class PostcodeChangesSchema(BaseModel):
+    """Postcodes added, moved and terminated, applied in one transaction."""
+
+    #:upserts: postcodes to add, or to move when already held.
+    upserts: list[PostcodeCreateSchema] = Field([], max_length=MAX_BULK_CHANGES)
+    #:deletes: terminated postcodes to remove.
+    deletes: list[PostcodeText] = Field([], max_length=MAX_BULK_CHANGES)
+    #:dry_run: count the changes without applying them.
+    dry_run: bool = Field(False)
+
+
+class PostcodeChangesSummarySchema(BaseModel):
+    """Number of postcodes affected by each kind of change."""
+
+    added: int
+    moved: int
+    #:unchanged: upserted postcodes already held at the same coordinates.
+    unchanged: int
+    deleted: int
+    #:missing: terminated postcodes that were not held.
+    missing: int
+    dry_run: bool
+
+
 class PostcodeResponseSchema(PostcodeSchema):
     """Response for the create/update"""
 
@@ -38,6 +167,37 @@ class PostcodeResponseSchema(PostcodeSchema):
         orm_mode = True
 
 
+class NearbyPostcodeSchema(BaseModel):
+    """A postcode and its distance from the searched point."""
+
+    full_postcode: str
+    latitude: float
+    longitude: float
+    #:distance_km: great-circle distance from the searched point.
+    distance_km: float
+
+
+class PostcodeMatchSchema(BaseModel):
+    """A postcode matching a typed prefix or postcode, and its coordinates."""
+
+    full_postcode: str
+    latitude: float
+    longitude: float
+
+
+class GeocodeReportSchema(BaseModel):
+    """Progress of a bulk geocoding job and the rows it could not match."""
+
+    job: str
+    #:done: whether the whole file has been geocoded, so the counts are final.
+    done: bool
+    rows: int
+    matched: int
+    #:unmatched: number, counted from 1 after any header, and postcode of the first
+    # unmatched rows; rows - matched were unmatched in all.
+    unmatched: list[dict]
+
+
 class LatLonBoundsSchema(BaseModel):
     """The bounds of a square."""
     bottom_left: list[float] 
@@ -57,3 +217,65 @@ class PricesSchema(LatLonBoundsSchema):
 
     two_yr_avg: float | None
     five_yr_avg: float | None
+    #:two_yr_percentiles: requested percentiles over two years, keyed as "p10".
+    two_yr_percentiles: dict[str, float | None] | None = None
+    five_yr_percentiles: dict[str, float | None] | None = None
+
+
+class PricePointSchema(BaseModel):
+    """Sales in a sub-square within one period."""
+
+    #:period: first day of the period.
+    period: date
+    n_sales: int
+    mean: float | None
+    median: float | None
+
+
+class PriceSeriesSchema(LatLonBoundsSchema):
+    """Sales in a sub-square over every period of a series."""
+
+    series: list[PricePointSchema]
+
+
+class AreaSummarySchema(BaseModel):
+    """Postcodes of an area or polygon, and their sales over two and five years."""
+
+    #:area: district or subarea, None for a polygon.
+    area: str | None = None
+    n_postcodes: int
+    #:centroid: mean latitude and longitude of the postcodes.
+    centroid: list[float] | None
+    bounds: GeometricSchema
+    two_yr_sales: int
+    five_yr_sales: int
+    #:two_yr_avg: median price, within 1% of the exact value for a whole area.
+    two_yr_avg: float | None
+    five_yr_avg: float | None
+
+
+class BatchMetric(str, Enum):
+    """Grid computed for every box of a batch search."""
+
+    NPOSTCODES = "npostcodes"
+    AVERAGE_PRICES = "average_prices"
+
+
+class BatchQuerySchema(BaseModel):
+    """Several boxes searched in one request.
+
+    Every box is answered in the full format, whatever its ``format``.
+    """
+
+    #:boxes: box, grid and, for prices, whether approximate quantiles will do.
+    boxes: list[PricesQuerySchema] = Field(..., min_length=1, max_length=MAX_BATCH_BOXES)
+    metrics: list[BatchMetric] = Field([BatchMetric.NPOSTCODES], min_length=1)
+    #:percentiles: reported on top of the medians of every price grid, from 0 to 100.
+    percentiles: list[Annotated[float, Field(ge=0, le=100)]] = Field([])
+
+
+class BatchResultSchema(BaseModel):
+    """Grids of one box of a batch search, for each requested metric."""
+
+    npostcodes: list[LatLonSummarySchema] | None = None
+    average_prices: list[PricesSchema] | None = None
@@ -0,0 +1,194 @@
+"""Summaries of postcode districts, subareas and arbitrary polygons.
+
+A district or subarea is answered from the rollups ``app.db.aggregates`` keeps per area,
+so its postcode count, centroid and bounds are a single row and its sales a row per
+month, or per month and sketch bucket for the median, however many postcodes it holds.
+The rollups hold the sales already in the local transactions table; areas are not
+topped up from the Land Registry.
+
+A polygon is answered from the raw rows. Its bounding box is read through the spatial
+index, the postcodes in the box are tested against the polygon with a ray cast
+vectorised over every point, one edge at a time, and the sales of those inside are
+refreshed and reduced as for a single sub-square of a price grid.
+"""
+
+import asyncio
+import datetime
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.crud.aggregates import get_area_postcodes, get_area_prices, get_area_sketches
+from app.crud.postcodes import get_frame_from_latlon_async
+from app.db import aggregates
+from app.schemas.postcodes import (
+    AreaKind,
+    AreaSummarySchema,
+    GeometricSchema,
+    PolygonQuerySchema,
+)
+from app.services import landregistry, sketch
+
+
+def points_in_polygon(lats, lons, points) -> np.ndarray:
+    """Whether each point lies inside a polygon, by the even-odd rule.
+
+    Args:
+        lats: Latitude of every point.
+        lons: Longitude of every point.
+        points: Vertices of the polygon as (lat, lon) pairs, the last joined back to the
+            first.
+
+    Returns:
+        np.ndarray: Boolean mask over the points.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    ring = np.asarray(points, dtype=np.float64)
+    inside = np.zeros(len(lats), dtype=bool)
+    for (lat0, lon0), (lat1, lon1) in zip(ring, np.roll(ring, -1, axis=0)):
+        # A ray running east from the point crosses the edge when the edge spans its
+        # latitude and meets that latitude east of the point
+        spans = (lat0 > lats) != (lat1 > lats)
+        if not spans.any():
+            continue
+        crossing = lon0 + (lats[spans] - lat0) * (lon1 - lon0) / (lat1 - lat0)
+        inside[spans] ^= lons[spans] < crossing
+    return inside
+
+
+def _windows(now: datetime.datetime) -> tuple[datetime.date, datetime.date, datetime.date]:
+    """First month of the five year window, of the two year one, and the month after
+    ``now``, as in ``landregistry.reduce_stored_prices``."""
+    first_of_month = lambda d: d.date().replace(day=1)
+    limit = first_of_month(now - datetime.timedelta(days=365 * 5))
+    two_yr_ago = first_of_month(now - datetime.timedelta(days=365 * 2))
+    next_month = first_of_month(now.replace(day=1) + datetime.timedelta(days=32))
+    return limit, two_yr_ago, next_month
+
+
+def _area_summaries(
+    db: Session, kind: AreaKind, areas: list[str], now: datetime.datetime
+) -> list[AreaSummarySchema]:
+    postcodes = get_area_postcodes(db, kind.value, areas).set_index("area")
+    postcodes = postcodes.reindex([a for a in areas if a in postcodes.index])
+    found = list(postcodes.index)
+    if not found:
+        return []
+    position = pd.Series(np.arange(len(found)), index=found)
+
+    limit, two_yr_ago, next_month = _windows(now)
+    prices = get_area_prices(db, kind.value, found, limit, next_month)
+    recent = (prices["month"] >= two_yr_ago).to_numpy()
+    cells, sales = position[prices["area"]].to_numpy(), prices["n_sales"].to_numpy()
+    two_yr_sales = np.bincount(cells[recent], sales[recent], minlength=len(found))
+    five_yr_sales = np.bincount(cells[~recent], sales[~recent], minlength=len(found))
+
+    two_yr_avg = five_yr_avg = np.full(len(found), np.nan)
+    if aggregates.sketches_enabled:
+        stored = get_area_sketches(db, kind.value, found, limit, next_month)
+        recent = (stored["month"] >= two_yr_ago).to_numpy()
+        cells = position[stored["area"]].to_numpy()
+        buckets, counts = stored["bucket"].to_numpy(), stored["n_sales"].to_numpy()
+        # One sketch per area, held as the periods of a single cell
+        two_yr, five_yr = sketch.CellSketches(1, len(found)), sketch.CellSketches(1, len(found))
+        two_yr.add(cells[recent], buckets[recent], counts[recent])
+        five_yr.add(cells[~recent], buckets[~recent], counts[~recent])
+        two_yr_avg, five_yr_avg = two_yr.quantile(0.5), five_yr.quantile(0.5)
+
+    as_float = lambda v: None if np.isnan(v) else float(v)
+    return [
+        AreaSummarySchema(
+            area=area,
+            n_postcodes=row.n_postcodes,
+            centroid=[row.lat_sum / row.n_postcodes, row.lon_sum / row.n_postcodes],
+            bounds=GeometricSchema(
+                min_lat=row.min_lat, max_lat=row.max_lat, min_lon=row.min_lon, max_lon=row.max_lon
+            ),
+            two_yr_sales=int(two_yr_sales[i]),
+            five_yr_sales=int(five_yr_sales[i]),
+            two_yr_avg=as_float(two_yr_avg[i]),
+            five_yr_avg=as_float(five_yr_avg[i]),
+        )
+        for i, (area, row) in enumerate(postcodes.iterrows())
+    ]
+
+
+async def area_summaries(
+    kind: AreaKind, areas: list[str], db: Session
+) -> list[AreaSummarySchema]:
+    """Postcodes and sales of districts or subareas, read from the stored rollups.
+
+    Args:
+        kind (AreaKind): Whether the areas are districts or subareas.
+        areas (list[str]): Areas to summarise, e.g. "KT" or "KT6".
+        db (Session): Database session.
+
+    Returns:
+        list[AreaSummarySchema]: A summary per area holding postcodes, in the order
+            asked for. Medians are approximate, and None without the stored sketches.
+    """
+    if not aggregates.enabled:
+        raise HTTPException(status_code=503, detail="Area rollups are not available")
+    areas = list(dict.fromkeys(a.strip().upper() for a in areas))
+    loop = asyncio.get_running_loop()
+    with metrics.stage("areas"):
+        return await loop.run_in_executor(
+            None, _area_summaries, db, kind, areas, datetime.datetime.today()
+        )
+
+
+async def polygon_summary(query: PolygonQuerySchema, db: Session) -> AreaSummarySchema:
+    """Postcodes inside a polygon and their sales over two and five years.
+
+    Args:
+        query (PolygonQuerySchema): Vertices of the polygon.
+        db (Session): Database session.
+
+    Returns:
+        AreaSummarySchema: Summary with exact medians.
+    """
+    ring = np.asarray(query.points, dtype=np.float64)
+    box = GeometricSchema(
+        min_lat=ring[:, 0].min(),
+        max_lat=ring[:, 0].max(),
+        min_lon=ring[:, 1].min(),
+        max_lon=ring[:, 1].max(),
+    )
+    df = await get_frame_from_latlon_async(db, box)
+    with metrics.stage("polygon"):
+        df = df[points_in_polygon(df["latitude"], df["longitude"], ring)]
+
+    now = datetime.datetime.today()
+    limit = now - datetime.timedelta(days=365 * 5)
+    with metrics.stage("refresh"):
+        await landregistry.refresh_transactions(
+            db, list(df["full_postcode"].values), limit.date(), now
+        )
+    # Every postcode falls in the single cell of a one by one grid
+    cells = pd.Series(0, index=df["full_postcode"].values)
+    loop = asyncio.get_running_loop()
+    with metrics.stage("reduce"):
+        two_yr, five_yr = await loop.run_in_executor(
+            None, landregistry.reduce_prices, db, cells, now, 1
+        )
+
+    lats, lons = df["latitude"], df["longitude"]
+    empty = df.empty
+    as_float = lambda v: None if np.isnan(v) else float(v)
+    return AreaSummarySchema(
+        n_postcodes=len(df),
+        centroid=None if empty else [float(lats.mean()), float(lons.mean())],
+        bounds=GeometricSchema()
+        if empty
+        else GeometricSchema(
+            min_lat=lats.min(), max_lat=lats.max(), min_lon=lons.min(), max_lon=lons.max()
+        ),
+        two_yr_sales=int(two_yr.counts[0]),
+        five_yr_sales=int(five_yr.counts[0]),
+        two_yr_avg=as_float(two_yr.quantile(0.5)[0]),
+        five_yr_avg=as_float(five_yr.quantile(0.5)[0]),
+    )
@@ -0,0 +1,55 @@
+"""Postcode autocomplete and forgiving lookup.
+
+Answered from the prefix index in ``db.prefix`` when it is loaded, otherwise from the
+postcodes table by comparing the compacted form of every postcode, which is a scan and
+only fit for occasional use. A lookup matches the typed postcode whatever its case and
+spacing, and when nothing matches tries it again with any one commonly mistyped
+character swapped.
+"""
+
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.crud.postcodes import get_by_keys, get_by_prefix
+from app.db.prefix import compact_postcode, confusable_variants, index
+from app.schemas.postcodes import AutocompleteQuerySchema, PostcodeMatchSchema
+
+
+def _schemas(df: pd.DataFrame) -> list[PostcodeMatchSchema]:
+    return [
+        PostcodeMatchSchema(full_postcode=postcode, latitude=lat, longitude=lon)
+        for postcode, lat, lon in zip(df["full_postcode"], df["latitude"], df["longitude"])
+    ]
+
+
+def _lookup(db: Session, keys: list[str]) -> pd.DataFrame:
+    if index.loaded:
+        return index.lookup(keys)
+    return get_by_keys(db, keys)
+
+
+async def complete(query: AutocompleteQuerySchema, db: Session) -> list[PostcodeMatchSchema]:
+    """Up to ``k`` postcodes starting with the typed prefix, in postcode order."""
+    key = compact_postcode(query.q)
+    with metrics.stage("autocomplete"):
+        if index.loaded:
+            df = index.complete(key, query.k)
+        else:
+            df = await run_in_threadpool(get_by_prefix, db, key, query.k)
+    return _schemas(df)
+
+
+async def lookup(postcode: str, db: Session) -> list[PostcodeMatchSchema]:
+    """The postcode matching the typed one, or its near misses when there is none.
+
+    Returns:
+        list[PostcodeMatchSchema]: The exact match alone, else every postcode one swapped
+            character away, empty when neither is held.
+    """
+    with metrics.stage("autocomplete"):
+        df = await run_in_threadpool(_lookup, db, [compact_postcode(postcode)])
+        if df.empty:
+            df = await run_in_threadpool(_lookup, db, confusable_variants(postcode))
+    return _schemas(df.sort_values("full_postcode", kind="stable"))
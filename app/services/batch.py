@@ -0,0 +1,122 @@
+"""Batch search over many boxes in one request.
+
+Dashboards ask for dozens of regions at once. Overlapping boxes are grouped and the
+postcodes of a group are read once, through the envelope of its boxes, then sliced per
+box in memory. The Land Registry is asked for the union of the postcodes of every box
+in one refresh, so a postcode shared by several boxes is fetched at most once, and each
+box's prices are then reduced from the local transactions table. Identical boxes are
+computed once.
+"""
+
+import datetime
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.crud.postcodes import get_frame_from_latlon_async
+from app.schemas.postcodes import (
+    BatchMetric,
+    BatchQuerySchema,
+    BatchResultSchema,
+    GeometricSchema,
+)
+from app.services import calculations, landregistry
+
+
+def _overlap(a: GeometricSchema, b: GeometricSchema) -> bool:
+    return (
+        a.min_lat <= b.max_lat
+        and b.min_lat <= a.max_lat
+        and a.min_lon <= b.max_lon
+        and b.min_lon <= a.max_lon
+    )
+
+
+def overlapping_groups(boxes: list[GeometricSchema]) -> list[list[int]]:
+    """Indices of the boxes, grouped into sets of transitively overlapping boxes."""
+    parent = list(range(len(boxes)))
+
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(boxes)):
+        for j in range(i + 1, len(boxes)):
+            if _overlap(boxes[i], boxes[j]):
+                parent[root(i)] = root(j)
+    groups: dict[int, list[int]] = {}
+    for i in range(len(boxes)):
+        groups.setdefault(root(i), []).append(i)
+    return list(groups.values())
+
+
+async def box_frames(db: Session, boxes: list[GeometricSchema]) -> list[pd.DataFrame]:
+    """Postcodes of every box, reading each group of overlapping boxes once.
+
+    Returns:
+        list[pd.DataFrame]: The rows ``get_frame_from_latlon`` returns for each box.
+    """
+    frames = [None] * len(boxes)
+    for group in overlapping_groups(boxes):
+        envelope = GeometricSchema(
+            min_lat=min(boxes[i].min_lat for i in group),
+            max_lat=max(boxes[i].max_lat for i in group),
+            min_lon=min(boxes[i].min_lon for i in group),
+            max_lon=max(boxes[i].max_lon for i in group),
+        )
+        df = await get_frame_from_latlon_async(db, envelope)
+        lats, lons = df["latitude"].to_numpy(), df["longitude"].to_numpy()
+        for i in group:
+            box = boxes[i]
+            inside = (
+                (lats >= box.min_lat)
+                & (lats <= box.max_lat)
+                & (lons >= box.min_lon)
+                & (lons <= box.max_lon)
+            )
+            frames[i] = df[inside].reset_index(drop=True)
+    return frames
+
+
+async def batch_search(query: BatchQuerySchema, db: Session) -> list[BatchResultSchema]:
+    """Grids of the requested metrics for every box of a batch.
+
+    Args:
+        query (BatchQuerySchema): Boxes, metrics and percentiles.
+        db (Session): Database session.
+
+    Returns:
+        list[BatchResultSchema]: Grids of each box, in the order of the boxes.
+    """
+    # Identical boxes are computed once and share their result
+    unique: dict[tuple, int] = {}
+    boxes = []
+    for box in query.boxes:
+        key = tuple(box.model_dump().items())
+        if key not in unique:
+            unique[key] = len(boxes)
+            boxes.append(box)
+
+    frames = await box_frames(db, boxes)
+    results = [BatchResultSchema() for _ in boxes]
+
+    if BatchMetric.NPOSTCODES in query.metrics:
+        for box, df, result in zip(boxes, frames, results):
+            result.npostcodes = await calculations.npostcodes(box, db, df)
+
+    if BatchMetric.AVERAGE_PRICES in query.metrics:
+        now = datetime.datetime.today()
+        limit = now - datetime.timedelta(days=365 * 5)
+        postcodes = pd.unique(pd.concat([df["full_postcode"] for df in frames]))
+        with metrics.stage("refresh"):
+            await landregistry.refresh_transactions(db, list(postcodes), limit.date(), now)
+        for box, df, result in zip(boxes, frames, results):
+            columns = await landregistry.price_columns(box, db, query.percentiles, df)
+            result.average_prices = await landregistry.price_models(
+                box, columns, query.percentiles
+            )
+
+    return [results[unique[tuple(box.model_dump().items())]] for box in query.boxes]
@@ -0,0 +1,136 @@
+"""Response cache for the bounding-box search routes.
+
+Map clients send nearly the same box many times while a user pans. Boxes are snapped
+outwards to a grid of ``config.cache.resolution`` degrees and the response is computed
+for the snapped box, so requests a few metres apart share one entry. Entries live in a
+bounded LRU and expire after ``config.cache.ttl`` seconds.
+
+Adding or deleting a postcode drops every entry whose box holds it, whichever route
+produced it.
+"""
+
+import math
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from app.core.config import config
+from app.schemas.postcodes import GridSchema
+
+
+class ResponseCache:
+    """LRU of responses keyed by route and snapped bounding box, with TTL expiry."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, resolution: float = 0.001):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.resolution = resolution
+        # key -> (expiry time, snapped box, response), least recently used first
+        self._entries: OrderedDict[tuple, tuple[float, tuple, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def snap(self, bounds: GridSchema) -> GridSchema | None:
+        """The box grown outwards to the cache grid, or None if it is open on any side."""
+        box = (bounds.min_lat, bounds.max_lat, bounds.min_lon, bounds.max_lon)
+        if None in box:
+            return None
+        r = self.resolution
+        # Rounding first keeps edges already on the grid from moving a whole step
+        lo = lambda v: math.floor(round(v / r, 6)) * r
+        hi = lambda v: math.ceil(round(v / r, 6)) * r
+        return bounds.model_copy(
+            update={
+                "min_lat": round(lo(min(box[:2])), 9),
+                "max_lat": round(hi(max(box[:2])), 9),
+                "min_lon": round(lo(min(box[2:])), 9),
+                "max_lon": round(hi(max(box[2:])), 9),
+            }
+        )
+
+    async def get_or_compute(
+        self, route: str, bounds: GridSchema, compute: Callable[[GridSchema], Awaitable]
+    ):
+        """Cached response of ``route`` for the snapped box, computing it on a miss.
+
+        Args:
+            route (str): Name of the route, keeping the routes' entries apart.
+            bounds (GridSchema): Box requested by the client.
+            compute (Callable): Coroutine function producing the response for a box.
+
+        Returns:
+            The response for the snapped box.
+        """
+        snapped = self.snap(bounds)
+        if snapped is None:
+            return await compute(bounds)
+        key = (route, *snapped.model_dump().items())
+
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+
+        response = await compute(snapped)
+        box = (snapped.min_lat, snapped.max_lat, snapped.min_lon, snapped.max_lon)
+        self._entries[key] = (time.monotonic() + self.ttl, box, response)
+        self._entries.move_to_end(key)
+        self._evict()
+        return response
+
+    def _evict(self) -> None:
+        """Drop expired entries, then the least recently used beyond the size bound."""
+        now = time.monotonic()
+        for key in [k for k, (expiry, _, _) in self._entries.items() if expiry <= now]:
+            del self._entries[key]
+            self.evictions += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, lat: float, lon: float) -> None:
+        """Drop every entry whose box holds the point."""
+        stale = [
+            key
+            for key, (_, (min_lat, max_lat, min_lon, max_lon), _) in self._entries.items()
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+        ]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Counters for tuning the cache size and TTL."""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": config.cache.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+responses = ResponseCache(
+    max_entries=config.cache.max_entries,
+    ttl=config.cache.ttl,
+    resolution=config.cache.resolution,
+)
+
+
+async def cached(route: str, bounds: GridSchema, compute: Callable[[GridSchema], Awaitable]):
+    """Serve ``route`` through the response cache when it is enabled."""
+    if not config.cache.enabled:
+        return await compute(bounds)
+    return await responses.get_or_compute(route, bounds, compute)
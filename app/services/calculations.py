@@ -1,16 +1,20 @@
 """Service layer calculations"""
 import asyncio
+import numpy as np
 import pandas as pd
 from sqlalchemy.orm import Session
-from app.schemas.postcodes import LatLonBoundsSchema, LatLonSummarySchema, GeometricSchema
-from app.crud.postcodes import get_frame_from_latlon
+from app.core import metrics
+from app.core.config import config
+from app.schemas.postcodes import LatLonBoundsSchema, LatLonSummarySchema, GridSchema
+from app.crud.postcodes import get_frame_from_latlon_async
+from app.services import grid, tiles
 
 
 async def separate_by_size(
     lats: tuple, lons: tuple, nbins: int = 10
 ) -> list[LatLonBoundsSchema]:
     """Given maximum and minimum latitude and longitude, separate the square into
-    10x10 sub-squares. This will then be used for data aggregation.
+    nbins x nbins sub-squares. This will then be used for data aggregation.
 
     The resulting square is defined starting at the bottom left, moving anti-clockwise.
 
@@ -27,6 +31,7 @@ async def separate_by_size(
     Args:
         lats (tuple): Maximum and minimum latitudes.
         lons (tuple): Maximum and minimum longitudes.
+        nbins (int): Number of sub-squares along each side.
 
     Returns:
         list[tuple]: Maximum and minimum latitude and longitudes
@@ -52,34 +57,51 @@ async def separate_by_size(
         clon += lon_spacing
     return subsquares
 
-async def npostcodes(bounds: GeometricSchema, db: Session) -> LatLonSummarySchema:
-    """Takes in the maximum and minimum latitude and longitude and separates it into 
-    100 sub-squares, also calculating the total number of postcodes falling in the
-    sub-squares.
+async def grid_counts(
+    bounds: GridSchema, db: Session, df: pd.DataFrame | None = None
+) -> np.ndarray:
+    """Number of postcodes in each of the nbins x nbins sub-squares of a box, in
+    ``grid.cell_index`` order.
 
-    Separates the results by size
+    Counts come from the tile pyramid when it is loaded and fine enough for the
+    requested resolution, otherwise from the postcodes themselves, read from the db
+    unless the caller already holds those of the box as ``df``.
     """
-    # Get a dataframe of all of the db entries
-    df = get_frame_from_latlon(db, bounds)
-
-    # Filter based on subsquares
     lats = (bounds.min_lat, bounds.max_lat)
     lons = (bounds.min_lon, bounds.max_lon)
-    sub_squares = await separate_by_size(lats, lons)
 
-    # Create summary schema for each subsquare
-    res = []
-    for square in sub_squares:
-        min_lat = square.bottom_left[0]
-        max_lat = square.bottom_right[0]
-        min_lon = square.bottom_left[1]
-        max_lon = square.upper_left[1]
-        mask = (
-            (df["latitude"] >= min_lat)
-            & (df["latitude"] < max_lat)
-            & (df["longitude"] >= min_lon)
-            & (df["longitude"] < max_lon)
-        )
-        res += [LatLonSummarySchema(**square.model_dump(), n_postcodes=len(df[mask]))]
+    counts = None
+    if config.tiles.enabled and tiles.pyramid.loaded:
+        with metrics.stage("tiles"):
+            counts = tiles.pyramid.grid_counts(
+                lats, lons, bounds.nbins, config.tiles.min_tiles_per_cell
+            )
+    if counts is None:
+        if df is None:
+            # Get a dataframe of all of the db entries
+            df = await get_frame_from_latlon_async(db, bounds)
+        with metrics.stage("count"):
+            # Bin every postcode into its sub-square in one pass and count per cell
+            idx = grid.cell_index(
+                df["latitude"].values, df["longitude"].values, lats, lons, bounds.nbins
+            )
+            counts = grid.cell_counts(idx, bounds.nbins)
+    return counts
+
+
+async def npostcodes(
+    bounds: GridSchema, db: Session, df: pd.DataFrame | None = None
+) -> list[LatLonSummarySchema]:
+    """Takes in the maximum and minimum latitude and longitude and separates it into 
+    nbins x nbins sub-squares, also calculating the total number of postcodes falling
+    in the sub-squares.
+    """
+    lats = (bounds.min_lat, bounds.max_lat)
+    lons = (bounds.min_lon, bounds.max_lon)
+    sub_squares = await separate_by_size(lats, lons, bounds.nbins)
+    counts = await grid_counts(bounds, db, df)
 
-    return res
+    return [
+        LatLonSummarySchema(**square.model_dump(), n_postcodes=int(n))
+        for square, n in zip(sub_squares, counts)
+    ]
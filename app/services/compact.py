@@ -0,0 +1,132 @@
+"""Compact encodings of grid responses.
+
+The full responses carry a model per sub-square with its four corners, all of which
+follow from the box and ``nbins``. A compact response states the grid once, as its
+origin (the minimum latitude and longitude), the spacing of the sub-squares and the
+shape, followed by the value of every sub-square as flat columns in ``grid.cell_index``
+order, ``cell = lon_bin * nbins + lat_bin``. Columns of price series hold every period
+of a cell in turn, ``cell * nperiods + period``.
+
+Three encodings are offered:
+
+- ``compact``: JSON, missing values as null.
+- ``binary``: packed little-endian arrays. The payload starts with the magic ``PCG1``
+  and the length of a JSON header as a little-endian uint32, followed by the header,
+  which holds the grid and the name, dtype, offset and length of every column. The
+  columns follow, each starting on an 8-byte boundary and with offsets counted from the
+  end of the header, so a client can map them with ``np.frombuffer``. Missing values
+  are NaN.
+- ``arrow``: an Arrow IPC stream of one record batch, the grid in the schema metadata
+  under ``grid``. Needs pyarrow.
+"""
+
+import json
+import struct
+
+import numpy as np
+from fastapi import Response
+
+from app.core import metrics
+from app.schemas.postcodes import GridSchema, ResponseFormat
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+MAGIC = b"PCG1"
+MEDIA_TYPES = {
+    ResponseFormat.COMPACT: "application/json",
+    ResponseFormat.BINARY: "application/octet-stream",
+    ResponseFormat.ARROW: "application/vnd.apache.arrow.stream",
+}
+
+
+def available(format: ResponseFormat) -> bool:
+    """Whether the dependencies of an encoding are installed."""
+    return format is not ResponseFormat.ARROW or pa is not None
+
+
+def layout(bounds: GridSchema, **extra) -> dict:
+    """Origin, spacing and shape of the sub-squares of a box, plus any extra fields."""
+    lats = (bounds.min_lat, bounds.max_lat)
+    lons = (bounds.min_lon, bounds.max_lon)
+    return {
+        "origin": [min(lats), min(lons)],
+        "spacing": [
+            (max(lats) - min(lats)) / bounds.nbins,
+            (max(lons) - min(lons)) / bounds.nbins,
+        ],
+        "shape": [bounds.nbins, bounds.nbins],
+        "order": "lon_major",
+        **extra,
+    }
+
+
+def _little_endian(values: np.ndarray) -> np.ndarray:
+    values = np.ascontiguousarray(values).ravel()
+    return values.astype(values.dtype.newbyteorder("<"), copy=False)
+
+
+def to_json(grid: dict, columns: dict[str, np.ndarray]) -> bytes:
+    out = {name: _little_endian(values).tolist() for name, values in columns.items()}
+    for name, values in columns.items():
+        if values.dtype.kind == "f":
+            # NaN is not valid JSON
+            out[name] = [None if v != v else v for v in out[name]]
+    return json.dumps({**grid, "columns": out}, separators=(",", ":")).encode()
+
+
+def to_packed(grid: dict, columns: dict[str, np.ndarray]) -> bytes:
+    arrays, specs, offset = [], [], 0
+    for name, values in columns.items():
+        values = _little_endian(values)
+        specs.append(
+            {"name": name, "dtype": values.dtype.str, "offset": offset, "length": len(values)}
+        )
+        arrays.append(values.tobytes() + b"\0" * (-values.nbytes % 8))
+        offset += len(arrays[-1])
+    header = json.dumps({**grid, "columns": specs}, separators=(",", ":")).encode()
+    # Pad the header so the first column starts on an 8-byte boundary
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+    return b"".join([MAGIC, struct.pack("<I", len(header)), header, *arrays])
+
+
+def to_arrow(grid: dict, columns: dict[str, np.ndarray]) -> bytes:
+    table = pa.table(
+        {name: pa.array(np.ravel(values), from_pandas=True) for name, values in columns.items()}
+    ).replace_schema_metadata({"grid": json.dumps(grid)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(
+    format: ResponseFormat, bounds: GridSchema, columns: dict[str, np.ndarray], **extra
+) -> bytes:
+    """Encode the columns of a grid response.
+
+    Args:
+        format (ResponseFormat): One of the compact encodings.
+        bounds (GridSchema): Box and grid the columns were computed for.
+        columns (dict[str, np.ndarray]): Values of every sub-square, in cell order.
+        **extra: Further fields of the grid description, e.g. the periods of a series.
+
+    Returns:
+        bytes: Response body, of the media type ``MEDIA_TYPES[format]``.
+    """
+    grid = layout(bounds, **extra)
+    with metrics.stage("encode"):
+        if format is ResponseFormat.COMPACT:
+            return to_json(grid, columns)
+        if format is ResponseFormat.BINARY:
+            return to_packed(grid, columns)
+        return to_arrow(grid, columns)
+
+
+def respond(format: ResponseFormat, result):
+    """A route's result as computed, or its encoded body wrapped in a response."""
+    if format is ResponseFormat.FULL:
+        return result
+    return Response(content=result, media_type=MEDIA_TYPES[format])
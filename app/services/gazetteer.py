@@ -0,0 +1,144 @@
+"""Bulk loading of the full postcode gazetteer.
+
+Loading ~1.7M postcodes through the ORM builds one object per row and commits in small
+batches. Here the district and subarea columns are derived with vectorised string
+operations, the rows are written with a single ``executemany`` into a staging table with
+no indexes, and the indexes are only built once every row is in. The R*Tree, by far the
+slowest index to build, is filled alongside the staging table.
+
+The staging table then replaces the live one in a single transaction, so readers see
+either the old gazetteer or the new one, never a half-filled table. If anything fails,
+including a duplicate postcode breaking the unique index, the live table is untouched.
+"""
+
+import sqlite3
+
+import pandas as pd
+from sqlalchemy import MetaData
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from app.db import aggregates, spatial
+from app.models.postcodes import Postcodes
+
+STAGING_TABLE = "postcodes_load"
+STAGING_RTREE = f"{STAGING_TABLE}_rtree"
+
+_COLUMNS = ["full_postcode", "district_postcode", "subarea_postcode", "latitude", "longitude"]
+
+
+def read_gazetteer(path: str) -> pd.DataFrame:
+    """Read a postcode, latitude, longitude CSV and derive the postcode columns.
+
+    Postcodes are split at the space as in ``crud.postcodes.create``: the outward code
+    is the subarea and its first two characters the district. Rows without coordinates
+    and repeated postcodes are dropped.
+    """
+    data = pd.read_csv(path, usecols=["postcode", "latitude", "longitude"])
+    data = data.dropna().drop_duplicates(subset="postcode")
+    outward = data["postcode"].str.split(" ", n=1).str[0]
+    return pd.DataFrame(
+        {
+            "full_postcode": data["postcode"],
+            "district_postcode": outward.str[:2],
+            "subarea_postcode": outward,
+            "latitude": data["latitude"],
+            "longitude": data["longitude"],
+        }
+    )
+
+
+def _ddl() -> tuple[str, list[str]]:
+    """CREATE TABLE for the staging table and CREATE INDEX for the live table."""
+    dialect = sqlite.dialect()
+    staging = Postcodes.__table__.to_metadata(MetaData(), name=STAGING_TABLE)
+    staging.indexes.clear()
+    create_table = str(CreateTable(staging).compile(dialect=dialect))
+    create_indexes = [
+        str(CreateIndex(index).compile(dialect=dialect))
+        for index in Postcodes.__table__.indexes
+    ]
+    return create_table, create_indexes
+
+
+def bulk_load(database: str, frame: pd.DataFrame) -> int:
+    """Replace the postcodes table of a SQLite database with the rows of ``frame``.
+
+    Args:
+        database (str): Path to the SQLite database file.
+        frame (pd.DataFrame): Rows with the columns returned by ``read_gazetteer``.
+
+    Returns:
+        int: Number of postcodes loaded.
+    """
+    create_table, create_indexes = _ddl()
+    # Autocommit mode, so every transaction below is explicit
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        # Fast-import settings, scoped to this connection. Only the staging table is
+        # written without syncing; the swap below runs with the usual durability.
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -262144")
+
+        conn.execute("BEGIN")
+        conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        conn.execute(create_table)
+        conn.executemany(
+            f"INSERT INTO {STAGING_TABLE} ({', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            frame[_COLUMNS].itertuples(index=False, name=None),
+        )
+        conn.execute("COMMIT")
+
+        # The R*Tree is optional, SQLite may be built without it
+        conn.execute("BEGIN")
+        conn.execute(f"DROP TABLE IF EXISTS {STAGING_RTREE}")
+        try:
+            conn.execute(
+                f"""CREATE VIRTUAL TABLE {STAGING_RTREE}
+                    USING rtree(id, min_lat, max_lat, min_lon, max_lon)"""
+            )
+            conn.execute(
+                f"""INSERT INTO {STAGING_RTREE}
+                    SELECT id, latitude, latitude, longitude, longitude FROM {STAGING_TABLE}"""
+            )
+            with_rtree = True
+        except sqlite3.OperationalError:
+            with_rtree = False
+        conn.execute("COMMIT")
+
+        conn.execute("PRAGMA synchronous = FULL")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Triggers on transactions read postcodes, and would fail the rename below
+            for trigger in aggregates.TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            conn.execute("DROP TABLE IF EXISTS postcodes")
+            conn.execute(f"ALTER TABLE {STAGING_TABLE} RENAME TO postcodes")
+            for statement in create_indexes:
+                conn.execute(statement)
+            if with_rtree:
+                conn.execute(f"DROP TABLE IF EXISTS {spatial.RTREE_TABLE}")
+                conn.execute(f"ALTER TABLE {STAGING_RTREE} RENAME TO {spatial.RTREE_TABLE}")
+                # Recreates the triggers dropped with the old postcodes table
+                for statement in spatial.RTREE_DDL:
+                    conn.execute(statement)
+            if conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'postcode_cells'"
+            ).fetchone():
+                # Recreates the aggregate triggers and recounts against the new table
+                try:
+                    conn.execute(aggregates.MATH_PROBE)
+                    with_sketches = True
+                except sqlite3.OperationalError:
+                    with_sketches = False
+                ddl, rebuild = aggregates.statements(with_sketches)
+                for statement in ddl + rebuild:
+                    conn.execute(statement)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return len(frame)
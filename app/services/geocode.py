@@ -0,0 +1,220 @@
+"""Streaming bulk geocoding of CSV and NDJSON files.
+
+An uploaded file is read a chunk at a time and split into records. Records are resolved
+``config.geocode.batch_size`` at a time, through the prefix index when it is loaded or
+with one ``IN`` query on the unique postcode index otherwise, and written back as soon
+as their batch is resolved, with ``latitude`` and ``longitude`` added. Neither the
+upload nor the response is ever held in full.
+
+Unmatched rows are still written, with empty coordinates, and the first
+``config.geocode.max_unmatched`` of them are also collected in a ``GeocodeReport`` that
+can be fetched by its job id once the response has been read.
+"""
+
+import codecs
+import csv
+import io
+import json
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import AsyncIterator
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import config
+from app.crud.postcodes import get_by_postcodes
+from app.db.prefix import compact_postcode, index, normalise_postcode
+from app.db.session import open_session
+
+
+class GeocodeFormat(str, Enum):
+    """Layout of a geocoded file, one record per line."""
+
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+MEDIA_TYPES = {GeocodeFormat.CSV: "text/csv", GeocodeFormat.NDJSON: "application/x-ndjson"}
+
+
+def format_of(content_type: str | None) -> GeocodeFormat | None:
+    """Format of an upload from its content type, or None when it is not supported."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        return GeocodeFormat.CSV
+    if media_type in ("application/x-ndjson", "application/jsonl", "application/json-lines"):
+        return GeocodeFormat.NDJSON
+    return None
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """A streaming response computed from the request body as it is uploaded.
+
+    ``StreamingResponse`` may watch for the client going away by reading from the
+    request itself, which would take chunks of the upload away from the body iterator.
+    Reading the upload raises ``ClientDisconnect`` anyway, so the response is only
+    streamed.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
+@dataclass
+class GeocodeReport:
+    """Progress of a geocoding job and the rows it could not match."""
+
+    job: str
+    rows: int = 0
+    matched: int = 0
+    done: bool = False
+    #:unmatched: number, counted from 1 after any header, and postcode of the first
+    # unmatched rows, the postcode None when the row has none or could not be parsed.
+    unmatched: list[dict] = field(default_factory=list)
+
+
+# Reports of the latest jobs, the oldest dropped first
+reports: OrderedDict[str, GeocodeReport] = OrderedDict()
+
+
+def new_report() -> GeocodeReport:
+    """Register the report of a new job."""
+    report = GeocodeReport(job=uuid.uuid4().hex)
+    reports[report.job] = report
+    while len(reports) > config.geocode.max_reports:
+        reports.popitem(last=False)
+    return report
+
+
+def resolve(db: Session, postcodes: list[str]) -> dict[str, tuple[float, float]]:
+    """Coordinates of those of the postcodes held, keyed by their compacted form."""
+    keys = list({compact_postcode(p) for p in postcodes if p})
+    if index.loaded:
+        df = index.lookup(keys)
+    else:
+        df = get_by_postcodes(db, [normalise_postcode(k) for k in keys])
+    return {
+        compact_postcode(postcode): (lat, lon)
+        for postcode, lat, lon in zip(df["full_postcode"], df["latitude"], df["longitude"])
+    }
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Lines of a UTF-8 byte stream, with any byte order mark and line endings dropped."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def _csv_records(lines: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Lines joined back up wherever a quoted CSV field spans several of them."""
+    pending = []
+    async for line in lines:
+        pending.append(line)
+        if sum(part.count('"') for part in pending) % 2 == 0:
+            yield "\n".join(pending)
+            pending = []
+    if pending:
+        yield "\n".join(pending)
+
+
+async def _batches(records: AsyncIterator[str]) -> AsyncIterator[list[str]]:
+    batch = []
+    async for record in records:
+        batch.append(record)
+        if len(batch) == config.geocode.batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _json_row(record: str) -> dict | None:
+    """An NDJSON record as a dict, None for a blank line and empty when it is not an
+    object."""
+    if not record.strip():
+        return None
+    try:
+        row = json.loads(record)
+    except ValueError:
+        return {}
+    return row if isinstance(row, dict) else {}
+
+
+def _csv_text(rows: list[list]) -> str:
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerows(rows)
+    return out.getvalue()
+
+
+async def geocode_stream(
+    chunks: AsyncIterator[bytes], format: GeocodeFormat, column: str, report: GeocodeReport
+) -> AsyncIterator[bytes]:
+    """Geocode a file as it is uploaded, yielding the enriched file as it is resolved.
+
+    Args:
+        chunks (AsyncIterator[bytes]): Body of the upload.
+        format (GeocodeFormat): Layout of the upload and of the output.
+        column (str): Column or key of every record holding its postcode.
+        report (GeocodeReport): Filled in with the counts and unmatched rows.
+
+    Yields:
+        bytes: The records in order, each with a latitude and longitude.
+    """
+    header = None
+    lines = _lines(chunks)
+    # An NDJSON record is one line by definition, and JSON escapes its quotes
+    records = lines if format is GeocodeFormat.NDJSON else _csv_records(lines)
+    with open_session() as db:
+        async for batch in _batches(records):
+            out = []
+            if format is GeocodeFormat.CSV:
+                if header is None:
+                    header = next(csv.reader([batch.pop(0)]), [])
+                    out.append(header + ["latitude", "longitude"])
+                at = header.index(column) if column in header else None
+                rows = [next(csv.reader([record])) if record else None for record in batch]
+                postcodes = [
+                    row[at] if row and at is not None and at < len(row) else None for row in rows
+                ]
+            else:
+                rows = [_json_row(record) for record in batch]
+                postcodes = [
+                    row.get(column) if isinstance(row, dict) else None for row in rows
+                ]
+                postcodes = [p if isinstance(p, str) else None for p in postcodes]
+
+            with metrics.stage("geocode"):
+                found = await run_in_threadpool(resolve, db, [p for p in postcodes if p])
+            for row, postcode in zip(rows, postcodes):
+                if row is None:
+                    # Blank line
+                    continue
+                report.rows += 1
+                lat, lon = found.get(compact_postcode(postcode or ""), (None, None))
+                if lat is None:
+                    if len(report.unmatched) < config.geocode.max_unmatched:
+                        report.unmatched.append({"row": report.rows, "postcode": postcode})
+                else:
+                    report.matched += 1
+                if format is GeocodeFormat.CSV:
+                    out.append(row + ["" if lat is None else lat, "" if lon is None else lon])
+                else:
+                    out.append(json.dumps({**row, "latitude": lat, "longitude": lon}))
+            if format is GeocodeFormat.CSV:
+                yield _csv_text(out).encode()
+            else:
+                yield "".join(f"{record}\n" for record in out).encode()
+    report.done = True
@@ -0,0 +1,184 @@
+"""Vectorised aggregation of rows onto the sub-square grid of a bounding box.
+
+Every row is assigned the integer index of the sub-square it falls in with a single
+pass over the latitude/longitude columns. Statistics over all sub-squares are then one
+``bincount`` or ``groupby`` rather than one boolean mask per sub-square, so the cost is
+O(rows) regardless of ``nbins``.
+
+``GridReducer`` keeps the same statistics as partial aggregates, so rows can be fed in
+chunks and dropped as soon as they are binned. It can also split every cell into
+``nperiods`` time periods, with rows keyed ``cell * nperiods + period``.
+
+Cells are numbered in the same order ``calculations.separate_by_size`` produces its
+sub-squares: longitude bands on the outside, latitude bands on the inside, i.e.
+``cell = lon_bin * nbins + lat_bin``.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def cell_index(
+    lats: np.ndarray, lons: np.ndarray, lat_bounds: tuple, lon_bounds: tuple, nbins: int = 10
+) -> np.ndarray:
+    """Assign each coordinate to its sub-square.
+
+    Sub-squares are closed at their minimum and open at their maximum, matching the
+    masks previously built per sub-square. Points outside the box are given -1.
+
+    Args:
+        lats (np.ndarray): Latitude of each row.
+        lons (np.ndarray): Longitude of each row.
+        lat_bounds (tuple): Maximum and minimum latitudes of the box.
+        lon_bounds (tuple): Maximum and minimum longitudes of the box.
+        nbins (int): Number of sub-squares along each side.
+
+    Returns:
+        np.ndarray: Flat cell index of each row, -1 where the row is outside the box.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    lat_spacing = (max(lat_bounds) - min(lat_bounds)) / nbins
+    lon_spacing = (max(lon_bounds) - min(lon_bounds)) / nbins
+
+    # A zero-width box gives inf/nan bins, which the range check below rejects
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lat_bin = np.floor((lats - min(lat_bounds)) / lat_spacing)
+        lon_bin = np.floor((lons - min(lon_bounds)) / lon_spacing)
+    inside = (lat_bin >= 0) & (lat_bin < nbins) & (lon_bin >= 0) & (lon_bin < nbins)
+
+    idx = np.full(len(lats), -1, dtype=np.int64)
+    idx[inside] = lon_bin[inside].astype(np.int64) * nbins + lat_bin[inside].astype(np.int64)
+    return idx
+
+
+def cell_counts(idx: np.ndarray, nbins: int = 10, where: np.ndarray | None = None) -> np.ndarray:
+    """Number of rows in every sub-square.
+
+    Args:
+        idx (np.ndarray): Cell index of each row from ``cell_index``.
+        nbins (int): Number of sub-squares along each side.
+        where (np.ndarray | None): Optional boolean mask selecting the rows to count.
+
+    Returns:
+        np.ndarray: Count per cell, of length ``nbins ** 2``.
+    """
+    keep = idx >= 0 if where is None else (idx >= 0) & where
+    return np.bincount(idx[keep], minlength=nbins * nbins)
+
+
+def cell_statistic(
+    idx: np.ndarray,
+    values: np.ndarray,
+    nbins: int = 10,
+    statistic: str = "median",
+    where: np.ndarray | None = None,
+) -> np.ndarray:
+    """Reduce ``values`` within every sub-square with a single group-by.
+
+    Args:
+        idx (np.ndarray): Cell index of each row from ``cell_index``.
+        values (np.ndarray): Value of each row to aggregate.
+        nbins (int): Number of sub-squares along each side.
+        statistic (str): Any pandas group-by reduction, e.g. "median", "mean", "max".
+        where (np.ndarray | None): Optional boolean mask selecting the rows to use.
+
+    Returns:
+        np.ndarray: Statistic per cell, NaN where a cell has no rows.
+    """
+    keep = idx >= 0 if where is None else (idx >= 0) & where
+    grouped = pd.Series(np.asarray(values)[keep]).groupby(idx[keep]).agg(statistic)
+    return grouped.reindex(range(nbins * nbins)).to_numpy(dtype=np.float64)
+
+
+class GridReducer:
+    """Per-cell statistics accumulated from chunks of rows.
+
+    Each chunk is reduced to the count and sum of every cell and the number of times
+    each distinct value occurs in it, and merged into the running totals. Memory grows
+    with the number of cells and distinct values per cell, never with the number of rows
+    fed in, and the median is still exact.
+    """
+
+    def __init__(self, nbins: int = 10, nperiods: int = 1):
+        self.nbins = nbins
+        self.nperiods = nperiods
+        self.size = nbins * nbins * nperiods
+        self.counts = np.zeros(self.size, dtype=np.int64)
+        self.sums = np.zeros(self.size, dtype=np.float64)
+        # Occurrences of every (cell, value) pair, sorted by cell then value
+        self._values = pd.Series(
+            dtype=np.int64, index=pd.MultiIndex.from_arrays([[], []], names=["cell", "value"])
+        )
+
+    def update(
+        self, idx: np.ndarray, values: np.ndarray, where: np.ndarray | None = None
+    ) -> None:
+        """Fold a chunk of rows into the running aggregates.
+
+        Args:
+            idx (np.ndarray): Cell index of each row from ``cell_index``, combined with
+                its period when there are several.
+            values (np.ndarray): Value of each row to aggregate.
+            where (np.ndarray | None): Optional boolean mask selecting the rows to use.
+        """
+        keep = idx >= 0 if where is None else (idx >= 0) & where
+        idx = idx[keep]
+        values = np.asarray(values)[keep]
+        if len(idx) == 0:
+            return
+        self.counts += np.bincount(idx, minlength=self.size)
+        self.sums += np.bincount(idx, weights=values, minlength=self.size)
+        partial = pd.Series(
+            1, index=pd.MultiIndex.from_arrays([idx, values], names=["cell", "value"])
+        )
+        self._values = (
+            pd.concat([self._values, partial]).groupby(level=["cell", "value"]).sum()
+        )
+
+    def merge(self, other: "GridReducer") -> "GridReducer":
+        """Fold the aggregates of another reducer over the same grid into these."""
+        self.counts += other.counts
+        self.sums += other.sums
+        self._values = (
+            pd.concat([self._values, other._values]).groupby(level=["cell", "value"]).sum()
+        )
+        return self
+
+    def result(self, statistic: str = "median") -> np.ndarray:
+        """Statistic per cell, NaN where a cell has no rows.
+
+        Args:
+            statistic (str): One of "count", "sum", "mean" or "median".
+
+        Returns:
+            np.ndarray: Statistic per cell, or per cell and period.
+        """
+        empty = self.counts == 0
+        if statistic == "count":
+            return self.counts.astype(np.float64)
+        if statistic == "sum":
+            return self.sums.copy()
+        if statistic == "mean":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(empty, np.nan, self.sums / self.counts)
+        if statistic != "median":
+            raise ValueError(f"Unsupported statistic: {statistic}")
+        return self.quantile(0.5)
+
+    def quantile(self, q: float) -> np.ndarray:
+        """Exact ``q`` quantile per cell, interpolated as pandas does, NaN where empty."""
+        # Walk the cumulative occurrences to the one or two values either side of the
+        # quantile in every cell
+        values = self._values.index.get_level_values("value").to_numpy(dtype=np.float64)
+        cumulative = self._values.to_numpy().cumsum()
+        offsets = np.concatenate([[0], self.counts.cumsum()[:-1]])
+        h = q * (self.counts - 1)
+        lower = np.searchsorted(cumulative, offsets + np.floor(h), side="right")
+        upper = np.searchsorted(cumulative, offsets + np.ceil(h), side="right")
+
+        out = np.full(len(self.counts), np.nan)
+        filled = self.counts > 0
+        low, high = values[lower[filled]], values[upper[filled]]
+        out[filled] = low + (h[filled] - np.floor(h[filled])) * (high - low)
+        return out
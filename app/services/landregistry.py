@@ -2,21 +2,38 @@
 """
 
 import io
+import math
 import asyncio
 import datetime
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable
 from enum import Enum
 from SPARQLWrapper import SPARQLWrapper, CSV, POST, GET
+from SPARQLWrapper.SPARQLExceptions import QueryBadFormed
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from sqlalchemy.orm import Session
 from app.schemas.postcodes import (
+    PricePointSchema,
+    PriceSeriesQuerySchema,
+    PriceSeriesSchema,
     PricesSchema,
-    GeometricSchema,
+    PricesQuerySchema,
 )
-from app.crud.postcodes import get_frame_from_latlon
-from app.services import calculations
+from app.const import PRICE_PAID_START
+from app.core import metrics
+from app.core.config import config
+from app.crud.aggregates import get_price_cells, get_price_sketches
+from app.crud.postcodes import get_frame_from_latlon_async
+from app.crud.transactions import (
+    iter_transactions,
+    windows_to_fetch_async,
+    write_transactions_async,
+)
+from app.db import aggregates
+from app.services import calculations, grid, parallel, periods, sketch, tiles
 
 
 class LocationCriteria(str, Enum):
@@ -62,11 +79,19 @@ class AddressQueryParams(str, Enum):
     POSTCODE = "postcode"
 
 
+# Columns of the CSV returned for the default query parameters that are kept
+_RESPONSE_COLUMNS = [
+    "transx", "postcode", "date", "amount", "propertytype", "estatetype", "newbuild",
+    "category",
+]
+_CATEGORICAL = ["postcode", "property_type", "estate_type", "category"]
+
+
 class QueryConstructor:
     """A wrapper around HM Land Registry SparQL queries."""
 
-    def __init__(self):
-        self.endpoint = "https://landregistry.data.gov.uk/landregistry/sparql"
+    def __init__(self, endpoint: str | None = None):
+        self.endpoint = endpoint or config.landregistry.endpoint
         try:
             self.sparql = SPARQLWrapper(self.endpoint)
         except:
@@ -137,7 +162,7 @@ class QueryConstructor:
             self._date += "FILTER (\n"
         else:
             self._date += " &&\n"
-        self._date += f"?date < '{end_date.strftime("%Y-%m-%d")}'^^xsd:date"
+        self._date += f"?date <= '{end_date.strftime("%Y-%m-%d")}'^^xsd:date"
 
     def query_parameters(
         self, opts: Iterable[UKPPIQueryParams | AddressQueryParams] | None = None
@@ -180,8 +205,13 @@ class QueryConstructor:
 
         self._ordering + self._ordering + f"?{param}"
 
-    def query(self):
-        """Construct the query from individual components"""
+    def query(self, chunksize: int | None = None):
+        """Construct the query from individual components and run it.
+
+        Arguments:
+          chunksize (int | None): If given, an iterator over frames of this many rows
+           parsed from the response as it is read, rather than one frame.
+        """
 
         if not self._location_added:
             raise (
@@ -226,74 +256,570 @@ class QueryConstructor:
         self.sparql.setQuery(self._query)
         # Use POST due to expected query size
         self.sparql.setMethod(POST)
+        self.sparql.setTimeout(config.landregistry.timeout)
         # Set the return format to JSON
         self.sparql.setReturnFormat(CSV)
 
         # Execute the query and parse the results
-        self.results = self.sparql.query().convert()
-        return pd.read_csv(io.BytesIO(self.results))
+        if chunksize is None:
+            self.results = self.sparql.query().convert()
+            return pd.read_csv(io.BytesIO(self.results))
+        # Parse the response as it arrives instead of buffering it whole
+        return pd.read_csv(self.sparql.query().response, chunksize=chunksize)
 
-async def price_data(bounds: GeometricSchema, db: Session) -> list[PricesSchema]:
-    # Query to get a dataframe of postcodes
-    df = get_frame_from_latlon(db, bounds)
-    # Get the sub-squares
+
+def to_transactions(results: pd.DataFrame) -> pd.DataFrame:
+    """Shape rows of a SPARQL CSV response like the local transactions table.
+
+    Columns are cast to compact dtypes as they are parsed: the amount as int32, the
+    date as datetime64 and the repetitive URIs and labels as categoricals.
+    """
+    return pd.DataFrame(
+        {
+            # Transaction URIs end in .../transaction/<id>/current
+            "transaction_id": results["transx"].str.extract(
+                r"transaction/([^/]+)", expand=False
+            ).fillna(results["transx"]),
+            "postcode": results["postcode"].astype("category"),
+            "date": pd.to_datetime(results["date"]),
+            "amount": results["amount"].astype(np.int32),
+            "property_type": results["propertytype"].str.rsplit("/", n=1).str[-1].astype("category"),
+            "estate_type": results["estatetype"].str.rsplit("/", n=1).str[-1].astype("category"),
+            "new_build": results["newbuild"].astype(str).str.lower() == "true",
+            "category": results["category"].astype("category"),
+        }
+    )
+
+
+def fetch_transactions(
+    postcodes: Iterable[str], start: datetime.date, end: datetime.date
+) -> pd.DataFrame:
+    """Query the Land Registry for the transactions of some postcodes within a window,
+    shaped like the local transactions table.
+
+    The response is parsed ``config.landregistry.chunksize`` rows at a time, so only
+    the compact frame, never the raw CSV, is held in full.
+    """
+    query = QueryConstructor()
+    location_data = {"postcode": " ".join([f"'{p}'" for p in postcodes])}
+    query.location(location_data)
+    query.start_date(start)
+    query.end_date(end)
+    chunks = [
+        to_transactions(chunk)
+        for chunk in query.query(chunksize=config.landregistry.chunksize)
+    ]
+    if not chunks:
+        return to_transactions(pd.DataFrame(columns=_RESPONSE_COLUMNS))
+    # Chunks with different categories concatenate as objects, so cast them back
+    return pd.concat(chunks, ignore_index=True).astype({c: "category" for c in _CATEGORICAL})
+
+
+# Dedicated pool, so its size caps the queries in flight against the Land Registry and
+# SPARQL round-trips never starve the default executor used for db work
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.landregistry.max_concurrency,
+            thread_name_prefix="landregistry",
+        )
+    return _executor
+
+
+def _is_timeout(exc: Exception) -> bool:
+    """Whether a failed query ran out of time, locally or at the endpoint."""
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code in (408, 504)
+    if isinstance(exc, urllib.error.URLError):
+        return isinstance(exc.reason, TimeoutError)
+    return isinstance(exc, TimeoutError)
+
+
+def plan_batches(postcodes: list[str]) -> list[list[str]]:
+    """Split postcodes into evenly sized batches for querying.
+
+    Batches never exceed ``max_batch_size`` postcodes. Below that, the work is spread
+    over up to ``max_concurrency`` batches as long as each keeps ``min_batch_size``
+    postcodes, so one street is a single query and a county many bounded ones.
+    """
+    if not postcodes:
+        return []
+    opts = config.landregistry
+    nbatches = max(
+        math.ceil(len(postcodes) / opts.max_batch_size),
+        min(opts.max_concurrency, len(postcodes) // opts.min_batch_size),
+        1,
+    )
+    size = math.ceil(len(postcodes) / nbatches)
+    return [postcodes[i : i + size] for i in range(0, len(postcodes), size)]
+
+
+async def _fetch_batch(
+    postcodes: list[str], start: datetime.date, end: datetime.date
+) -> pd.DataFrame:
+    """Fetch one batch, retrying failures with exponential backoff.
+
+    A batch that times out is split in two and each half fetched on its own, as the
+    endpoint is most likely struggling with the size of the query. A malformed query is
+    never retried.
+    """
+    loop = asyncio.get_running_loop()
+    opts = config.landregistry
+    for attempt in range(opts.retries + 1):
+        try:
+            with metrics.external("sparql"):
+                return await loop.run_in_executor(
+                    _get_executor(), fetch_transactions, postcodes, start, end
+                )
+        except QueryBadFormed:
+            raise
+        except Exception as e:
+            if _is_timeout(e) and len(postcodes) > 1:
+                half = len(postcodes) // 2
+                parts = await asyncio.gather(
+                    _fetch_batch(postcodes[:half], start, end),
+                    _fetch_batch(postcodes[half:], start, end),
+                )
+                return pd.concat(parts, ignore_index=True)
+            if attempt == opts.retries:
+                raise
+            await asyncio.sleep(opts.backoff * 2**attempt)
+
+
+async def fetch_transactions_batched(
+    postcodes: list[str], start: datetime.date, end: datetime.date
+):
+    """Fetch the transactions of any number of postcodes in bounded, concurrent batches.
+
+    Yields each batch's postcodes and transactions as soon as it completes, so a caller
+    can store and drop one batch while the others are still in flight.
+    """
+    batches = plan_batches(postcodes)
+
+    async def fetch(batch):
+        return batch, await _fetch_batch(batch, start, end)
+
+    for done in asyncio.as_completed([fetch(b) for b in batches]):
+        yield await done
+
+
+async def refresh_transactions(
+    db: Session, postcodes: list[str], start: datetime.date, now: datetime.datetime
+) -> None:
+    """Fetch the transactions of the postcodes missing from the local table, or stale in
+    it, from the Land Registry.
+
+    A local source holds the ingested Price Paid files and is never topped up, nor is a
+    read-only replica, which answers from the transactions it was copied with.
+    """
+    if config.landregistry.source != "sparql" or config.database.read_only:
+        return
+    windows = await windows_to_fetch_async(
+        db,
+        postcodes,
+        start,
+        datetime.timedelta(days=config.landregistry.max_age_days),
+        datetime.timedelta(days=config.landregistry.registration_lag_days),
+    )
+    for since, stale in windows.items():
+        async for batch, transactions in fetch_transactions_batched(stale, since, now):
+            await write_transactions_async(db, transactions, batch, since, now.date())
+
+
+def reduce_prices(
+    db: Session,
+    cells: pd.Series,
+    now: datetime.datetime,
+    nbins: int,
+    approximate: bool = False,
+) -> tuple:
+    """Prices per sub-square over the last two years and the three before.
+
+    Held transactions are read back and binned a chunk at a time, so memory grows with
+    the number of sub-squares rather than the number of transactions.
+
+    Args:
+        db (Session): Database session.
+        cells (pd.Series): Sub-square of every postcode, indexed by postcode.
+        now (datetime.datetime): End of the window.
+        nbins (int): Number of sub-squares along each side.
+        approximate (bool): Sketch the prices instead of keeping every distinct one.
+
+    Returns:
+        tuple: Two and five year reducers, ``grid.GridReducer`` for exact quantiles or
+            ``sketch.CellSketches`` for approximate ones.
+    """
+    limit = now - datetime.timedelta(days=365 * 5)
+    two_yr_ago = np.datetime64(now - datetime.timedelta(days=365 * 2))
+    reducer = sketch.CellSketches if approximate else grid.GridReducer
+    two_yr, five_yr = reducer(nbins), reducer(nbins)
+    for chunk in iter_transactions(db, list(cells.index), limit.date(), now.date()):
+        idx = cells.reindex(chunk["postcode"], fill_value=-1).to_numpy()
+        # Age of each sale is compared once and shared by both windows
+        recent = (pd.to_datetime(chunk["date"]) >= two_yr_ago).to_numpy()
+        amounts = chunk["amount"].to_numpy()
+        two_yr.update(idx, amounts, where=recent)
+        five_yr.update(idx, amounts, where=~recent)
+    return two_yr, five_yr
+
+
+def _stored_block(lats: tuple, lons: tuple, nbins: int) -> tuple | None:
+    """Tile edges of the sub-squares at the level of the stored aggregates, or None when
+    the sub-squares are too small for the stored aggregates to answer for them."""
+    if not aggregates.sketches_enabled or tiles.pyramid.resolving_level(
+        lats, lons, nbins, config.tiles.min_tiles_per_cell
+    ) is None:
+        return None
+    return tiles.pyramid.cell_edges(lats, lons, nbins, aggregates.LEVEL)
+
+
+def _block(edges: np.ndarray) -> tuple[int, int]:
+    return int(edges[0]), int(edges[-1])
+
+
+def _tile_cells(stored: pd.DataFrame, a: np.ndarray, b: np.ndarray, nbins: int) -> np.ndarray:
+    """Sub-square of every stored tile row, numbered longitude-major as grid.cell_index."""
+    lat_bin = np.searchsorted(a, stored["row"].to_numpy(), side="right") - 1
+    lon_bin = np.searchsorted(b, stored["col"].to_numpy(), side="right") - 1
+    return lon_bin * nbins + lat_bin
+
+
+def reduce_stored_prices(
+    db: Session, lats: tuple, lons: tuple, nbins: int, now: datetime.datetime
+) -> tuple | None:
+    """Approximate prices per sub-square merged from the stored tile sketches.
+
+    Sub-square edges are moved to the nearest tile edge, so the stored sketches are only
+    used when every sub-square is at least ``min_tiles_per_cell`` tiles across. The two
+    and five year windows are rounded to whole months.
+
+    Returns:
+        tuple | None: Two and five year ``sketch.CellSketches``, or None when the stored
+            sketches cannot answer for this grid.
+    """
+    edges = _stored_block(lats, lons, nbins)
+    if edges is None:
+        return None
+    a, b = edges
+
+    first_of_month = lambda d: d.date().replace(day=1)
+    limit = first_of_month(now - datetime.timedelta(days=365 * 5))
+    two_yr_ago = first_of_month(now - datetime.timedelta(days=365 * 2))
+    next_month = first_of_month(now.replace(day=1) + datetime.timedelta(days=32))
+    stored = get_price_sketches(db, aggregates.LEVEL, _block(a), _block(b), limit, next_month)
+
+    cells = _tile_cells(stored, a, b, nbins)
+    recent = (stored["month"] >= two_yr_ago).to_numpy()
+    buckets, counts = stored["bucket"].to_numpy(), stored["n_sales"].to_numpy()
+
+    two_yr, five_yr = sketch.CellSketches(nbins), sketch.CellSketches(nbins)
+    two_yr.add(cells[recent], buckets[recent], counts[recent])
+    five_yr.add(cells[~recent], buckets[~recent], counts[~recent])
+    return two_yr, five_yr
+
+
+async def price_columns(
+    bounds: PricesQuerySchema,
+    db: Session,
+    percentiles: list[float] | None = None,
+    df: pd.DataFrame | None = None,
+) -> dict[str, np.ndarray]:
+    """Median price per sub-square over two and five years, and optionally percentiles,
+    as columns in ``grid.cell_index`` order.
+
+    Args:
+        bounds (PricesQuerySchema): Box, grid and whether approximate quantiles will do.
+        db (Session): Database session.
+        percentiles (list[float] | None): Percentiles, from 0 to 100, to report as well.
+        df (pd.DataFrame | None): Postcodes of the box, when the caller has already read
+            them and refreshed their transactions.
+
+    Returns:
+        dict[str, np.ndarray]: "two_yr_avg" and "five_yr_avg" medians, and a column per
+            window and percentile keyed like "two_yr_p10", NaN where there were no sales.
+    """
     lats = (bounds.min_lat, bounds.max_lat)
     lons = (bounds.min_lon, bounds.max_lon)
-    sub_squares = await calculations.separate_by_size(lats, lons)
-
     # Set date range
     now = datetime.datetime.today()
     limit = now - datetime.timedelta(days=365*5)
-
-    # Batch the query using a multi-threaded approach with the synchronous library
-    def batch_query(postcodes):
-        query = QueryConstructor()
-        location_data = {"postcode": " ".join([f"'{p}'" for p in postcodes])}
-        query.location(location_data)
-        query.start_date(limit)
-        query.end_date(now)
-        return query.query()
+    if df is None:
+        # Query to get a dataframe of postcodes
+        df = await get_frame_from_latlon_async(db, bounds)
+        postcodes = list(df["full_postcode"].values)
+        with metrics.stage("refresh"):
+            await refresh_transactions(db, postcodes, limit.date(), now)
     loop = asyncio.get_running_loop()
-    batch_size = len(df) // 10
-    tasks = [
-        loop.run_in_executor(None, batch_query, df["full_postcode"].values[i:i+batch_size])
-        for i in range(0, len(df), batch_size)
-    ]
-    res = await asyncio.gather(*tasks)
-    # Concatenate results
-    out = []
-    res = pd.concat(res)
-    agg = res.merge(df, left_on="postcode", right_on="full_postcode")
-    agg["date"] = pd.to_datetime(agg["date"])
-    # Perform analysis on each sub-square
-    for square in sub_squares:
-        min_lat = square.bottom_left[0]
-        max_lat = square.bottom_right[0]
-        min_lon = square.bottom_left[1]
-        max_lon = square.upper_left[1]
-        mask = (
-            (df["latitude"] >= min_lat)
-            & (df["latitude"] < max_lat)
-            & (df["longitude"] >= min_lon)
-            & (df["longitude"] < max_lon)
-        )
-        # With the mask perform the average price calculations on a 2yr and 5yr basis
-        two_yr = mask & (now - agg["date"] < datetime.timedelta(days=365 * 2))
-        five_yr = (
-            mask
-            & (now - agg["date"] < datetime.timedelta(days=365 * 5))
-            & (now - agg["date"] >= datetime.timedelta(days=365 * 2))
+
+    # Large sub-squares are answered from the stored tile sketches when approximate
+    # quantiles will do; otherwise every transaction in the window now comes from the
+    # local table, binned by the sub-square of its postcode
+    reducers = None
+    if bounds.approximate:
+        with metrics.stage("sketches"):
+            reducers = await loop.run_in_executor(
+                None, reduce_stored_prices, db, lats, lons, bounds.nbins, now
+            )
+    if reducers is None:
+        cells = pd.Series(
+            grid.cell_index(
+                df["latitude"].values, df["longitude"].values, lats, lons, bounds.nbins
+            ),
+            index=df["full_postcode"].values,
         )
-        two_yr_avg = agg.loc[two_yr, "amount"].median()
-        if np.isnan(two_yr_avg): two_yr_avg = None
-        five_yr_avg = agg.loc[five_yr, "amount"].median()
-        if np.isnan(five_yr_avg): five_yr_avg = None
+        with metrics.stage("reduce"):
+            if config.parallel.enabled and len(cells) >= config.parallel.min_postcodes:
+                reducers = await parallel.reduce_prices(
+                    cells, now, bounds.nbins, bounds.approximate
+                )
+            else:
+                reducers = await loop.run_in_executor(
+                    None, reduce_prices, db, cells, now, bounds.nbins, bounds.approximate
+                )
+    two_yr, five_yr = reducers
+    with metrics.stage("quantiles"):
+        columns = {"two_yr_avg": two_yr.quantile(0.5), "five_yr_avg": five_yr.quantile(0.5)}
+        for p in percentiles or []:
+            columns[f"two_yr_p{p:g}"] = two_yr.quantile(p / 100)
+            columns[f"five_yr_p{p:g}"] = five_yr.quantile(p / 100)
+    return columns
+
+
+async def price_data(
+    bounds: PricesQuerySchema, db: Session, percentiles: list[float] | None = None
+) -> list[PricesSchema]:
+    """Median price per sub-square over two and five years, and optionally percentiles.
+
+    Args:
+        bounds (PricesQuerySchema): Box, grid and whether approximate quantiles will do.
+        db (Session): Database session.
+        percentiles (list[float] | None): Percentiles, from 0 to 100, to report as well.
+
+    Returns:
+        list[PricesSchema]: Prices of every sub-square.
+    """
+    columns = await price_columns(bounds, db, percentiles)
+    return await price_models(bounds, columns, percentiles)
 
-        out += [PricesSchema(**square.model_dump(), two_yr_avg = two_yr_avg, five_yr_avg = five_yr_avg)]
+
+async def price_models(
+    bounds: PricesQuerySchema, columns: dict[str, np.ndarray], percentiles: list[float] | None
+) -> list[PricesSchema]:
+    """A ``PricesSchema`` per sub-square from the columns of ``price_columns``."""
+    # Get the sub-squares
+    lats = (bounds.min_lat, bounds.max_lat)
+    lons = (bounds.min_lon, bounds.max_lon)
+    sub_squares = await calculations.separate_by_size(lats, lons, bounds.nbins)
+    percentiles = percentiles or []
+    as_float = lambda v: None if np.isnan(v) else float(v)
+    pct = lambda window, i: {
+        f"p{p:g}": as_float(columns[f"{window}_p{p:g}"][i]) for p in percentiles
+    }
+
+    # Average price on a 2yr and 5yr basis for each sub-square
+    out = []
+    for i, square in enumerate(sub_squares):
+        out += [
+            PricesSchema(
+                **square.model_dump(),
+                two_yr_avg=as_float(columns["two_yr_avg"][i]),
+                five_yr_avg=as_float(columns["five_yr_avg"][i]),
+                two_yr_percentiles=pct("two_yr", i) if percentiles else None,
+                five_yr_percentiles=pct("five_yr", i) if percentiles else None,
+            )
+        ]
     # Now perform the analysis
     return out
 
 
+def reduce_series(
+    db: Session,
+    cells: pd.Series,
+    start: datetime.date,
+    end: datetime.date,
+    interval: str,
+    nbins: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Number of sales, mean and median price per sub-square and period, from the raw
+    transactions binned a chunk at a time.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Counts, means and medians, each of
+            shape ``(nbins ** 2, nperiods)``.
+    """
+    nperiods = len(periods.period_starts(start, end, interval))
+    reducer = grid.GridReducer(nbins, nperiods)
+    # The transactions window is exclusive at both ends
+    window = (start - datetime.timedelta(days=1), end + datetime.timedelta(days=1))
+    for chunk in iter_transactions(db, list(cells.index), *window):
+        cell = cells.reindex(chunk["postcode"], fill_value=-1).to_numpy()
+        period = periods.period_index(chunk["date"], start, interval)
+        inside = (cell >= 0) & (period >= 0) & (period < nperiods)
+        idx = np.where(inside, cell * nperiods + period, -1)
+        reducer.update(idx, chunk["amount"].to_numpy())
+    shape = (nbins * nbins, nperiods)
+    return (
+        reducer.counts.reshape(shape),
+        reducer.result("mean").reshape(shape),
+        reducer.quantile(0.5).reshape(shape),
+    )
+
+
+def reduce_stored_series(
+    db: Session,
+    lats: tuple,
+    lons: tuple,
+    nbins: int,
+    start: datetime.date,
+    end: datetime.date,
+    interval: str,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """As ``reduce_series``, from the monthly tile aggregates instead of the raw rows.
+
+    Counts and means are exact for the tiles given to each sub-square and medians come
+    from the stored sketches, so decades of history are read as a few rows per tile and
+    month. Sub-square edges are moved to the nearest tile edge and ``end`` is rounded up
+    to the end of its month.
+
+    Returns:
+        tuple | None: As ``reduce_series``, or None when the stored aggregates cannot
+            answer for this grid.
+    """
+    edges = _stored_block(lats, lons, nbins)
+    if edges is None:
+        return None
+    a, b = edges
+    nperiods = len(periods.period_starts(start, end, interval))
+    next_month = (end.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+    cells = get_price_cells(db, aggregates.LEVEL, _block(a), _block(b), start, next_month)
+    key = _tile_cells(cells, a, b, nbins) * nperiods + periods.period_index(
+        cells["month"], start, interval
+    )
+    key = key.astype(np.int64)
+    size = nbins * nbins * nperiods
+    counts = np.bincount(key, weights=cells["n_sales"].to_numpy(), minlength=size)
+    sums = np.bincount(key, weights=cells["amount_sum"].to_numpy(), minlength=size)
+
+    stored = get_price_sketches(db, aggregates.LEVEL, _block(a), _block(b), start, next_month)
+    sketches = sketch.CellSketches(nbins, nperiods)
+    sketches.add(
+        _tile_cells(stored, a, b, nbins) * nperiods
+        + periods.period_index(stored["month"], start, interval),
+        stored["bucket"].to_numpy(),
+        stored["n_sales"].to_numpy(),
+    )
+
+    shape = (nbins * nbins, nperiods)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return (
+        counts.astype(np.int64).reshape(shape),
+        means.reshape(shape),
+        sketches.quantile(0.5).reshape(shape),
+    )
+
+
+def series_window(
+    bounds: PriceSeriesQuerySchema, today: datetime.date
+) -> tuple[datetime.date, datetime.date]:
+    """First and last day of a series, the first moved back to the start of its period
+    so that every period is whole."""
+    end = bounds.end or today
+    start = bounds.start or end - datetime.timedelta(days=365 * 5)
+    return periods.period_start(start, bounds.interval), end
+
+
+async def series_columns(
+    bounds: PriceSeriesQuerySchema, db: Session
+) -> tuple[list[datetime.date], dict[str, np.ndarray]]:
+    """Number of sales, mean and median price of every sub-square in every period, as
+    columns in ``grid.cell_index`` order.
+
+    Args:
+        bounds (PriceSeriesQuerySchema): Box, grid, date range and period length.
+        db (Session): Database session.
+
+    Returns:
+        tuple[list[datetime.date], dict[str, np.ndarray]]: First day of every period,
+            and the "n_sales", "mean" and "median" columns, each of shape
+            ``(nbins ** 2, nperiods)`` with NaN where there were no sales.
+    """
+    df = await get_frame_from_latlon_async(db, bounds)
+    lats = (bounds.min_lat, bounds.max_lat)
+    lons = (bounds.min_lon, bounds.max_lon)
+
+    now = datetime.datetime.today()
+    start, end = series_window(bounds, now.date())
+    starts = periods.period_starts(start, end, bounds.interval)
+    # Nothing is published before the Price Paid Data begins, so it is never fetched
+    with metrics.stage("refresh"):
+        await refresh_transactions(
+            db, list(df["full_postcode"].values), max(start, PRICE_PAID_START), now
+        )
+
+    loop = asyncio.get_running_loop()
+    reduced = None
+    if bounds.approximate:
+        with metrics.stage("sketches"):
+            reduced = await loop.run_in_executor(
+                None,
+                reduce_stored_series,
+                db, lats, lons, bounds.nbins, start, end, bounds.interval,
+            )
+    if reduced is None:
+        cells = pd.Series(
+            grid.cell_index(
+                df["latitude"].values, df["longitude"].values, lats, lons, bounds.nbins
+            ),
+            index=df["full_postcode"].values,
+        )
+        with metrics.stage("reduce"):
+            reduced = await loop.run_in_executor(
+                None, reduce_series, db, cells, start, end, bounds.interval, bounds.nbins
+            )
+    counts, means, medians = reduced
+    return starts, {"n_sales": counts, "mean": means, "median": medians}
+
+
+async def price_series(bounds: PriceSeriesQuerySchema, db: Session) -> list[PriceSeriesSchema]:
+    """Number of sales, mean and median price of every sub-square in every period.
+
+    Args:
+        bounds (PriceSeriesQuerySchema): Box, grid, date range and period length.
+        db (Session): Database session.
+
+    Returns:
+        list[PriceSeriesSchema]: Series of every sub-square.
+    """
+    starts, columns = await series_columns(bounds, db)
+    counts, means, medians = columns["n_sales"], columns["mean"], columns["median"]
+    lats = (bounds.min_lat, bounds.max_lat)
+    lons = (bounds.min_lon, bounds.max_lon)
+    sub_squares = await calculations.separate_by_size(lats, lons, bounds.nbins)
+
+    as_float = lambda v: None if np.isnan(v) else float(v)
+    return [
+        PriceSeriesSchema(
+            **square.model_dump(),
+            series=[
+                PricePointSchema(
+                    period=period,
+                    n_sales=int(counts[i, j]),
+                    mean=as_float(means[i, j]),
+                    median=as_float(medians[i, j]),
+                )
+                for j, period in enumerate(starts)
+            ],
+        )
+        for i, square in enumerate(sub_squares)
+    ]
+
+
 if __name__ == "__main__":
     # query_land_registry_data()
     query = QueryConstructor()
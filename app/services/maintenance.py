@@ -0,0 +1,101 @@
+"""Bulk postcode maintenance, e.g. the quarterly ONS postcode changes.
+
+The db is changed by ``crud.postcodes.apply_changes`` in one transaction. The in-memory
+structures built over the postcodes table are then brought up to date off the event
+loop: a small diff is merged into the columnar store and the prefix index with one copy
+of each, and into the k-d tree a postcode at a time, while a diff larger than
+``config.bulk.patch_limit`` rebuilds them from the db. Tile counts and cached responses
+are patched, or rebuilt from counts read off the loop, on the event loop, which owns them.
+"""
+
+import numpy as np
+import pandas as pd
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import config
+from app.crud.postcodes import apply_changes_async
+from app.db import columnar, nearest, prefix
+from app.schemas.postcodes import PostcodeChangesSchema, PostcodeChangesSummarySchema
+from app.services import cache, tiles
+
+# Kinds of change ``apply_changes`` classifies every postcode as
+_CHANGES = ("added", "moved", "unchanged", "deleted", "missing")
+
+
+def _removed_added(changes: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Rows leaving the structures at their old coordinates, and rows joining them."""
+    removed = changes[changes["change"].isin(["moved", "deleted"])]
+    removed = removed[["full_postcode", "old_latitude", "old_longitude"]].rename(
+        columns={"old_latitude": "latitude", "old_longitude": "longitude"}
+    )
+    added = changes[changes["change"].isin(["added", "moved"])]
+    return removed, added[["id", "full_postcode", "latitude", "longitude"]]
+
+
+def _patch(changes: pd.DataFrame) -> None:
+    """Merge the changed postcodes into the in-memory search structures."""
+    removed, added = _removed_added(changes)
+    columnar.store.patch(removed, added)
+    prefix.index.patch(list(removed["full_postcode"]), added)
+    for postcode in removed["full_postcode"]:
+        nearest.tree.remove(postcode)
+    for row in added.itertuples(index=False):
+        nearest.tree.add(int(row.id), row.full_postcode, row.latitude, row.longitude)
+
+
+def _patch_counts(changes: pd.DataFrame) -> None:
+    """Apply the changed postcodes to the tile counts and the response cache."""
+    removed, added = _removed_added(changes)
+    for delta, rows in ((-1, removed), (1, added)):
+        for lat, lon in zip(rows["latitude"], rows["longitude"]):
+            tiles.pyramid.add(lat, lon, delta)
+            cache.responses.invalidate(lat, lon)
+
+
+def _reload(db: Session) -> np.ndarray | None:
+    """Rebuild every loaded in-memory search structure from the db.
+
+    Returns:
+        np.ndarray | None: Deepest tile counts to rebuild the loaded pyramid from on
+            the event loop, None when it is not loaded.
+    """
+    if columnar.store.loaded:
+        columnar.load(db)
+    if nearest.tree.loaded:
+        nearest.load(db)
+    if prefix.index.loaded:
+        prefix.load(db)
+    return tiles.read_counts(db) if tiles.pyramid.loaded else None
+
+
+async def apply_changes(
+    changes: PostcodeChangesSchema, db: Session
+) -> PostcodeChangesSummarySchema:
+    """Apply, or with ``dry_run`` only count, a diff of postcodes.
+
+    Args:
+        changes (PostcodeChangesSchema): Upserted and deleted postcodes.
+        db (Session): Database session.
+
+    Returns:
+        PostcodeChangesSummarySchema: Number of postcodes affected by each change.
+    """
+    with metrics.stage("apply"):
+        result = await apply_changes_async(db, changes)
+    counts = result["change"].value_counts()
+    if not changes.dry_run:
+        changed = result[result["change"].isin(["added", "moved", "deleted"])]
+        with metrics.stage("reindex"):
+            if len(changed) > config.bulk.patch_limit:
+                finest = await run_in_threadpool(_reload, db)
+                if finest is not None:
+                    tiles.pyramid.build_from_counts(finest)
+                cache.responses.clear()
+            else:
+                await run_in_threadpool(_patch, changed)
+                _patch_counts(changed)
+    return PostcodeChangesSummarySchema(
+        **{change: int(counts.get(change, 0)) for change in _CHANGES}, dry_run=changes.dry_run
+    )
@@ -0,0 +1,79 @@
+"""Radius and nearest-postcode searches.
+
+Answered from the k-d tree in ``db.nearest`` when it is loaded. Otherwise the postcodes
+of the box around the search circle are read from the db and filtered by great-circle
+distance; a nearest search grows the circle until it holds enough postcodes, as every
+postcode nearer than the edge of the circle is then inside it.
+"""
+
+import math
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from app.const import EARTH_RADIUS_KM
+from app.core import metrics
+from app.crud.postcodes import get_frame_from_latlon_async
+from app.db.nearest import haversine_km, tree
+from app.schemas.postcodes import (
+    GeometricSchema,
+    NearbyPostcodeSchema,
+    NearestQuerySchema,
+    RadiusQuerySchema,
+)
+
+# Radii in km tried in turn by a nearest search without the tree; the last spans the UK
+_SEARCH_RADII_KM = (1.0, 4.0, 16.0, 64.0, 256.0, 2048.0)
+
+
+def circle_box(lat: float, lon: float, km: float) -> GeometricSchema:
+    """Smallest latitude/longitude box holding the circle of ``km`` around a point."""
+    dlat = math.degrees(km / EARTH_RADIUS_KM)
+    # Longitude degrees shrink towards the poles, where the box spans every longitude
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+    dlon = 180.0 if cos_lat < 1e-9 else min(math.degrees(km / EARTH_RADIUS_KM) / cos_lat, 180.0)
+    return GeometricSchema(
+        min_lat=lat - dlat, max_lat=lat + dlat, min_lon=lon - dlon, max_lon=lon + dlon
+    )
+
+
+async def _within(db: Session, lat: float, lon: float, km: float) -> pd.DataFrame:
+    """Postcodes within ``km`` of a point read from the db, with their distances."""
+    df = await get_frame_from_latlon_async(db, circle_box(lat, lon, km))
+    df = df.assign(distance_km=haversine_km(lat, lon, df["latitude"], df["longitude"]))
+    return df[df["distance_km"] <= km].sort_values("distance_km", kind="stable")
+
+
+def _schemas(df: pd.DataFrame) -> list[NearbyPostcodeSchema]:
+    return [
+        NearbyPostcodeSchema(
+            full_postcode=postcode, latitude=lat, longitude=lon, distance_km=distance
+        )
+        for postcode, lat, lon, distance in zip(
+            df["full_postcode"], df["latitude"], df["longitude"], df["distance_km"]
+        )
+    ]
+
+
+async def radius_search(query: RadiusQuerySchema, db: Session) -> list[NearbyPostcodeSchema]:
+    """Postcodes within ``radius_km`` of the point, nearest first."""
+    with metrics.stage("nearby"):
+        if tree.loaded:
+            df = tree.radius(query.lat, query.lon, query.radius_km, query.limit)
+        else:
+            df = (await _within(db, query.lat, query.lon, query.radius_km)).head(query.limit)
+    return _schemas(df)
+
+
+async def nearest_search(query: NearestQuerySchema, db: Session) -> list[NearbyPostcodeSchema]:
+    """The ``k`` postcodes nearest to the point, nearest first."""
+    with metrics.stage("nearby"):
+        if tree.loaded:
+            df = tree.nearest(query.lat, query.lon, query.k)
+        else:
+            for km in _SEARCH_RADII_KM:
+                df = await _within(db, query.lat, query.lon, km)
+                if len(df) >= query.k:
+                    break
+            df = df.head(query.k)
+    return _schemas(df)
@@ -0,0 +1,106 @@
+"""Process-pool backend for reducing the prices of large bounding boxes across cores.
+
+Reading and binning the transactions of a county-sized box is CPU-bound numpy and
+pandas work that holds the GIL, so threads do not help. With ``config.parallel.enabled``
+the grid is split into latitude bands of whole sub-squares and every worker reads and
+reduces the transactions of its band's postcodes through its own database connection,
+returning a ``grid.GridReducer`` or ``sketch.CellSketches``. The partial results are
+mergeable, so combining them is a sum of small per-cell arrays.
+
+Only prices are spread across the pool. Counting postcodes is a single ``bincount``
+over coordinates the parent has already read, cheaper than handing them to workers.
+
+Workers are spawned rather than forked, as the server process runs threads.
+"""
+
+import asyncio
+import datetime
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import config
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def workers() -> int:
+    return config.parallel.workers or os.cpu_count() or 1
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=workers(), mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown() -> None:
+    """Stop the worker processes, if any were started."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def _bands(n: int, nbands: int) -> list[tuple[int, int]]:
+    """Split ``range(n)`` into up to ``nbands`` contiguous, near-equal ranges."""
+    edges = np.linspace(0, n, min(nbands, n) + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+# Worker-local database engine, created on first use in each worker process
+_engine = None
+
+
+def _reduce_band(
+    dsn: str, cells: pd.Series, now: datetime.datetime, nbins: int, approximate: bool
+) -> tuple:
+    """Worker: two and five year price reducers for the postcodes of one band."""
+    global _engine
+    from sqlalchemy.orm import Session
+
+    from app.db.session import make_engine
+    from app.services.landregistry import reduce_prices
+
+    if _engine is None:
+        _engine = make_engine(dsn)
+    with Session(_engine) as db:
+        return reduce_prices(db, cells, now, nbins, approximate)
+
+
+async def reduce_prices(
+    cells: pd.Series, now: datetime.datetime, nbins: int, approximate: bool = False
+) -> tuple:
+    """As ``landregistry.reduce_prices``, over latitude bands of sub-squares in parallel.
+
+    Every band holds whole sub-squares, so the merged reducers are identical to those
+    of a single pass.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    cells = cells[cells.to_numpy() >= 0]
+    lat_bin = cells.to_numpy() % nbins
+    tasks = [
+        loop.run_in_executor(
+            pool,
+            _reduce_band,
+            config.database.dsn,
+            cells[(lat_bin >= lo) & (lat_bin < hi)],
+            now,
+            nbins,
+            approximate,
+        )
+        for lo, hi in _bands(nbins, workers())
+    ]
+    partials = await asyncio.gather(*tasks)
+    two_yr, five_yr = partials[0]
+    for other_two_yr, other_five_yr in partials[1:]:
+        two_yr.merge(other_two_yr)
+        five_yr.merge(other_five_yr)
+    return two_yr, five_yr
@@ -0,0 +1,52 @@
+"""Calendar periods that price series are bucketed into.
+
+Periods are whole months, quarters or years. A series starts at the period holding its
+start date, so every period is complete apart from the last one, and period ``i`` of a
+series is ``i`` periods after the first.
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Length of each kind of period in months
+MONTHS = {"month": 1, "quarter": 3, "year": 12}
+
+
+def _months(dates) -> np.ndarray:
+    """Months since year zero of each date."""
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    return dates.year.to_numpy() * 12 + dates.month.to_numpy() - 1
+
+
+def period_start(date: datetime.date, interval: str) -> datetime.date:
+    """First day of the period holding ``date``."""
+    step = MONTHS[interval]
+    month = (date.month - 1) // step * step + 1
+    return datetime.date(date.year, month, 1)
+
+
+def period_starts(start: datetime.date, end: datetime.date, interval: str) -> list[datetime.date]:
+    """First day of every period from the one holding ``start`` to the one holding ``end``."""
+    first = period_start(start, interval)
+    n = period_index([end], first, interval)[0] + 1
+    return [
+        datetime.date(year=m // 12, month=m % 12 + 1, day=1)
+        for m in _months([first])[0] + MONTHS[interval] * np.arange(n)
+    ]
+
+
+def period_index(dates, start: datetime.date, interval: str) -> np.ndarray:
+    """Period of each date, counted from the period holding ``start``.
+
+    Args:
+        dates: Dates, as anything ``pd.to_datetime`` accepts.
+        start (datetime.date): Start of the series.
+        interval (str): One of "month", "quarter" or "year".
+
+    Returns:
+        np.ndarray: Period of each date, negative for dates before the series.
+    """
+    first = _months([period_start(start, interval)])[0]
+    return np.floor_divide(_months(dates) - first, MONTHS[interval])
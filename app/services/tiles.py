@@ -0,0 +1,187 @@
+"""Precomputed quadtree tile pyramid of postcode counts over the UK.
+
+Level ``L`` of the pyramid splits the UK extent into ``2**L`` tiles along each side and
+holds the number of postcodes in every tile. A summed-area table per level turns the sum
+over any rectangle of tiles into four lookups, so a grid over any bounding box is
+answered in time that depends on ``nbins`` only, never on the number of postcodes in it.
+
+Grid cells rarely line up with tile edges, so each cell is given the tiles whose centres
+fall inside it. The pyramid is only consulted when a cell is at least
+``min_tiles_per_cell`` tiles across, which bounds the miscounted strip along each cell
+edge to half a tile.
+
+The deepest level is read from the ``postcode_cells`` aggregate when it is available, so
+loading touches one row per tile rather than one per postcode.
+"""
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.const import UK_LAT_BOUNDS, UK_LON_BOUNDS
+from app.core.config import config
+from app.crud.aggregates import get_postcode_cells
+from app.crud.postcodes import get_coordinates
+from app.db import aggregates
+
+
+class TilePyramid:
+    """Counts per quadtree tile at every level from 0 to ``max_level``.
+
+    ``counts[level][i, j]`` is the count for latitude row ``i`` and longitude column
+    ``j`` of that level.
+    """
+
+    def __init__(
+        self,
+        lat_bounds: tuple = UK_LAT_BOUNDS,
+        lon_bounds: tuple = UK_LON_BOUNDS,
+        max_level: int = 10,
+    ):
+        self.lat_bounds = lat_bounds
+        self.lon_bounds = lon_bounds
+        self.max_level = max_level
+        self.counts: list[np.ndarray] = []
+        # Summed-area tables, built lazily per level and dropped on every change
+        self._tables: dict[int, np.ndarray] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return len(self.counts) > 0
+
+    def _tile_size(self, level: int) -> tuple[float, float]:
+        n = 2**level
+        return (
+            (self.lat_bounds[1] - self.lat_bounds[0]) / n,
+            (self.lon_bounds[1] - self.lon_bounds[0]) / n,
+        )
+
+    def _tile(self, lats: np.ndarray, lons: np.ndarray, level: int) -> tuple:
+        """Row and column of the tile holding each point, and whether it is inside."""
+        tile_lat, tile_lon = self._tile_size(level)
+        rows = np.floor((np.asarray(lats, dtype=np.float64) - self.lat_bounds[0]) / tile_lat)
+        cols = np.floor((np.asarray(lons, dtype=np.float64) - self.lon_bounds[0]) / tile_lon)
+        n = 2**level
+        inside = (rows >= 0) & (rows < n) & (cols >= 0) & (cols < n)
+        return rows.astype(np.int64), cols.astype(np.int64), inside
+
+    def finest_counts(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Number of points in every tile of the deepest level."""
+        n = 2**self.max_level
+        rows, cols, inside = self._tile(lats, lons, self.max_level)
+        return np.bincount(rows[inside] * n + cols[inside], minlength=n * n).reshape(n, n)
+
+    def build(self, lats: np.ndarray, lons: np.ndarray) -> None:
+        """Count points into the deepest level and sum 2x2 blocks up to the root."""
+        self.build_from_counts(self.finest_counts(lats, lons))
+
+    def build_from_counts(self, finest: np.ndarray) -> None:
+        """Sum 2x2 blocks of the deepest level's counts up to the root."""
+        levels = [np.asarray(finest, dtype=np.int64)]
+        while levels[0].shape[0] > 1:
+            child = levels[0]
+            half = child.shape[0] // 2
+            levels.insert(0, child.reshape(half, 2, half, 2).sum(axis=(1, 3)))
+        self.counts = levels
+        self._tables.clear()
+
+    def add(self, lat: float, lon: float, delta: int = 1) -> None:
+        """Apply a single postcode insert (``delta=1``) or delete (``delta=-1``)."""
+        if not self.loaded:
+            return
+        for level, counts in enumerate(self.counts):
+            rows, cols, inside = self._tile([lat], [lon], level)
+            if inside[0]:
+                counts[rows[0], cols[0]] += delta
+        self._tables.clear()
+
+    def _table(self, level: int) -> np.ndarray:
+        """Summed-area table of a level, padded with a leading row and column of zeros."""
+        if level not in self._tables:
+            counts = self.counts[level]
+            table = np.zeros((counts.shape[0] + 1, counts.shape[1] + 1), dtype=np.int64)
+            table[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+            self._tables[level] = table
+        return self._tables[level]
+
+    def resolving_level(
+        self, lats: tuple, lons: tuple, nbins: int = 10, min_tiles_per_cell: int = 16
+    ) -> int | None:
+        """Coarsest level with at least ``min_tiles_per_cell`` tiles across every
+        sub-square, or None when the sub-squares are too small for the deepest level."""
+        cell_lat = (max(lats) - min(lats)) / nbins
+        cell_lon = (max(lons) - min(lons)) / nbins
+        for level in range(self.max_level + 1):
+            tile_lat, tile_lon = self._tile_size(level)
+            if (
+                cell_lat >= min_tiles_per_cell * tile_lat
+                and cell_lon >= min_tiles_per_cell * tile_lon
+            ):
+                return level
+        return None
+
+    def cell_edges(
+        self, lats: tuple, lons: tuple, nbins: int, level: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Tile row and column boundary nearest to every sub-square edge at a level.
+
+        Sub-square ``i`` along the latitude takes tile rows ``a[i]`` to ``a[i + 1] - 1``,
+        and likewise for columns with ``b``.
+        """
+        n = 2**level
+        tile_lat, tile_lon = self._tile_size(level)
+        lat_edges = min(lats) + (max(lats) - min(lats)) / nbins * np.arange(nbins + 1)
+        lon_edges = min(lons) + (max(lons) - min(lons)) / nbins * np.arange(nbins + 1)
+        a = np.clip(np.rint((lat_edges - self.lat_bounds[0]) / tile_lat), 0, n).astype(int)
+        b = np.clip(np.rint((lon_edges - self.lon_bounds[0]) / tile_lon), 0, n).astype(int)
+        return a, b
+
+    def grid_counts(
+        self, lats: tuple, lons: tuple, nbins: int = 10, min_tiles_per_cell: int = 16
+    ) -> np.ndarray | None:
+        """Postcode count in every sub-square of the box, summed from tiles.
+
+        Args:
+            lats (tuple): Maximum and minimum latitudes.
+            lons (tuple): Maximum and minimum longitudes.
+            nbins (int): Number of sub-squares along each side.
+            min_tiles_per_cell (int): Coarsest acceptable tiling of each sub-square.
+
+        Returns:
+            np.ndarray | None: Count per cell in ``grid.cell_index`` order, or None when
+                the sub-squares are too small for even the deepest level.
+        """
+        level = self.resolving_level(lats, lons, nbins, min_tiles_per_cell)
+        if level is None:
+            return None
+        a, b = self.cell_edges(lats, lons, nbins, level)
+
+        table = self._table(level)
+        sums = (
+            table[np.ix_(a[1:], b[1:])]
+            - table[np.ix_(a[:-1], b[1:])]
+            - table[np.ix_(a[1:], b[:-1])]
+            + table[np.ix_(a[:-1], b[:-1])]
+        )
+        # sums is indexed [lat_bin, lon_bin]; cells are numbered longitude-major
+        return sums.T.ravel()
+
+
+pyramid = TilePyramid(max_level=config.tiles.max_level)
+
+
+def read_counts(db: Session) -> np.ndarray:
+    """Postcodes in every tile of the deepest level, from the tile aggregates or from
+    every postcode in the db, for ``pyramid.build_from_counts``."""
+    if aggregates.enabled and aggregates.LEVEL == pyramid.max_level:
+        n = 2**pyramid.max_level
+        cells = get_postcode_cells(db, pyramid.max_level)
+        finest = np.zeros((n, n), dtype=np.int64)
+        finest[cells["row"].values, cells["col"].values] = cells["n_postcodes"].values
+        return finest
+    df = get_coordinates(db)
+    return pyramid.finest_counts(df["latitude"].values, df["longitude"].values)
+
+
+def load(db: Session) -> None:
+    """Build the pyramid from the tile aggregates, or from every postcode in the db."""
+    pyramid.build_from_counts(read_counts(db))
@@ -0,0 +1,112 @@
+"""Benchmark bounding-box postcode lookups with and without the R*Tree index.
+
+Builds a synthetic gazetteer in a temporary SQLite database, then times
+``crud.postcodes.get_frame_from_latlon`` for boxes of several sizes, first with plain
+range predicates (a full scan) and then through the R*Tree. The R*Tree is forced for
+every box so the output shows the size above which a scan wins, which is what
+``config.database.rtree_max_area`` should be set to.
+
+    python -m benchmarks.bbox_index --rows 1700000 --repeat 5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.core.config import config
+from app.const import UK_LAT_BOUNDS, UK_LON_BOUNDS
+from app.crud.postcodes import get_frame_from_latlon
+from app.db import spatial
+from app.db.base import Base
+from app.schemas.postcodes import GeometricSchema
+
+# Half-widths in degrees of the boxes queried around the centre point
+BOX_SIZES = [0.005, 0.02, 0.1, 0.5, 2.0]
+CENTRE = (51.5, -0.12)
+
+
+def populate(engine, n_rows: int, seed: int = 0) -> None:
+    """Fill the postcodes table with points clustered around a few city centres."""
+    rng = np.random.default_rng(seed)
+    centres = np.array([CENTRE, (53.48, -2.24), (52.48, -1.9), (55.95, -3.19)])
+    which = rng.integers(0, len(centres), n_rows)
+    lats = rng.normal(centres[which, 0], 0.6)
+    lons = rng.normal(centres[which, 1], 0.6)
+    lats = np.clip(lats, *UK_LAT_BOUNDS)
+    lons = np.clip(lons, *UK_LON_BOUNDS)
+    rows = [
+        {
+            "full_postcode": f"B{i // 10000} {i % 10000:04d}",
+            "district_postcode": "B",
+            "subarea_postcode": f"B{i // 10000}",
+            "latitude": float(lat),
+            "longitude": float(lon),
+        }
+        for i, (lat, lon) in enumerate(zip(lats, lons))
+    ]
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """INSERT INTO postcodes
+                   (full_postcode, district_postcode, subarea_postcode, latitude, longitude)
+                   VALUES (:full_postcode, :district_postcode, :subarea_postcode,
+                           :latitude, :longitude)"""
+            ),
+            rows,
+        )
+
+
+def time_boxes(engine, repeat: int) -> dict[float, tuple[float, int]]:
+    """Best-of-``repeat`` seconds and row count for each box size."""
+    results = {}
+    with Session(engine) as db:
+        for half in BOX_SIZES:
+            bounds = GeometricSchema(
+                min_lat=CENTRE[0] - half,
+                max_lat=CENTRE[0] + half,
+                min_lon=CENTRE[1] - half,
+                max_lon=CENTRE[1] + half,
+            )
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                df = get_frame_from_latlon(db, bounds)
+                best = min(best, time.perf_counter() - start)
+            results[half] = (best, len(df))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500_000, help="synthetic postcodes")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per box, best kept")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'postcodes.db')}")
+        Base.metadata.create_all(bind=engine)
+        populate(engine, args.rows)
+
+        spatial.enabled = False
+        before = time_boxes(engine, args.repeat)
+        spatial.create_spatial_index(engine)
+        # Force the R*Tree for every box to show where the crossover lies
+        config.database.rtree_max_area = float("inf")
+        after = time_boxes(engine, args.repeat)
+
+    print(f"{'box (deg)':>10} {'rows':>9} {'scan (ms)':>10} {'rtree (ms)':>11} {'speedup':>8}")
+    for half in BOX_SIZES:
+        (t_scan, n), (t_rtree, _) = before[half], after[half]
+        print(
+            f"{2 * half:>10.3f} {n:>9d} {t_scan * 1e3:>10.2f} {t_rtree * 1e3:>11.2f}"
+            f" {t_scan / t_rtree:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
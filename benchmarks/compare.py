@@ -0,0 +1,59 @@
+"""Compare two result files of ``benchmarks.run``.
+
+Cases are matched on route, box size, grid resolution and concurrency. The median
+latency and throughput of each are printed side by side with their ratio, and the
+exit status is 1 if any case's median latency grew by more than ``--threshold``, so
+the comparison can gate a CI job.
+
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+KEY = ("route", "half_width", "nbins", "concurrency")
+
+
+def load(path: str) -> tuple[dict, dict]:
+    with open(path) as f:
+        data = json.load(f)
+    return data["meta"], {tuple(case[k] for k in KEY): case for case in data["results"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="largest tolerated p50 slowdown"
+    )
+    args = parser.parse_args()
+
+    before_meta, before = load(args.before)
+    after_meta, after = load(args.after)
+    print(f"before {before_meta.get('commit')}  after {after_meta.get('commit')}")
+    print(
+        f"{'route':>15} {'box':>6} {'nbins':>5} {'conc':>4}"
+        f" {'p50 before':>11} {'p50 after':>10} {'ratio':>6} {'req/s ratio':>11}"
+    )
+    regressions = 0
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        ratio = new["p50_ms"] / old["p50_ms"]
+        flag = ""
+        if ratio > 1 + args.threshold:
+            regressions += 1
+            flag = "  slower"
+        print(
+            f"{key[0]:>15} {key[1]:>6} {key[2]:>5} {key[3]:>4}"
+            f" {old['p50_ms']:>11.1f} {new['p50_ms']:>10.1f} {ratio:>6.2f}"
+            f" {new['throughput_rps'] / old['throughput_rps']:>11.2f}{flag}"
+        )
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"only in {'before' if key in before else 'after'}: {key}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
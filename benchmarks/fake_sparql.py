@@ -0,0 +1,174 @@
+"""Local stand-in for the HM Land Registry SPARQL endpoint.
+
+Answers the price paid queries built by ``landregistry.QueryConstructor`` with CSV in
+the shape of the real endpoint: the postcodes are read from the ``VALUES`` clause and
+the window from the date ``FILTER``, and every postcode gets a deterministic handful of
+sales in that window, so repeated runs fetch identical data. Responses are delayed by a
+fixed latency plus a per-postcode cost to mimic the real service under load.
+
+    python -m benchmarks.fake_sparql --port 8765 --latency 0.3
+"""
+
+import argparse
+import datetime
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+COLUMNS = [
+    "propertyaddress", "postcode", "transx", "amount", "date", "propertytype",
+    "estatetype", "category", "newbuild", "paon", "saon", "street", "town", "district",
+    "county",
+]
+PROPERTY_TYPES = ["detached", "semi-detached", "terraced", "flat-maisonette"]
+ESTATE_TYPES = ["freehold", "leasehold"]
+COMMON = "http://landregistry.data.gov.uk/def/common/"
+DATA = "http://landregistry.data.gov.uk/data/ppi/"
+
+_POSTCODES = re.compile(r"VALUES \?postcode \{(.*?)\^\^xsd:string\}", re.S)
+_AFTER = re.compile(r"\?date > '(\d{4}-\d{2}-\d{2})'")
+_BEFORE = re.compile(r"\?date < '(\d{4}-\d{2}-\d{2})'")
+
+
+def sales_csv(
+    postcodes: list[str], start: datetime.date, end: datetime.date, sales_per_year: float
+) -> str:
+    """CSV rows of the sales of every postcode between two dates, header included."""
+    rows = [",".join(COLUMNS)]
+    today = datetime.date.today()
+    for postcode in postcodes:
+        # Seeded by the postcode alone, so a sale is the same whichever batch asks for it
+        rng = np.random.default_rng(zlib.crc32(postcode.encode()))
+        # Thirty years of history, of which the query's window keeps a slice
+        n = rng.poisson(sales_per_year * 30)
+        offsets = rng.integers(1, 30 * 366, n)
+        amounts = np.round(np.exp(rng.normal(12.4, 0.55, n)), -2).astype(int)
+        kinds = rng.integers(0, len(PROPERTY_TYPES), n)
+        for k in range(n):
+            date = today - datetime.timedelta(days=int(offsets[k]))
+            if not start < date < end:
+                continue
+            uid = f"{zlib.crc32(f'{postcode}{k}'.encode()):08X}-0000-0000-0000-{k:012d}"
+            rows.append(
+                ",".join(
+                    [
+                        f"{DATA}address/{uid}",
+                        postcode,
+                        f"{DATA}transaction/{uid}/current",
+                        str(amounts[k]),
+                        date.isoformat(),
+                        COMMON + PROPERTY_TYPES[kinds[k]],
+                        COMMON + ESTATE_TYPES[int(kinds[k] == 3)],
+                        "Standard price paid transaction",
+                        "false",
+                        str(k + 1),
+                        "",
+                        "HIGH STREET",
+                        "TOWN",
+                        "DISTRICT",
+                        "COUNTY",
+                    ]
+                )
+            )
+    return "\n".join(rows) + "\n"
+
+
+class FakeSparqlServer:
+    """Threaded HTTP server answering price paid queries.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port.
+        latency (float): Seconds added to every response.
+        latency_per_postcode (float): Seconds added per postcode in the query.
+        sales_per_year (float): Mean number of sales per postcode and year.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        latency_per_postcode: float = 0.0,
+        sales_per_year: float = 0.2,
+    ):
+        self.latency = latency
+        self.latency_per_postcode = latency_per_postcode
+        self.sales_per_year = sales_per_year
+        self.queries = 0
+        self.postcodes = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/landregistry/sparql"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                query = urllib.parse.parse_qs(body).get("query", [""])[0]
+                values = _POSTCODES.search(query)
+                postcodes = re.findall(r"'([^']+)'", values.group(1)) if values else []
+                after, before = _AFTER.search(query), _BEFORE.search(query)
+                start = (
+                    datetime.date.fromisoformat(after.group(1)) if after else datetime.date.min
+                )
+                end = datetime.date.fromisoformat(before.group(1)) if before else datetime.date.max
+                with server._lock:
+                    server.queries += 1
+                    server.postcodes += len(postcodes)
+
+                time.sleep(server.latency + server.latency_per_postcode * len(postcodes))
+                payload = sales_csv(postcodes, start, end, server.sales_per_year).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> str:
+        """Serve on a background thread and return the endpoint URL."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per query")
+    parser.add_argument(
+        "--latency-per-postcode", type=float, default=0.002, help="seconds per postcode"
+    )
+    parser.add_argument("--sales-per-year", type=float, default=0.2)
+    args = parser.parse_args()
+    server = FakeSparqlServer(
+        args.port, args.latency, args.latency_per_postcode, args.sales_per_year
+    )
+    print(server.start())
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark the process-pool backend against the serial path as workers are added.
+
+Reducing ``--sales`` transactions per postcode for ``--postcodes`` postcodes from a
+temporary SQLite database is timed on synthetic data, serially with
+``landregistry.reduce_prices`` and across the pool with ``parallel.reduce_prices``.
+Any speedup needs as many cores as workers.
+
+The pool is restarted for every worker count and warmed up before timing, so the
+figures exclude process start-up.
+
+    python -m benchmarks.parallel_scaling --workers 1 2 4 8 --repeat 3
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.core.config import config
+from app.db.base import Base
+from app.models.transactions import Transactions
+from app.services import grid, landregistry, parallel
+from benchmarks.bbox_index import populate
+
+LAT_BOUNDS = (50.0, 56.0)
+LON_BOUNDS = (-4.0, 1.0)
+
+
+def best_of(repeat: int, run) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def populate_sales(engine, n_postcodes: int, sales: int, seed: int = 0) -> pd.Series:
+    """Postcodes with ``sales`` transactions each over the last five years.
+
+    Returns:
+        pd.Series: Cell of every postcode in the benchmark grid, indexed by postcode.
+    """
+    populate(engine, n_postcodes, seed)
+    rng = np.random.default_rng(seed)
+    with engine.connect() as conn:
+        df = pd.read_sql(text("SELECT full_postcode, latitude, longitude FROM postcodes"), conn)
+    n = len(df) * sales
+    today = datetime.date.today()
+    frame = pd.DataFrame(
+        {
+            "transaction_id": [f"T{i}" for i in range(n)],
+            "postcode": np.repeat(df["full_postcode"].values, sales),
+            "date": [today - datetime.timedelta(days=int(d)) for d in rng.integers(1, 1800, n)],
+            "amount": (np.exp(rng.normal(12.4, 0.6, n)) // 500 * 500).astype(int),
+        }
+    )
+    with engine.begin() as conn:
+        conn.execute(Transactions.__table__.insert(), frame.to_dict("records"))
+    return df.set_index("full_postcode")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--postcodes", type=int, default=50_000, help="postcodes with sales")
+    parser.add_argument("--sales", type=int, default=10, help="sales per postcode")
+    parser.add_argument("--nbins", type=int, default=64, help="sub-squares per side")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, best kept")
+    args = parser.parse_args()
+
+    now = datetime.datetime.today()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dsn = f"sqlite:///{os.path.join(tmp, 'prices.db')}"
+        config.database.dsn = dsn
+        engine = create_engine(dsn)
+        Base.metadata.create_all(bind=engine)
+        coords = populate_sales(engine, args.postcodes, args.sales)
+        cells = pd.Series(
+            grid.cell_index(
+                coords["latitude"].values,
+                coords["longitude"].values,
+                LAT_BOUNDS,
+                LON_BOUNDS,
+                args.nbins,
+            ),
+            index=coords.index,
+        )
+
+        def serial_prices():
+            with Session(engine) as db:
+                landregistry.reduce_prices(db, cells, now, args.nbins)
+
+        results = {"prices": {0: best_of(args.repeat, serial_prices)}}
+
+        for n_workers in args.workers:
+            parallel.shutdown()
+            config.parallel.workers = n_workers
+            prices = lambda: asyncio.run(parallel.reduce_prices(cells, now, args.nbins))
+            # Start the workers and import the app in them before timing
+            prices()
+            results["prices"][n_workers] = best_of(args.repeat, prices)
+        parallel.shutdown()
+
+    print(f"{'workload':>9} {'workers':>8} {'time (ms)':>10} {'speedup':>8}")
+    for workload, timings in results.items():
+        for n_workers, seconds in timings.items():
+            label = "serial" if n_workers == 0 else str(n_workers)
+            print(
+                f"{workload:>9} {label:>8} {seconds * 1e3:>10.1f}"
+                f" {timings[0] / seconds:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""End-to-end benchmark of the ``/search`` routes.
+
+Builds a synthetic gazetteer with ``benchmarks.synthetic`` (or reuses ``--db``), points
+the Land Registry client at a ``benchmarks.fake_sparql`` server, and drives the app
+in-process through an ASGI client, so the figures cover routing, validation, database
+access, aggregation and serialisation but no network stack.
+
+Every route is run over a matrix of box sizes around central London, grid resolutions
+and concurrency levels. For each case the first request is timed on its own as the cold
+latency (for the price routes it includes fetching from the fake endpoint), then
+``--requests`` requests are timed at the given concurrency. The peak Python allocation
+of a single request is measured on a separate, traced pass.
+
+Results are written as JSON for ``benchmarks.compare``:
+
+    python -m benchmarks.run --rows 1700000 --out before.json
+    python -m benchmarks.run --db /tmp/bench.db --out after.json
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.const import URL_SEARCH
+from app.core.config import config
+from benchmarks.fake_sparql import FakeSparqlServer
+from benchmarks.synthetic import make_database
+
+CENTRE = (51.507, -0.128)
+# Half-widths in degrees of the boxes around the centre, from a street to a region
+BOX_SIZES = [0.005, 0.05, 0.25, 1.0]
+NBINS = [10, 50]
+CONCURRENCY = [1, 8]
+# Price routes query the Land Registry per postcode, so stay below county size
+ROUTES = {
+    "npostcodes": BOX_SIZES,
+    "subsquares": BOX_SIZES,
+    "average_prices": BOX_SIZES[:3],
+    "price_series": BOX_SIZES[:3],
+}
+
+
+def params(half_width: float, nbins: int) -> dict:
+    lat, lon = CENTRE
+    return {
+        "min_lat": lat - half_width,
+        "max_lat": lat + half_width,
+        # Square on the ground rather than in degrees
+        "min_lon": lon - half_width / 0.62,
+        "max_lon": lon + half_width / 0.62,
+        "nbins": nbins,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def timed(client, url: str, query: dict) -> tuple[float, bool]:
+    start = time.perf_counter()
+    response = await client.get(url, params=query)
+    return time.perf_counter() - start, response.status_code == 200
+
+
+async def run_case(client, route: str, query: dict, requests: int, concurrency: int) -> dict:
+    """Latency, throughput and memory of one route, box and concurrency level."""
+    url = f"/{URL_SEARCH}/{route}"
+    cold, _ = await timed(client, url, query)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await timed(client, url, query)
+
+    start = time.perf_counter()
+    timings = await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - start
+    latencies = np.array([t for t, _ in timings]) * 1e3
+
+    tracemalloc.start()
+    await timed(client, url, query)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "cold_ms": cold * 1e3,
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "throughput_rps": requests / wall,
+        "errors": sum(not ok for _, ok in timings),
+        "peak_alloc_mb": peak / 2**20,
+    }
+
+
+async def run_all(args) -> list[dict]:
+    # Imported once the database and endpoint are configured, as the session factory
+    # binds its engine on import
+    import httpx
+
+    from app.main import app
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as client:
+            for route, sizes in ROUTES.items():
+                if args.routes and route not in args.routes:
+                    continue
+                for half_width in sizes:
+                    for nbins in args.nbins:
+                        for concurrency in args.concurrency:
+                            case = {
+                                "route": route,
+                                "half_width": half_width,
+                                "nbins": nbins,
+                                "concurrency": concurrency,
+                                "requests": args.requests,
+                            }
+                            case.update(
+                                await run_case(
+                                    client,
+                                    route,
+                                    params(half_width, nbins),
+                                    args.requests,
+                                    concurrency,
+                                )
+                            )
+                            print(
+                                f"{route:>15} {half_width:>6} {nbins:>4} {concurrency:>3}"
+                                f" p50 {case['p50_ms']:>9.1f} ms"
+                                f" {case['throughput_rps']:>8.1f} req/s"
+                            )
+                            results.append(case)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="existing database to reuse instead of generating one")
+    parser.add_argument("--rows", type=int, default=200_000, help="synthetic postcodes")
+    parser.add_argument("--routes", nargs="+", choices=list(ROUTES), help="default all")
+    parser.add_argument("--nbins", type=int, nargs="+", default=NBINS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=20, help="timed requests per case")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake SPARQL seconds per query")
+    parser.add_argument(
+        "--latency-per-postcode", type=float, default=0.002, help="fake SPARQL seconds per postcode"
+    )
+    parser.add_argument("--out", default="benchmark.json", help="JSON results file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "bench.db")
+        if not args.db:
+            make_database(path, args.rows)
+        config.database.dsn = f"sqlite:///{path}"
+        # Measure the routes themselves rather than the response cache
+        config.cache.enabled = False
+
+        server = FakeSparqlServer(
+            latency=args.latency, latency_per_postcode=args.latency_per_postcode
+        )
+        config.landregistry.endpoint = server.start()
+        try:
+            results = asyncio.run(run_all(args))
+        finally:
+            server.stop()
+
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "sparql_queries": server.queries,
+        # Kilobytes on Linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "config": {
+            "store": config.store.enabled,
+            "tiles": config.tiles.enabled,
+            "parallel": config.parallel.enabled,
+        },
+    }
+    with open(args.out, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Wrote {len(results)} cases to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Synthetic UK-scale postcode gazetteer.
+
+Postcodes are scattered around the larger UK towns, weighted by population, so boxes
+over cities are dense and boxes over the countryside sparse, roughly as in the real
+gazetteer of ~1.7M postcodes. Each town gets its own postcode area and every postcode
+is unique and in the ``AA9 9AA`` shape, so district and subarea columns behave as with
+real data.
+
+The database is written with ``gazetteer.bulk_load``, as a full gazetteer would be.
+
+    python -m benchmarks.synthetic data/bench.db --rows 1700000
+"""
+
+import argparse
+import string
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from app.const import UK_LAT_BOUNDS, UK_LON_BOUNDS
+from app.db.base import Base
+from app.models import aggregates, postcodes, transactions  # noqa: F401, registers the tables
+from app.services import gazetteer
+
+# Postcode area, latitude, longitude and relative weight of a town
+TOWNS = [
+    ("LN", 51.507, -0.128, 9.0),
+    ("BM", 52.486, -1.890, 2.9),
+    ("MA", 53.480, -2.242, 2.8),
+    ("LS", 53.801, -1.549, 1.9),
+    ("GL", 55.864, -4.252, 1.7),
+    ("LV", 53.408, -2.992, 1.4),
+    ("NE", 54.978, -1.618, 1.1),
+    ("SH", 53.381, -1.470, 1.1),
+    ("BS", 51.455, -2.588, 1.0),
+    ("EH", 55.953, -3.189, 0.9),
+    ("CF", 51.482, -3.179, 0.8),
+    ("NG", 52.954, -1.158, 0.8),
+    ("LE", 52.637, -1.140, 0.7),
+    ("SO", 50.910, -1.404, 0.9),
+    ("BT", 54.597, -5.930, 0.7),
+    ("AB", 57.149, -2.094, 0.4),
+    ("PL", 50.375, -4.143, 0.4),
+    ("NR", 52.630, 1.297, 0.4),
+    ("IV", 57.478, -4.225, 0.2),
+    ("TR", 50.263, -5.051, 0.2),
+]
+# Share of postcodes scattered uniformly over the countryside
+RURAL_SHARE = 0.15
+# Spread in degrees of the postcodes around a town centre
+TOWN_SPREAD = 0.12
+
+_LETTERS = np.array(list(string.ascii_uppercase))
+
+
+def postcodes_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Postcode, latitude and longitude of ``n_rows`` synthetic postcodes.
+
+    Returns:
+        pd.DataFrame: Rows with the columns returned by ``gazetteer.read_gazetteer``.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.array([town[3] for town in TOWNS])
+    n_rural = int(n_rows * RURAL_SHARE)
+    which = rng.choice(len(TOWNS), n_rows - n_rural, p=weights / weights.sum())
+
+    centres = np.array([(town[1], town[2]) for town in TOWNS])
+    lats = np.concatenate(
+        [rng.normal(centres[which, 0], TOWN_SPREAD), rng.uniform(*UK_LAT_BOUNDS, n_rural)]
+    )
+    # A degree of longitude is ~0.6 of a degree of latitude across the UK
+    lons = np.concatenate(
+        [
+            rng.normal(centres[which, 1], TOWN_SPREAD / 0.6),
+            rng.uniform(*UK_LON_BOUNDS, n_rural),
+        ]
+    )
+    lats = np.clip(lats, UK_LAT_BOUNDS[0], np.nextafter(UK_LAT_BOUNDS[1], 0))
+    lons = np.clip(lons, UK_LON_BOUNDS[0], np.nextafter(UK_LON_BOUNDS[1], 0))
+
+    # Rural postcodes borrow the area of the nearest town
+    rural_lats, rural_lons = lats[len(which) :, None], lons[len(which) :, None]
+    distance = (rural_lats - centres[:, 0]) ** 2 + (rural_lons - centres[:, 1]) ** 2
+    nearest = distance.argmin(axis=1)
+    which = np.concatenate([which, nearest])
+    areas = np.array([town[0] for town in TOWNS])[which]
+
+    # Number the postcodes within each area: district, sector, then two unit letters
+    order = pd.Series(np.arange(n_rows)).groupby(areas).cumcount().to_numpy()
+    district = order // (10 * 26 * 26) + 1
+    sector = order // (26 * 26) % 10
+    unit = _LETTERS[order // 26 % 26].astype(object) + _LETTERS[order % 26]
+    postcode = (
+        pd.Series(areas, dtype=object)
+        + pd.Series(district).astype(str)
+        + " "
+        + pd.Series(sector).astype(str)
+        + pd.Series(unit)
+    )
+    outward = postcode.str.split(" ", n=1).str[0]
+    return pd.DataFrame(
+        {
+            "full_postcode": postcode,
+            "district_postcode": outward.str[:2],
+            "subarea_postcode": outward,
+            "latitude": lats,
+            "longitude": lons,
+        }
+    )
+
+
+def make_database(path: str, n_rows: int, seed: int = 0) -> int:
+    """Create every table of the app in a SQLite file and bulk load synthetic postcodes.
+
+    Returns:
+        int: Number of postcodes loaded.
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    return gazetteer.bulk_load(path, postcodes_frame(n_rows, seed))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="SQLite database file to create")
+    parser.add_argument("--rows", type=int, default=1_700_000, help="synthetic postcodes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(make_database(args.path, args.rows, args.seed))
+
+
+if __name__ == "__main__":
+    main()